@@ -0,0 +1,108 @@
+"""
+CPU-bound attachment processing, run in a ProcessPoolExecutor by server.py.
+
+Pure functions of the attachment bytes (no database access), so they can be
+pickled to child processes. process_attachment() returns the derived data that
+is stored next to the blob: sniffed MIME type, a JPEG thumbnail and a
+recompressed copy for images, and a text preview for logs and other text.
+"""
+
+import io
+
+THUMBNAIL_SIZE = (320, 320)
+OPTIMIZED_MAX_SIZE = (2048, 2048)
+OPTIMIZED_QUALITY = 82
+OPTIMIZED_MIN_SAVING = 0.10  # keep the recompressed copy only if it is at least 10% smaller
+TEXT_PREVIEW_CHARS = 4000
+MAX_IMAGE_PIXELS = 64_000_000  # larger images are rejected instead of decoded
+
+# (offset, signature, mime type)
+SIGNATURES = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"BM", "image/bmp"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+]
+IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/bmp", "image/webp"}
+
+
+def sniff_mime(content: bytes) -> str:
+    """MIME type from the content itself; the filename and the client are not trusted"""
+    for offset, signature, mime in SIGNATURES:
+        if content[offset:offset + len(signature)] == signature:
+            return mime
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if looks_like_text(content):
+        return "text/plain"
+    return "application/octet-stream"
+
+
+def looks_like_text(content: bytes) -> bool:
+    sample = content[:8192]
+    if b"\x00" in sample:
+        return False
+    try:
+        sample.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        # A multi-byte character cut at the end of the sample is still text
+        if exc.start < len(sample) - 3:
+            return False
+    return True
+
+
+def extract_text(content: bytes) -> str:
+    """First TEXT_PREVIEW_CHARS characters of a text attachment (logs, configs)"""
+    text = content[:TEXT_PREVIEW_CHARS * 4].decode("utf-8", errors="replace")
+    return text[:TEXT_PREVIEW_CHARS]
+
+
+def encode_jpeg(image, quality: int) -> bytes:
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+    return out.getvalue()
+
+
+def process_image(content: bytes, mime: str) -> dict:
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        result = {"width": image.width, "height": image.height}
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail(THUMBNAIL_SIZE)
+        result["thumbnail"] = encode_jpeg(thumbnail, 75)
+
+        # Animated GIFs would lose their frames, so they are never recompressed
+        if not getattr(image, "is_animated", False):
+            optimized = image.copy()
+            optimized.thumbnail(OPTIMIZED_MAX_SIZE)
+            if mime == "image/png" and optimized.mode in ("RGBA", "LA", "P"):
+                out = io.BytesIO()
+                optimized.save(out, format="PNG", optimize=True)
+                data, optimized_mime = out.getvalue(), "image/png"
+            else:
+                data, optimized_mime = encode_jpeg(optimized, OPTIMIZED_QUALITY), "image/jpeg"
+            if len(data) <= len(content) * (1 - OPTIMIZED_MIN_SAVING):
+                result["optimized"] = data
+                result["optimized_mime_type"] = optimized_mime
+    return result
+
+
+def process_attachment(content: bytes) -> dict:
+    """Derived data for one blob; raises on content that claims to be an image but does not decode"""
+    mime = sniff_mime(content)
+    result = {"mime_type": mime}
+    if mime in IMAGE_TYPES:
+        result.update(process_image(content, mime))
+    elif mime == "text/plain":
+        result["text_preview"] = extract_text(content)
+    return result
@@ -0,0 +1,13 @@
+"""
+bcrypt hashing for bulk user provisioning, run in a ProcessPoolExecutor by server.py.
+
+A pure function of the passwords, so it can be pickled to child processes without
+importing the server (and its database client) there. Hashes use the same format
+and cost as server.hash_password, so provisioned users log in like registered ones.
+"""
+
+
+def hash_passwords(passwords: list) -> list:
+    import bcrypt
+
+    return [bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8") for password in passwords]
@@ -0,0 +1,70 @@
+"""
+Bulk user provisioning from a CSV (header row first) or NDJSON file, with the same
+pipeline as POST /api/users/bulk: rows are streamed from the file, passwords are
+hashed on a process pool and users are inserted with unordered insert_many, the
+unique email index rejecting addresses that already exist.
+
+    python provision_users.py empleados.csv
+    python provision_users.py empleados.ndjson --workers 8 --batch-size 2000
+
+Prints the report (created, failed rows with their line, users per second) as JSON
+and exits with 1 when any row failed.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+
+import server
+
+FORMATS = {"csv": server.csv_records, "ndjson": server.ndjson_records}
+EXTENSIONS = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}
+
+
+async def file_lines(path):
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        for number, line in enumerate(f, 1):
+            yield number, line.rstrip("\r\n")
+
+
+async def provision(path, parser):
+    await server.ensure_indexes()  # the unique email index is what rejects duplicates
+    if not await server.email_index_ready():
+        sys.exit("users.email unique index missing (see the setup log for duplicate emails)")
+    try:
+        return await server.provision_users(parser(file_lines(path)))
+    finally:
+        server.shutdown_password_pool()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create TechAssist users in bulk")
+    parser.add_argument("path", help="CSV or NDJSON file with email,name,password[,role,phone,department_id]")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="Default: from the file extension")
+    parser.add_argument("--workers", type=int, help="Password hashing processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, help=f"Users per insert_many (default: {server.USER_PROVISION_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    file_format = args.format or EXTENSIONS.get(os.path.splitext(args.path)[1].lower())
+    if file_format is None:
+        parser.error("cannot tell the format from the extension, use --format")
+    if args.workers:
+        server.PASSWORD_HASH_WORKERS = args.workers
+    if args.batch_size:
+        server.USER_PROVISION_BATCH_SIZE = args.batch_size
+
+    try:
+        report = asyncio.run(provision(args.path, FORMATS[file_format]))
+    finally:
+        server.client.close()
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    logging.info(f"{report['created']} users created, {report['failed']} rows failed, "
+                 f"{report['users_per_second']} users/s")
+    return 1 if report['failed'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,26 +1,522 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Response, Request, status
+from fastapi.responses import JSONResponse
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import DeleteOne, ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import bson
 import os
+import base64
+import bisect
+import csv
+import json
 import logging
+import time
+import asyncio
+import atexit
+import contextvars
+import functools
+import hashlib
+import heapq
+import threading
+import math
+import multiprocessing
+import queue
+import urllib.parse
+import weakref
+from collections import Counter, OrderedDict
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
+from typing import Dict, List, Optional
 import uuid
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone, timedelta
-import bcrypt
 import jwt
-from apscheduler.schedulers.background import BackgroundScheduler
-import requests
+
+import attachment_processing
+import password_hashing
+
+# bcrypt, requests and apscheduler are imported where they are used: they are
+# only needed by password checks, Google OAuth and the scheduler respectively
+
+boot_started = time.perf_counter()
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# ============= DB QUERY PROFILING =============
+
+# Development-only: records every Mongo command issued while serving a request
+DB_PROFILING = os.environ.get('DB_PROFILING', 'false').lower() == 'true'
+DB_QUERY_BUDGET_STRICT = os.environ.get('DB_QUERY_BUDGET_STRICT', 'false').lower() == 'true'
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '5'))
+
+# Max Mongo commands per route ("METHOD /path/template"), auth lookups included
+QUERY_BUDGETS: Dict[str, int] = {
+    "GET /api/tickets": 5,
+    "GET /api/tickets/{ticket_id}": 12,
+    "GET /api/tickets/my-assigned": 3,
+    "GET /api/tickets/my-resolved": 3,
+    "GET /api/tickets/{ticket_id}/comments": 6,
+    "GET /api/tickets/{ticket_id}/history": 6,
+    "GET /api/equipments": 3,
+}
+
+_current_profile: contextvars.ContextVar = contextvars.ContextVar('db_query_profile', default=None)
+
+def _shape_of(value):
+    """Replace literal values by placeholders so equivalent queries compare equal"""
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{k}:{_shape_of(v)}" for k, v in sorted(value.items())) + "}"
+    if isinstance(value, list):
+        return "[" + ",".join(sorted({_shape_of(v) for v in value})) + "]"
+    return "?"
+
+def query_shape(command_name: str, command: dict) -> str:
+    collection = command.get(command_name)
+    if command_name in ("find", "count", "distinct", "findAndModify"):
+        spec = command.get("filter", command.get("query", {}))
+    elif command_name == "aggregate":
+        spec = command.get("pipeline", [])
+    elif command_name in ("update", "delete"):
+        statements = command.get("updates") or command.get("deletes") or [{}]
+        spec = statements[0].get("q", {})
+    else:
+        spec = {}
+    return f"{command_name} {collection} {_shape_of(spec)}"
+
+class QueryProfile:
+    """Mongo commands issued within a single request"""
+
+    def __init__(self):
+        self.queries = []  # (shape, duration_ms)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self.queries)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(duration for _, duration in self.queries)
+
+    def repeated_shapes(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        counts = Counter(shape for shape, _ in self.queries)
+        return {shape: count for shape, count in counts.items() if count >= threshold}
+
+class QueryProfilerListener(monitoring.CommandListener):
+    """Attributes commands to the active request through a context variable.
+
+    Motor copies the caller's context into its executor threads, so the
+    profile set by the middleware is visible here.
+    """
+
+    def started(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            profile._pending[event.request_id] = query_shape(event.command_name, event.command)
+
+    def _finished(self, event):
+        profile = _current_profile.get()
+        if profile is not None:
+            shape = profile._pending.pop(event.request_id, event.command_name)
+            profile.queries.append((shape, event.duration_micros / 1000))
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+query_profiler = QueryProfilerListener()
+
+# ============= TRACING =============
+
+# OpenTelemetry-style request tracing without the SDK: a server span per request,
+# a client span per Mongo command, and spans around auth, bcrypt, the OAuth call,
+# response serialization and scheduled jobs. The current span lives in a context
+# variable, so asyncio tasks (which copy the context when created) and Motor's
+# executor threads parent their spans correctly. Sampled spans are appended as
+# OTLP/JSON, one ExportTraceServiceRequest per line, which the collector's
+# otlpjsonfile receiver (or any JSON tooling) reads without a running collector.
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_SAMPLE_RATIO = float(os.environ.get('TRACE_SAMPLE_RATIO', '1.0'))
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH', str(ROOT_DIR / 'traces' / 'spans-{pid}.jsonl'))
+TRACE_EXPORT_BATCH_SIZE = int(os.environ.get('TRACE_EXPORT_BATCH_SIZE', '512'))
+TRACE_EXPORT_INTERVAL_SECONDS = float(os.environ.get('TRACE_EXPORT_INTERVAL_SECONDS', '5'))
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'techassist-backend')
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+# Per-request scratch shared by the middleware, the endpoint wrapper and the response class
+_request_trace: contextvars.ContextVar = contextvars.ContextVar('request_trace', default=None)
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def otlp_attributes(attributes: dict) -> list:
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """One timed operation; root spans (no parent) make the sampling decision for their trace"""
+
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "sampled",
+                 "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: str = "internal", parent: Optional["Span"] = None,
+                 trace_id: Optional[str] = None, parent_id: Optional[str] = None,
+                 sampled: Optional[bool] = None, start_ns: Optional[int] = None,
+                 attributes: Optional[dict] = None):
+        self.name = name
+        self.kind = kind
+        self.span_id = os.urandom(8).hex()
+        if parent is not None:
+            self.trace_id, self.parent_id, self.sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            self.trace_id = trace_id or os.urandom(16).hex()
+            self.parent_id = parent_id
+            # Same rule as the SDK's TraceIdRatioBased sampler, so every service agrees on a trace
+            self.sampled = sampled if sampled is not None else int(self.trace_id[16:], 16) < TRACE_SAMPLE_RATIO * 2 ** 64
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException):
+        self.error = f"{type(exc).__name__}: {exc}"
+        self.attributes["exception.type"] = type(exc).__name__
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self, end_ns: Optional[int] = None):
+        self.end_ns = end_ns or time.time_ns()
+        if self.sampled:
+            span_exporter.add(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+class _NoopSpan:
+    def set_attribute(self, key: str, value):
+        pass
+
+NOOP_SPAN = _NoopSpan()
+
+def parse_traceparent(header: Optional[str]) -> Optional[tuple]:
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header"""
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+@contextmanager
+def start_span(name: str, kind: str = "internal", attributes: Optional[dict] = None):
+    """Child of the current span (or a new root); current for the duration of the block"""
+    if not TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+    span = Span(name, kind, parent=_current_span.get(), attributes=attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.record_exception(exc)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+
+class OtlpJsonFileExporter:
+    """Buffers finished spans and appends them to a per-process OTLP/JSON lines file.
+
+    Spans end on the event loop and on Motor's threads, hence the lock. A batch is
+    handed to a writer thread when it is full or TRACE_EXPORT_INTERVAL_SECONDS after
+    the last one, so the file write never blocks the event loop; flush(wait=True)
+    drains it at shutdown and exit.
+    """
+
+    def __init__(self, path_template: str):
+        self.path_template = path_template
+        self.exported = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._queue = None
+        self._writer_pid = None
+
+    def add(self, span: Span):
+        with self._lock:
+            self._buffer.append(span)
+            due = (len(self._buffer) >= TRACE_EXPORT_BATCH_SIZE
+                   or time.monotonic() - self._last_flush >= TRACE_EXPORT_INTERVAL_SECONDS)
+        if due:
+            self.flush()
+
+    def flush(self, wait: bool = False):
+        """Queue the buffered spans for writing; with wait, return once everything queued is written"""
+        with self._lock:
+            spans, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+            if not spans and not wait:
+                return
+            if self._writer_pid != os.getpid():
+                # First batch in this process (a forked child does not inherit the thread)
+                self._queue = queue.SimpleQueue()
+                self._writer_pid = os.getpid()
+                threading.Thread(target=self._write_loop, args=(self._queue,),
+                                 name="span-exporter", daemon=True).start()
+            if spans:
+                self._queue.put(spans)
+            if wait:
+                written = threading.Event()
+                self._queue.put(written)
+        if wait:
+            written.wait(timeout=5)
+
+    def _write_loop(self, batches: queue.SimpleQueue):
+        while True:
+            batch = batches.get()
+            if isinstance(batch, threading.Event):
+                batch.set()
+            else:
+                self._write(batch)
+
+    def _write(self, spans: List[Span]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": otlp_attributes({
+                "service.name": TRACE_SERVICE_NAME,
+                "process.pid": os.getpid(),
+            })},
+            "scopeSpans": [{
+                "scope": {"name": "techassist.tracing"},
+                "spans": [span.to_otlp() for span in spans],
+            }],
+        }]}
+        path = Path(self.path_template.format(pid=os.getpid()))
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(payload, separators=(",", ":")) + "\n")
+            self.exported += len(spans)
+        except OSError as e:
+            logging.warning(f"Could not export {len(spans)} spans to {path}: {e}")
+
+span_exporter = OtlpJsonFileExporter(TRACE_EXPORT_PATH)
+if TRACING_ENABLED:
+    atexit.register(span_exporter.flush, wait=True)
+
+class TracingCommandListener(monitoring.CommandListener):
+    """A client span per Mongo command issued inside a sampled trace.
+
+    The parent is the span current where the command was issued, which Motor's
+    executor threads see through the copied context. Statements are recorded as
+    query shapes, so no literal values (emails, tokens) reach the trace file.
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        parent = _current_span.get()
+        if parent is None or not parent.sampled:
+            return
+        self._spans[(event.connection_id, event.request_id)] = Span(
+            f"mongodb.{event.command_name}", "client", parent=parent, attributes={
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": str(event.command.get(event.command_name)),
+                "db.statement": query_shape(event.command_name, event.command),
+            })
+
+    def succeeded(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end()
+
+    def failed(self, event):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.error = str(event.failure.get("errmsg", event.failure))
+            span.end()
+
+tracing_listener = TracingCommandListener()
+
+def traced_endpoint(endpoint):
+    """Wraps an async endpoint in a handler span and notes when it returned, so the
+    response-model validation FastAPI runs afterwards can be timed separately"""
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        with start_span(f"handler {endpoint.__name__}"):
+            result = await endpoint(*args, **kwargs)
+        trace = _request_trace.get()
+        if trace is not None:
+            trace["handler_end_ns"] = time.time_ns()
+        return result
+    wrapper.traced = True
+    return wrapper
+
+class TracedRoute(APIRoute):
+    def __init__(self, path: str, endpoint, **kwargs):
+        # Sync endpoints run in the threadpool and keep their own timing in the request span;
+        # include_router rebuilds every route with the same class, hence the traced check
+        if asyncio.iscoroutinefunction(endpoint) and not getattr(endpoint, "traced", False):
+            endpoint = traced_endpoint(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+class TracedJSONResponse(JSONResponse):
+    """Records Pydantic response-model serialization and JSON encoding as spans"""
+
+    def render(self, content) -> bytes:
+        trace = _request_trace.get()
+        parent = _current_span.get()
+        if trace and trace.get("handler_end_ns") and parent is not None:
+            # Between the handler returning and this render FastAPI validated the
+            # response model and ran jsonable_encoder
+            Span("serialize.response_model", parent=parent, start_ns=trace.pop("handler_end_ns")).end()
+        with start_span("serialize.json") as span:
+            body = super().render(content)
+            span.set_attribute("http.response.body.size", len(body))
+        return body
+
+def traced_job(job_id: str, func):
+    """Each run of a scheduled job is the root span of its own trace"""
+    if not TRACING_ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def run():
+        with start_span(f"job {job_id}", attributes={"job.id": job_id}):
+            return func()
+    return run
+
+# ============= CONNECTION POOL =============
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', '')  # e.g. "zstd,snappy,zlib"
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', '30000'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '10000'))
+
+# Readiness fails when this fraction of the pool is checked out
+POOL_SATURATION_THRESHOLD = float(os.environ.get('POOL_SATURATION_THRESHOLD', '0.9'))
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '2'))
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Tracks checked-out connections and waiters across all pools of the client"""
+
+    def __init__(self):
+        self.in_use = 0
+        self.waiting = 0
+        self.open = 0
+        self._lock = threading.Lock()  # events arrive from the driver's and the jobs' threads
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
+
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, in_use=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1)
+
+    def connection_checked_in(self, event):
+        self._add(in_use=-1)
+
+    def connection_created(self, event):
+        self._add(open=1)
+
+    def connection_closed(self, event):
+        self._add(open=-1)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            in_use, waiting, open_ = self.in_use, self.waiting, self.open
+        return {
+            "in_use": in_use,
+            "waiting": waiting,
+            "open": open_,
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "saturation": round(in_use / MONGO_MAX_POOL_SIZE, 3) if MONGO_MAX_POOL_SIZE else 0,
+        }
+
+pool_stats = PoolStatsListener()
+
+def mongo_client_options() -> dict:
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "event_listeners": [pool_stats] + ([query_profiler] if DB_PROFILING else []) + ([tracing_listener] if TRACING_ENABLED else []),
+    }
+    if MONGO_COMPRESSORS:
+        options["compressors"] = MONGO_COMPRESSORS
+    return options
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, **mongo_client_options())
 db = client[os.environ['DB_NAME']]
 
 security = HTTPBearer(auto_error=False)
@@ -30,8 +526,11 @@ JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_HOURS = 48
 
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(
+    prefix="/api",
+    route_class=TracedRoute if TRACING_ENABLED else APIRoute,
+    default_response_class=TracedJSONResponse if TRACING_ENABLED else JSONResponse,
+)
 
 # ============= MODELS =============
 
@@ -47,13 +546,14 @@ class User(BaseModel):
     department_id: Optional[str] = None
     status: str = "activo"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    token_version: int = Field(default=0, exclude=True)  # bump to revoke every JWT of the user
 
 class UserSession(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     user_id: str
-    session_token: str
-    expires_at: datetime
+    token_hash: str  # sha256 of the session token, the raw token is never stored
+    expires_at: datetime  # stored as a BSON date so the TTL index can expire it
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Department(BaseModel):
@@ -85,6 +585,7 @@ class Priority(BaseModel):
     name: str  # baja, media, alta
     response_time_hours: int
     color: str
+    rank: int = 0  # higher is more urgent; stored on tickets as priority_rank for queue ordering
 
 class TicketStatus(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -102,11 +603,18 @@ class Ticket(BaseModel):
     title: str
     description: str
     priority: str  # baja, media, alta
+    priority_rank: int = 1  # PRIORITIES[priority].rank, kept in sync with priority
     status: str  # abierto, en_proceso, cerrado
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     assigned_at: Optional[datetime] = None
     closed_at: Optional[datetime] = None
     last_priority_change: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    due_at: Optional[datetime] = None  # SLA deadline: last_priority_change + response time of the priority
+    updated_at: Optional[datetime] = None  # bumped by every write; drives GET /tickets/changes
+    # Denormalized display names, kept in sync by fan_out_rename
+    user_name: Optional[str] = None
+    technician_name: Optional[str] = None
+    category_name: Optional[str] = None
 
 class Comment(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -121,9 +629,21 @@ class Attachment(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     ticket_id: str
     filename: str
-    file_data: str  # base64
+    file_data: Optional[str] = None  # base64; resolved from attachment_blobs on read, never stored on the row
+    digest: Optional[str] = None  # SHA-256 of the decoded content, key into attachment_blobs
+    size: Optional[int] = None
+    mime_type: Optional[str] = None  # sniffed from the content by the processing pipeline
+    thumbnail: Optional[str] = None  # base64 JPEG, for images once processed
+    text_preview: Optional[str] = None  # start of text attachments (logs)
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class AssignmentRule(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    category_id: Optional[str] = None  # match on ticket category...
+    requester_department_id: Optional[str] = None  # ...and/or the requester's department
+    technician_department_id: str  # pool of technicians that takes matching tickets
+
 class TicketHistory(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -132,6 +652,22 @@ class TicketHistory(BaseModel):
     action: str
     timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+# Response time per priority; due_at is recomputed whenever the priority changes
+PRIORITIES = {
+    p.name: p for p in (
+        Priority(name="baja", response_time_hours=int(os.environ.get('SLA_HOURS_BAJA', '72')), color="green", rank=1),
+        Priority(name="media", response_time_hours=int(os.environ.get('SLA_HOURS_MEDIA', '24')), color="yellow", rank=2),
+        Priority(name="alta", response_time_hours=int(os.environ.get('SLA_HOURS_ALTA', '4')), color="red", rank=3),
+    )
+}
+
+def compute_due_at(priority: str, since: datetime) -> datetime:
+    hours = PRIORITIES[priority].response_time_hours if priority in PRIORITIES else PRIORITIES["baja"].response_time_hours
+    return since + timedelta(hours=hours)
+
+def priority_rank(priority: str) -> int:
+    return PRIORITIES[priority].rank if priority in PRIORITIES else PRIORITIES["baja"].rank
+
 # ============= INPUT MODELS =============
 
 class RegisterInput(BaseModel):
@@ -169,6 +705,20 @@ class CreateCategoryInput(BaseModel):
     name: str
     description: Optional[str] = None
 
+class AssignmentRuleInput(BaseModel):
+    category_id: Optional[str] = None
+    requester_department_id: Optional[str] = None
+    technician_department_id: str
+
+class UpdateCategoryInput(BaseModel):
+    name: Optional[str] = None
+    description: Optional[str] = None
+
+class UpdateUserInput(BaseModel):
+    name: Optional[str] = None
+    phone: Optional[str] = None
+    department_id: Optional[str] = None
+
 class CreateEquipmentInput(BaseModel):
     name: str
     type: str
@@ -181,28 +731,45 @@ class CreateEquipmentInput(BaseModel):
 # ============= AUTH HELPERS =============
 
 def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    import bcrypt
+    with start_span("bcrypt.hashpw"):
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
 def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    import bcrypt
+    with start_span("bcrypt.checkpw"):
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
-def create_jwt_token(user_id: str, email: str, role: str) -> str:
+def create_jwt_token(user_id: str, email: str, role: str, token_version: int = 0) -> str:
     expiration = datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
     payload = {
         'user_id': user_id,
         'email': email,
         'role': role,
+        'ver': token_version,
         'exp': expiration
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> User:
-    # Check cookie first
+def hash_session_token(session_token: str) -> str:
+    return hashlib.sha256(session_token.encode('utf-8')).hexdigest()
+
+def get_request_token(request: Request, credentials: Optional[HTTPAuthorizationCredentials]) -> Optional[str]:
+    # Check cookie first, fallback to Authorization header
     session_token = request.cookies.get('session_token')
-    
-    # Fallback to Authorization header
     if not session_token and credentials:
         session_token = credentials.credentials
+    return session_token
+
+async def get_current_user(request: Request, credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> User:
+    with start_span("auth.get_current_user") as span:
+        user = await authenticate_request(request, credentials)
+        span.set_attribute("enduser.id", user.id)
+        span.set_attribute("enduser.role", user.role)
+        return user
+
+async def authenticate_request(request: Request, credentials: Optional[HTTPAuthorizationCredentials]) -> User:
+    session_token = get_request_token(request, credentials)
     
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
@@ -213,6 +780,8 @@ async def get_current_user(request: Request, credentials: Optional[HTTPAuthoriza
         user_doc = await db.users.find_one({"id": payload['user_id']}, {"_id": 0})
         if not user_doc:
             raise HTTPException(status_code=401, detail="User not found")
+        if payload.get('ver', 0) != user_doc.get('token_version', 0):
+            raise HTTPException(status_code=401, detail="Token revoked")
         user_doc.pop('password', None)
         return User(**user_doc)
     except jwt.ExpiredSignatureError:
@@ -220,26 +789,125 @@ async def get_current_user(request: Request, credentials: Optional[HTTPAuthoriza
     except jwt.InvalidTokenError:
         pass
     
-    # Check if it's Google OAuth session token
-    session_doc = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
+    # Check if it's Google OAuth session token (expired ones never match, the TTL index removes them later)
+    session_doc = await db.user_sessions.find_one(
+        {"token_hash": hash_session_token(session_token), "expires_at": {"$gt": datetime.now(timezone.utc)}},
+        {"_id": 0, "user_id": 1}
+    )
     if not session_doc:
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    session = UserSession(**session_doc)
-    if session.expires_at < datetime.now(timezone.utc):
-        raise HTTPException(status_code=401, detail="Session expired")
-    
-    user_doc = await db.users.find_one({"id": session.user_id}, {"_id": 0})
+    user_doc = await db.users.find_one({"id": session_doc['user_id']}, {"_id": 0})
     if not user_doc:
         raise HTTPException(status_code=401, detail="User not found")
     
     user_doc.pop('password', None)
     return User(**user_doc)
 
+# ============= RATE LIMITING =============
+
+# Token buckets protecting the bcrypt-heavy auth endpoints: (capacity, refill per second)
+RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # memory, mongo
+TRUST_PROXY_HEADERS = os.environ.get('TRUST_PROXY_HEADERS', 'false').lower() == 'true'
+LOGIN_RATE_PER_IP = int(os.environ.get('LOGIN_RATE_PER_IP', '20'))  # per minute
+LOGIN_RATE_PER_EMAIL = int(os.environ.get('LOGIN_RATE_PER_EMAIL', '5'))  # per minute
+REGISTER_RATE_PER_IP = int(os.environ.get('REGISTER_RATE_PER_IP', '10'))  # per 10 minutes
+RATE_LIMITS = {
+    "login:ip": (LOGIN_RATE_PER_IP, LOGIN_RATE_PER_IP / 60),
+    "login:email": (LOGIN_RATE_PER_EMAIL, LOGIN_RATE_PER_EMAIL / 60),
+    "register:ip": (REGISTER_RATE_PER_IP, REGISTER_RATE_PER_IP / 600),
+}
+
+class RateLimitStore:
+    """Storage for token buckets. take() consumes one token and returns the
+    seconds to wait before retrying (0 when the attempt is allowed)."""
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        raise NotImplementedError
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Per-process buckets, bounded to the most recently used keys"""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self.buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.monotonic()
+        tokens, updated = self.buckets.pop(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+        retry_after = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            retry_after = (1 - tokens) / refill_per_second
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return retry_after
+
+class MongoRateLimitStore(RateLimitStore):
+    """Buckets shared by every worker, updated atomically with a pipeline update"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key: str, capacity: int, refill_per_second: float) -> float:
+        now = time.time()
+        elapsed = {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}
+        refilled = {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, refill_per_second]}]}]}
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / refill_per_second),
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        if doc['allowed']:
+            return 0.0
+        return (1 - doc['tokens']) / refill_per_second
+
+rate_limit_store: RateLimitStore = (
+    MongoRateLimitStore(db.rate_limits) if RATE_LIMIT_BACKEND == "mongo" else MemoryRateLimitStore()
+)
+rate_limit_metrics = {"allowed": Counter(), "throttled": Counter()}
+
+def client_ip(request: Request) -> str:
+    if TRUST_PROXY_HEADERS:
+        forwarded = request.headers.get('x-forwarded-for')
+        if forwarded:
+            return forwarded.split(',')[0].strip()
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(rule: str, identity: str):
+    """Raise 429 with Retry-After when the bucket for rule/identity is empty"""
+    if not RATE_LIMIT_ENABLED:
+        return
+    capacity, refill_per_second = RATE_LIMITS[rule]
+    retry_after = await rate_limit_store.take(f"{rule}:{identity}", capacity, refill_per_second)
+    if retry_after > 0:
+        rate_limit_metrics["throttled"][rule] += 1
+        logging.warning(f"Rate limit {rule} exceeded for {identity}")
+        raise HTTPException(
+            status_code=429,
+            detail="Too many attempts, try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+    rate_limit_metrics["allowed"][rule] += 1
+
 # ============= AUTH ENDPOINTS =============
 
 @api_router.post("/auth/register")
-async def register(input: RegisterInput):
+async def register(input: RegisterInput, request: Request):
+    await enforce_rate_limit("register:ip", client_ip(request))
+    
     # Check if user exists
     existing = await db.users.find_one({"email": input.email}, {"_id": 0})
     if existing:
@@ -256,7 +924,12 @@ async def register(input: RegisterInput):
     
     doc = user.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
-    await db.users.insert_one(doc)
+    try:
+        await db.users.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")  # registered concurrently
+    if user.role == "tecnico":
+        assignment_engine.upsert_technician(doc)
     
     # Create JWT token
     token = create_jwt_token(user.id, user.email, user.role)
@@ -267,7 +940,10 @@ async def register(input: RegisterInput):
     return {"user": user_dict, "token": token}
 
 @api_router.post("/auth/login")
-async def login(input: LoginInput):
+async def login(input: LoginInput, request: Request):
+    await enforce_rate_limit("login:ip", client_ip(request))
+    await enforce_rate_limit("login:email", input.email.lower())
+    
     user_doc = await db.users.find_one({"email": input.email}, {"_id": 0})
     if not user_doc:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -276,7 +952,7 @@ async def login(input: LoginInput):
     if not user.password or not verify_password(input.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    token = create_jwt_token(user.id, user.email, user.role)
+    token = create_jwt_token(user.id, user.email, user.role, user.token_version)
     
     user_dict = user.model_dump()
     user_dict.pop('password', None)
@@ -296,9 +972,14 @@ async def google_auth(redirect_url: str):
 
 @api_router.post("/auth/session")
 async def create_session_from_google(session_id: str, response: Response):
+    import requests
+    
     # Get user data from Emergent auth
     headers = {"X-Session-ID": session_id}
-    resp = requests.get("https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data", headers=headers)
+    url = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+    with start_span("oauth.session_data", "client", {"http.request.method": "GET", "url.full": url}) as span:
+        resp = requests.get(url, headers=headers)
+        span.set_attribute("http.response.status_code", resp.status_code)
     
     if resp.status_code != 200:
         raise HTTPException(status_code=400, detail="Invalid session ID")
@@ -319,21 +1000,28 @@ async def create_session_from_google(session_id: str, response: Response):
         )
         doc = user.model_dump()
         doc['created_at'] = doc['created_at'].isoformat()
-        await db.users.insert_one(doc)
+        try:
+            await db.users.insert_one(doc)
+        except DuplicateKeyError:
+            # Created concurrently (another login or a bulk provision); use that account
+            user = User(**await db.users.find_one({"email": data['email']}, {"_id": 0}))
     else:
         user = User(**user_doc)
     
     # Create session
     session = UserSession(
         user_id=user.id,
-        session_token=data['session_token'],
+        token_hash=hash_session_token(data['session_token']),
         expires_at=datetime.now(timezone.utc) + timedelta(days=7)
     )
     
     session_doc = session.model_dump()
     session_doc['created_at'] = session_doc['created_at'].isoformat()
-    session_doc['expires_at'] = session_doc['expires_at'].isoformat()
-    await db.user_sessions.insert_one(session_doc)
+    await db.user_sessions.update_one(
+        {"token_hash": session.token_hash},
+        {"$setOnInsert": session_doc},
+        upsert=True
+    )
     
     # Set cookie
     response.set_cookie(
@@ -352,288 +1040,1156 @@ async def create_session_from_google(session_id: str, response: Response):
     return {"user": user_dict, "session_token": data['session_token']}
 
 @api_router.post("/auth/logout")
-async def logout(response: Response, current_user: User = Depends(get_current_user)):
-    # Delete session from database
-    await db.user_sessions.delete_many({"user_id": current_user.id})
+async def logout(request: Request, response: Response, current_user: User = Depends(get_current_user),
+                 credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    # Delete only this session; JWTs are stateless and just dropped by the client
+    session_token = get_request_token(request, credentials)
+    await db.user_sessions.delete_one({"token_hash": hash_session_token(session_token)})
     
     # Clear cookie
     response.delete_cookie("session_token")
     
     return {"message": "Logged out successfully"}
 
-# ============= TICKET ENDPOINTS =============
-
-@api_router.post("/tickets", response_model=Ticket)
-async def create_ticket(input: CreateTicketInput, current_user: User = Depends(get_current_user)):
-    ticket = Ticket(
-        user_id=current_user.id,
-        title=input.title,
-        description=input.description,
-        category_id=input.category_id,
-        equipment_id=input.equipment_id,
-        priority="baja",
-        status="abierto"
-    )
-    
-    doc = ticket.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['last_priority_change'] = doc['last_priority_change'].isoformat()
-    await db.tickets.insert_one(doc)
-    
-    # Save attachments
-    if input.attachments:
-        for att in input.attachments:
-            attachment = Attachment(
-                ticket_id=ticket.id,
-                filename=att['filename'],
-                file_data=att['file_data']
-            )
-            att_doc = attachment.model_dump()
-            att_doc['uploaded_at'] = att_doc['uploaded_at'].isoformat()
-            await db.attachments.insert_one(att_doc)
+@api_router.post("/auth/logout-all")
+async def logout_all(response: Response, current_user: User = Depends(get_current_user)):
+    # Bumping the version invalidates every JWT issued so far, no denylist needed
+    await db.users.update_one({"id": current_user.id}, {"$inc": {"token_version": 1}})
+    await db.user_sessions.delete_many({"user_id": current_user.id})
     
-    # Create history
-    history = TicketHistory(
-        ticket_id=ticket.id,
-        user_id=current_user.id,
-        action=f"Ticket creado con prioridad {ticket.priority}"
-    )
-    hist_doc = history.model_dump()
-    hist_doc['timestamp'] = hist_doc['timestamp'].isoformat()
-    await db.ticket_history.insert_one(hist_doc)
+    response.delete_cookie("session_token")
     
-    return ticket
+    return {"message": "All sessions closed"}
 
-@api_router.get("/tickets")
-async def get_tickets(current_user: User = Depends(get_current_user)):
-    if current_user.role == "cliente":
-        # Clientes solo ven sus tickets
-        tickets = await db.tickets.find({"user_id": current_user.id}, {"_id": 0}).to_list(1000)
-    else:
-        # Técnicos y admins ven todos
-        tickets = await db.tickets.find({}, {"_id": 0}).to_list(1000)
-    
-    # Convert ISO strings to datetime
-    for ticket in tickets:
-        if isinstance(ticket.get('created_at'), str):
-            ticket['created_at'] = datetime.fromisoformat(ticket['created_at'])
-        if isinstance(ticket.get('last_priority_change'), str):
-            ticket['last_priority_change'] = datetime.fromisoformat(ticket['last_priority_change'])
-        if ticket.get('assigned_at') and isinstance(ticket['assigned_at'], str):
-            ticket['assigned_at'] = datetime.fromisoformat(ticket['assigned_at'])
-        if ticket.get('closed_at') and isinstance(ticket['closed_at'], str):
-            ticket['closed_at'] = datetime.fromisoformat(ticket['closed_at'])
-    
-    # Enrich with user and technician names
-    for ticket in tickets:
-        user = await db.users.find_one({"id": ticket['user_id']}, {"_id": 0, "name": 1})
-        ticket['user_name'] = user['name'] if user else "Unknown"
-        
-        if ticket.get('technician_id'):
-            tech = await db.users.find_one({"id": ticket['technician_id']}, {"_id": 0, "name": 1})
-            ticket['technician_name'] = tech['name'] if tech else "Unknown"
-        else:
-            ticket['technician_name'] = None
-        
-        # Get category name
-        category = await db.categories.find_one({"id": ticket['category_id']}, {"_id": 0, "name": 1})
-        ticket['category_name'] = category['name'] if category else "Unknown"
+# ============= AUTO ASSIGNMENT =============
+
+AUTO_ASSIGN_MODE = os.environ.get('AUTO_ASSIGN_MODE', 'off')  # off, dry_run, on
+PRIORITY_WEIGHTS = {"baja": 1, "media": 2, "alta": 3}
+OPEN_STATUSES = ["abierto", "en_proceso"]
+
+class AssignmentEngine:
+    """Least-loaded technician picker.
     
-    return tickets
+    Load is the sum of priority weights of a technician's open tickets. One
+    min-heap per technician department (plus a global one under None) gives
+    O(log n) picks; entries are invalidated lazily when a load changes. The
+    scheduler thread also reports changes, hence the lock.
+    """
 
-@api_router.get("/tickets/my-assigned")
-async def get_my_assigned_tickets(current_user: User = Depends(get_current_user)):
-    if current_user.role == "cliente":
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.technicians: Dict[str, dict] = {}  # id -> {"name", "department_id"}
+        self.loads: Dict[str, int] = {}
+        self.rules: List[dict] = []
+        self.heaps: Dict[Optional[str], list] = {}
+
+    def rebuild(self, technicians: List[dict], loads: Dict[str, int], rules: List[dict]):
+        with self._lock:
+            self.technicians = {t['id']: {"name": t['name'], "department_id": t.get('department_id')} for t in technicians}
+            self.loads = {tech_id: loads.get(tech_id, 0) for tech_id in self.technicians}
+            self.rules = rules
+            self.heaps = {}
+            for tech_id in self.technicians:
+                self._push(tech_id)
+
+    def _push(self, tech_id: str):
+        entry = (self.loads[tech_id], tech_id)
+        heapq.heappush(self.heaps.setdefault(None, []), entry)
+        department_id = self.technicians[tech_id]['department_id']
+        if department_id:
+            heapq.heappush(self.heaps.setdefault(department_id, []), entry)
+        if len(self.heaps[None]) > 4 * len(self.technicians) + 64:
+            self._compact()
+
+    def _compact(self):
+        """Drop stale entries once they outnumber live ones"""
+        self.heaps = {}
+        for tech_id, info in self.technicians.items():
+            entry = (self.loads[tech_id], tech_id)
+            self.heaps.setdefault(None, []).append(entry)
+            if info['department_id']:
+                self.heaps.setdefault(info['department_id'], []).append(entry)
+        for heap in self.heaps.values():
+            heapq.heapify(heap)
+
+    def _peek(self, pool: Optional[str]) -> Optional[str]:
+        heap = self.heaps.get(pool, [])
+        while heap:
+            load, tech_id = heap[0]
+            if self.loads.get(tech_id) == load:
+                return tech_id
+            heapq.heappop(heap)  # stale entry
+        return None
+
+    def upsert_technician(self, tech: dict):
+        with self._lock:
+            self.technicians[tech['id']] = {"name": tech['name'], "department_id": tech.get('department_id')}
+            self.loads.setdefault(tech['id'], 0)
+            self._push(tech['id'])
+
+    def adjust(self, tech_id: str, delta: int):
+        with self._lock:
+            if tech_id not in self.loads or delta == 0:
+                return
+            self.loads[tech_id] += delta
+            self._push(tech_id)
+
+    def target_pool(self, category_id: Optional[str], requester_department_id: Optional[str]) -> Optional[str]:
+        """Technician department required by the first matching affinity rule"""
+        for rule in self.rules:
+            if rule.get('category_id') and rule['category_id'] != category_id:
+                continue
+            if rule.get('requester_department_id') and rule['requester_department_id'] != requester_department_id:
+                continue
+            return rule['technician_department_id']
+        return None
+
+    def pick(self, category_id: Optional[str] = None, requester_department_id: Optional[str] = None) -> Optional[dict]:
+        with self._lock:
+            pool = self.target_pool(category_id, requester_department_id)
+            tech_id = self._peek(pool) if pool else None
+            if tech_id is None:
+                pool = None
+                tech_id = self._peek(None)
+            if tech_id is None:
+                return None
+            return {"id": tech_id, "name": self.technicians[tech_id]['name'], "load": self.loads[tech_id], "pool": pool}
+
+    def snapshot(self) -> List[dict]:
+        with self._lock:
+            return sorted(
+                ({"id": tech_id, "name": info['name'], "department_id": info['department_id'], "load": self.loads[tech_id]}
+                 for tech_id, info in self.technicians.items()),
+                key=lambda t: (t['load'], t['id'])
+            )
+
+assignment_engine = AssignmentEngine()
+
+def ticket_load(ticket: Optional[dict]) -> tuple:
+    """(technician_id, weight) a ticket contributes to the engine"""
+    if not ticket or ticket.get('deleted_at') or ticket.get('status') not in OPEN_STATUSES:
+        return None, 0
+    return ticket.get('technician_id'), PRIORITY_WEIGHTS.get(ticket.get('priority'), 1)
+
+def record_ticket_change(before: Optional[dict], after: Optional[dict]):
+    """Ticket write event: move the ticket's weight from its old to its new technician"""
+    old_tech, old_weight = ticket_load(before)
+    new_tech, new_weight = ticket_load(after)
+    if old_tech:
+        assignment_engine.adjust(old_tech, -old_weight)
+    if new_tech:
+        assignment_engine.adjust(new_tech, new_weight)
+
+async def rebuild_assignment_engine():
+    technicians = await db.users.find(
+        {"role": "tecnico", "status": "activo"}, {"_id": 0, "id": 1, "name": 1, "department_id": 1}
+    ).to_list(None)
+    pipeline = [
+        {"$match": {"status": {"$in": OPEN_STATUSES}, "technician_id": {"$ne": None}, **NOT_DELETED}},
+        {"$group": {"_id": "$technician_id", "load": {"$sum": {"$switch": {
+            "branches": [{"case": {"$eq": ["$priority", name]}, "then": weight} for name, weight in PRIORITY_WEIGHTS.items()],
+            "default": 1
+        }}}}},
+    ]
+    loads = {doc['_id']: doc['load'] async for doc in db.tickets.aggregate(pipeline)}
+    rules = await db.assignment_rules.find({}, {"_id": 0}).to_list(None)
+    assignment_engine.rebuild(technicians, loads, rules)
+    logging.info(f"Assignment engine rebuilt with {len(technicians)} technicians")
+
+ASSIGNMENT_REFRESH_SECONDS = int(os.environ.get('ASSIGNMENT_REFRESH_SECONDS', '300'))
+
+async def refresh_assignment_engine():
+    """Periodically re-sync the in-memory loads with writes made by other processes.
+
+    The engine lives in each API process, so this runs on the process's own event
+    loop rather than in the background worker.
+    """
+    while True:
+        await asyncio.sleep(ASSIGNMENT_REFRESH_SECONDS)
+        try:
+            await rebuild_assignment_engine()
+        except Exception as e:
+            logging.error(f"Error in refresh_assignment_engine: {e}")
+
+@api_router.get("/assignment/technicians")
+async def get_assignment_loads(current_user: User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "tecnico"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    tickets = await db.tickets.find({"technician_id": current_user.id}, {"_id": 0}).to_list(1000)
-    
-    for ticket in tickets:
-        if isinstance(ticket.get('created_at'), str):
-            ticket['created_at'] = datetime.fromisoformat(ticket['created_at'])
-        if isinstance(ticket.get('last_priority_change'), str):
-            ticket['last_priority_change'] = datetime.fromisoformat(ticket['last_priority_change'])
-        if ticket.get('assigned_at') and isinstance(ticket['assigned_at'], str):
-            ticket['assigned_at'] = datetime.fromisoformat(ticket['assigned_at'])
-        if ticket.get('closed_at') and isinstance(ticket['closed_at'], str):
-            ticket['closed_at'] = datetime.fromisoformat(ticket['closed_at'])
+    return {"mode": AUTO_ASSIGN_MODE, "technicians": assignment_engine.snapshot()}
+
+@api_router.get("/assignment/preview")
+async def preview_assignment(category_id: Optional[str] = None, requester_department_id: Optional[str] = None,
+                             current_user: User = Depends(get_current_user)):
+    """Dry run: who would get a ticket with these attributes right now"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    return tickets
+    return {"technician": assignment_engine.pick(category_id, requester_department_id)}
 
-@api_router.get("/tickets/my-resolved")
-async def get_my_resolved_tickets(current_user: User = Depends(get_current_user)):
-    if current_user.role == "cliente":
+@api_router.get("/assignment/rules")
+async def get_assignment_rules(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
     
-    tickets = await db.tickets.find({
-        "technician_id": current_user.id,
-        "status": "cerrado"
-    }, {"_id": 0}).to_list(1000)
+    return await db.assignment_rules.find({}, {"_id": 0}).to_list(1000)
+
+@api_router.post("/assignment/rules")
+async def create_assignment_rule(input: AssignmentRuleInput, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create assignment rules")
     
-    for ticket in tickets:
-        if isinstance(ticket.get('created_at'), str):
-            ticket['created_at'] = datetime.fromisoformat(ticket['created_at'])
-        if isinstance(ticket.get('last_priority_change'), str):
-            ticket['last_priority_change'] = datetime.fromisoformat(ticket['last_priority_change'])
-        if ticket.get('assigned_at') and isinstance(ticket['assigned_at'], str):
-            ticket['assigned_at'] = datetime.fromisoformat(ticket['assigned_at'])
-        if ticket.get('closed_at') and isinstance(ticket['closed_at'], str):
-            ticket['closed_at'] = datetime.fromisoformat(ticket['closed_at'])
+    rule = AssignmentRule(**input.model_dump())
+    await db.assignment_rules.insert_one(rule.model_dump())
+    await rebuild_assignment_engine()
+    return rule
+
+@api_router.delete("/assignment/rules/{rule_id}")
+async def delete_assignment_rule(rule_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can delete assignment rules")
     
-    return tickets
+    result = await db.assignment_rules.delete_one({"id": rule_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    await rebuild_assignment_engine()
+    return {"message": "Rule deleted successfully"}
 
-@api_router.get("/tickets/{ticket_id}")
-async def get_ticket(ticket_id: str, current_user: User = Depends(get_current_user)):
-    ticket_doc = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
-    if not ticket_doc:
-        raise HTTPException(status_code=404, detail="Ticket not found")
+# ============= RESPONSE CACHE =============
+
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')  # off, memory, redis
+RESPONSE_CACHE_URL = os.environ.get('RESPONSE_CACHE_URL', 'redis://localhost:6379/0')
+RESPONSE_CACHE_TTL_SECONDS = int(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '30'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+RESPONSE_CACHE_PREFIX = "techassist:cache:"
+
+class ResponseCache:
+    """Byte-string entries with a TTL, plus counters used as invalidation versions"""
     
-    ticket = Ticket(**ticket_doc)
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        raise NotImplementedError
     
-    # Check permissions
-    if current_user.role == "cliente" and ticket.user_id != current_user.id:
-        raise HTTPException(status_code=403, detail="Access denied")
+    async def set(self, key: str, value: bytes, ttl: int):
+        raise NotImplementedError
     
-    # Get user info
-    user = await db.users.find_one({"id": ticket.user_id}, {"_id": 0})
-    ticket_dict = ticket.model_dump()
-    ticket_dict['user'] = User(**user).model_dump() if user else None
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
     
-    # Get technician info
-    if ticket.technician_id:
-        tech = await db.users.find_one({"id": ticket.technician_id}, {"_id": 0})
-        ticket_dict['technician'] = User(**tech).model_dump() if tech else None
+    async def close(self):
+        """Release connections held for the running event loop"""
+
+class MemoryResponseCache(ResponseCache):
+    """In-process LRU. Each API process has its own copy, so with several workers
+    (or jobs running in worker.py) other processes only see changes after the TTL."""
     
-    # Get category
-    category = await db.categories.find_one({"id": ticket.category_id}, {"_id": 0})
-    ticket_dict['category'] = Category(**category).model_dump() if category else None
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._counters: Dict[str, int] = {}  # never evicted: a reset version could revive old entries
+        self._lock = threading.Lock()  # scheduler jobs invalidate from their own thread
     
-    # Get equipment
-    if ticket.equipment_id:
-        equipment = await db.equipments.find_one({"id": ticket.equipment_id}, {"_id": 0})
-        ticket_dict['equipment'] = Equipment(**equipment).model_dump() if equipment else None
-    
-    # Get comments
-    comments_docs = await db.comments.find({"ticket_id": ticket_id}, {"_id": 0}).to_list(1000)
-    comments = []
-    for comment_doc in comments_docs:
-        if isinstance(comment_doc.get('created_at'), str):
-            comment_doc['created_at'] = datetime.fromisoformat(comment_doc['created_at'])
-        comment = Comment(**comment_doc)
-        comment_dict = comment.model_dump()
-        user = await db.users.find_one({"id": comment.user_id}, {"_id": 0})
-        comment_dict['user_name'] = user['name'] if user else "Unknown"
-        comments.append(comment_dict)
-    ticket_dict['comments'] = comments
+    async def get_many(self, keys):
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                if key in self._counters:
+                    values.append(str(self._counters[key]).encode())
+                    continue
+                entry = self._entries.get(key)
+                if entry and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    values.append(entry[1])
+                else:
+                    self._entries.pop(key, None)
+                    values.append(None)
+        return values
     
-    # Get attachments
-    attachments_docs = await db.attachments.find({"ticket_id": ticket_id}, {"_id": 0}).to_list(1000)
-    attachments = []
-    for att_doc in attachments_docs:
-        if isinstance(att_doc.get('uploaded_at'), str):
-            att_doc['uploaded_at'] = datetime.fromisoformat(att_doc['uploaded_at'])
-        attachments.append(Attachment(**att_doc).model_dump())
-    ticket_dict['attachments'] = attachments
-    
-    # Get history
-    history_docs = await db.ticket_history.find({"ticket_id": ticket_id}, {"_id": 0}).sort("timestamp", -1).to_list(1000)
-    history = []
-    for hist_doc in history_docs:
-        if isinstance(hist_doc.get('timestamp'), str):
-            hist_doc['timestamp'] = datetime.fromisoformat(hist_doc['timestamp'])
-        hist = TicketHistory(**hist_doc)
-        hist_dict = hist.model_dump()
-        user = await db.users.find_one({"id": hist.user_id}, {"_id": 0})
-        hist_dict['user_name'] = user['name'] if user else "Unknown"
-        history.append(hist_dict)
-    ticket_dict['history'] = history
+    async def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
     
-    return ticket_dict
+    async def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
 
-@api_router.put("/tickets/{ticket_id}")
-async def update_ticket(ticket_id: str, input: UpdateTicketInput, current_user: User = Depends(get_current_user)):
-    ticket_doc = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
-    if not ticket_doc:
-        raise HTTPException(status_code=404, detail="Ticket not found")
+class RedisResponseCache(ResponseCache):
+    """Shared cache over the Redis protocol (Redis, Valkey, KeyDB or any local stand-in).
+
+    Speaks just enough RESP for MGET, SET EX and INCR. Connections are pooled per
+    event loop, since scheduler jobs run on loops of their own.
+    """
     
-    ticket = Ticket(**ticket_doc)
+    def __init__(self, url: str):
+        parsed = urllib.parse.urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.database = int(parsed.path.lstrip('/') or 0)
+        self._idle = weakref.WeakKeyDictionary()  # event loop -> idle (reader, writer) pairs
     
-    # Check permissions
-    if current_user.role == "cliente":
-        raise HTTPException(status_code=403, detail="Access denied")
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        if self.password:
+            await self._call(reader, writer, 'AUTH', self.password)
+        if self.database:
+            await self._call(reader, writer, 'SELECT', self.database)
+        return reader, writer
     
-    update_data = {}
-    history_action = []
+    async def execute(self, *args):
+        idle = self._idle.setdefault(asyncio.get_running_loop(), [])
+        reader, writer = idle.pop() if idle else await self._connect()
+        try:
+            result = await self._call(reader, writer, *args)
+        except BaseException:
+            writer.close()
+            raise
+        idle.append((reader, writer))
+        return result
     
-    if input.status:
-        update_data['status'] = input.status
-        history_action.append(f"Estado cambiado a {input.status}")
-        
-        if input.status == "cerrado":
-            update_data['closed_at'] = datetime.now(timezone.utc).isoformat()
+    @classmethod
+    async def _call(cls, reader, writer, *args):
+        command = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            command.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        writer.write(b"".join(command))
+        await writer.drain()
+        return await cls._read_reply(reader)
     
-    if input.priority:
-        old_priority = ticket.priority
-        update_data['priority'] = input.priority
-        update_data['last_priority_change'] = datetime.now(timezone.utc).isoformat()
-        history_action.append(f"Prioridad cambiada de {old_priority} a {input.priority}")
+    @classmethod
+    async def _read_reply(cls, reader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis connection closed")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload
+        if kind == b'-':
+            raise RuntimeError(f"Redis error: {payload.decode()}")
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            if int(payload) < 0:
+                return None
+            return (await reader.readexactly(int(payload) + 2))[:-2]
+        if kind == b'*':
+            if int(payload) < 0:
+                return None
+            return [await cls._read_reply(reader) for _ in range(int(payload))]
+        raise RuntimeError(f"Unexpected Redis reply: {line!r}")
     
-    if input.technician_id:
-        if not ticket.technician_id:
-            update_data['assigned_at'] = datetime.now(timezone.utc).isoformat()
-        update_data['technician_id'] = input.technician_id
-        tech = await db.users.find_one({"id": input.technician_id}, {"_id": 0})
-        tech_name = tech['name'] if tech else "Unknown"
-        history_action.append(f"Asignado a técnico {tech_name}")
+    async def get_many(self, keys):
+        return await self.execute('MGET', *keys)
+    
+    async def set(self, key, value, ttl):
+        await self.execute('SET', key, value, 'EX', ttl)
+    
+    async def incr(self, key):
+        return await self.execute('INCR', key)
+    
+    async def close(self):
+        for _, writer in self._idle.pop(asyncio.get_running_loop(), []):
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass  # already broken; nothing left to release
+
+def build_response_cache() -> Optional[ResponseCache]:
+    if RESPONSE_CACHE_BACKEND == "redis":
+        return RedisResponseCache(RESPONSE_CACHE_URL)
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache(RESPONSE_CACHE_MAX_ENTRIES)
+    return None
+
+response_cache = build_response_cache()
+response_cache_metrics = Counter()
+
+class SingleFlight:
+    """Run one computation per key at a time; concurrent callers share its result.
+
+    The computation runs in its own task and every caller awaits it shielded, so a
+    caller that disconnects (the first one included) does not cancel it for the rest.
+    """
+    
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Task] = {}
+    
+    async def do(self, key: str, compute):
+        task = self._inflight.get(key)
+        if task is not None:
+            response_cache_metrics['coalesced'] += 1
+        else:
+            task = asyncio.ensure_future(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(task)
+    
+    def _forget(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved: if every caller left, nobody else would
+
+single_flight = SingleFlight()
+
+def ticket_list_scope(user: User) -> str:
+    """Cache scope: every non-client sees the same list, clients only their own"""
+    return f"user:{user.id}" if user.role == "cliente" else "staff"
+
+def cache_version_key(scope: str) -> str:
+    return f"{RESPONSE_CACHE_PREFIX}version:{scope}"
+
+async def cached_json_response(scope: str, params: dict, compute) -> Response:
+    """Serve compute()'s JSON from the cache, keyed by scope, query params and the
+    scope's invalidation versions, computing it at most once per key at a time"""
+    async def render():
+        return json.dumps(jsonable_encoder(await compute())).encode()
+    
+    if response_cache is None:
+        return Response(content=await render(), media_type="application/json")
+    
+    try:
+        global_version, scope_version = await response_cache.get_many(
+            [cache_version_key("all"), cache_version_key(scope)]
+        )
+    except Exception as e:
+        response_cache_metrics['errors'] += 1
+        logging.warning(f"Response cache unavailable: {e}")
+        return Response(content=await render(), media_type="application/json")
+    
+    key = (f"{RESPONSE_CACHE_PREFIX}{scope}:{int(global_version or 0)}.{int(scope_version or 0)}:"
+           f"{urllib.parse.urlencode(sorted(params.items()))}")
+    
+    async def load():
+        try:
+            cached = (await response_cache.get_many([key]))[0]
+        except Exception as e:
+            response_cache_metrics['errors'] += 1
+            logging.warning(f"Response cache unavailable: {e}")
+            cached = None
+        if cached is not None:
+            response_cache_metrics['hits'] += 1
+            return cached
+        
+        response_cache_metrics['misses'] += 1
+        body = await render()
+        try:
+            await response_cache.set(key, body, RESPONSE_CACHE_TTL_SECONDS)
+        except Exception as e:
+            response_cache_metrics['errors'] += 1
+            logging.warning(f"Response cache unavailable: {e}")
+        return body
+    
+    return Response(content=await single_flight.do(key, load), media_type="application/json")
+
+async def close_response_cache():
+    """Scheduler jobs run on loops of their own: close the loop's cache connections before the loop"""
+    if response_cache is not None:
+        await response_cache.close()
+
+async def invalidate_scopes(*scopes: str):
+    if response_cache is None:
+        return
+    for scope in scopes:
+        try:
+            await response_cache.incr(cache_version_key(scope))
+            response_cache_metrics['invalidations'] += 1
+        except Exception as e:
+            response_cache_metrics['errors'] += 1
+            logging.warning(f"Could not invalidate cache scope {scope}: {e}")
+
+async def invalidate_ticket_lists(*user_ids: Optional[str]):
+    """A ticket was written: drop the staff list and the lists of the given requesters"""
+    await invalidate_scopes("staff", *(f"user:{user_id}" for user_id in user_ids if user_id))
+
+async def invalidate_all_ticket_lists():
+    """Many tickets changed at once (renames, archival, migrations)"""
+    await invalidate_scopes("all")
+
+# ============= TICKET ENDPOINTS =============
+
+# Soft-deleted tickets carry deleted_at; {"deleted_at": None} also matches legacy docs without it
+NOT_DELETED = {"deleted_at": None}
+
+DETAIL_EMBED_LIMIT = int(os.environ.get('DETAIL_EMBED_LIMIT', '20'))
+PAGE_MAX_LIMIT = 200
+
+# ----- Sparse fieldsets (?fields=a,b,c) -----
+
+FIELDS_QUERY = Query(None, description="Comma-separated fields to return (id is always included)")
+TICKET_FIELDS = set(Ticket.model_fields)
+USER_FIELDS = set(User.model_fields) - {"password", "token_version"}
+EQUIPMENT_FIELDS = set(Equipment.model_fields)
+TICKET_DATE_FIELDS = ('created_at', 'last_priority_change', 'assigned_at', 'closed_at', 'due_at', 'updated_at')
+NAME_FIELDS = ('user_name', 'technician_name', 'category_name')
+USER_PROJECTION = {"_id": 0, "password": 0, "token_version": 0}
+
+def parse_fields(fields: Optional[str], allowed) -> Optional[List[str]]:
+    """`a,b` -> ['id', 'a', 'b']; None when the parameter is absent. 400 on unknown names."""
+    if fields is None:
+        return None
+    requested = [f.strip() for f in fields.split(',') if f.strip()]
+    unknown = sorted(set(requested) - set(allowed))
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(sorted(allowed))}"
+        )
+    return list(dict.fromkeys(["id", *requested]))
+
+def fields_projection(fields: Optional[List[str]], default: Optional[dict] = None) -> dict:
+    if fields is None:
+        return default or {"_id": 0}
+    return {"_id": 0, **{field: 1 for field in fields}}
+
+def parse_ticket_dates(ticket: dict) -> dict:
+    for field in TICKET_DATE_FIELDS:
+        if isinstance(ticket.get(field), str):
+            ticket[field] = datetime.fromisoformat(ticket[field])
+    return ticket
+
+async def names_by_id(collection, ids) -> Dict[str, str]:
+    """Resolve many ids to names with a single $in query"""
+    unique_ids = list({i for i in ids if i})
+    if not unique_ids:
+        return {}
+    docs = await collection.find({"id": {"$in": unique_ids}}, {"_id": 0, "id": 1, "name": 1}).to_list(len(unique_ids))
+    return {doc['id']: doc['name'] for doc in docs}
+
+async def fill_ticket_names(tickets: List[dict]):
+    """Set user_name, technician_name and category_name from the source collections"""
+    user_names = await names_by_id(db.users, [t['user_id'] for t in tickets] + [t.get('technician_id') for t in tickets])
+    category_names = await names_by_id(db.categories, [t['category_id'] for t in tickets])
+    for ticket in tickets:
+        ticket['user_name'] = user_names.get(ticket['user_id'], "Unknown")
+        ticket['technician_name'] = user_names.get(ticket['technician_id'], "Unknown") if ticket.get('technician_id') else None
+        ticket['category_name'] = category_names.get(ticket['category_id'], "Unknown")
+
+@api_router.post("/tickets", response_model=Ticket)
+async def create_ticket(input: CreateTicketInput, current_user: User = Depends(get_current_user)):
+    category = await db.categories.find_one({"id": input.category_id}, {"_id": 0, "name": 1})
+    
+    ticket = Ticket(
+        user_id=current_user.id,
+        title=input.title,
+        description=input.description,
+        category_id=input.category_id,
+        equipment_id=input.equipment_id,
+        priority="baja",
+        priority_rank=priority_rank("baja"),
+        status="abierto",
+        user_name=current_user.name,
+        category_name=category['name'] if category else "Unknown"
+    )
+    ticket.due_at = compute_due_at(ticket.priority, ticket.last_priority_change)
+    ticket.updated_at = ticket.created_at
+    
+    history_action = f"Ticket creado con prioridad {ticket.priority}"
+    if AUTO_ASSIGN_MODE != "off":
+        candidate = assignment_engine.pick(input.category_id, current_user.department_id)
+        if candidate and AUTO_ASSIGN_MODE == "on":
+            ticket.technician_id = candidate['id']
+            ticket.technician_name = candidate['name']
+            ticket.assigned_at = ticket.created_at
+            history_action += f" | Asignado automáticamente a técnico {candidate['name']}"
+        elif candidate:
+            logging.info(f"[dry-run] Ticket {ticket.id} would be assigned to {candidate['id']} (load {candidate['load']})")
+    
+    # Reject undecodable attachments before anything is written
+    uploads = [(att['filename'], decode_attachment(att['file_data'])) for att in input.attachments or []]
+    
+    doc = ticket.model_dump()
+    doc['created_at'] = doc['created_at'].isoformat()
+    doc['last_priority_change'] = doc['last_priority_change'].isoformat()
+    doc['due_at'] = doc['due_at'].isoformat()
+    doc['updated_at'] = doc['updated_at'].isoformat()
+    if doc['assigned_at']:
+        doc['assigned_at'] = doc['assigned_at'].isoformat()
+    await db.tickets.insert_one(doc)
+    record_ticket_change(None, doc)
+    await invalidate_ticket_lists(current_user.id)
+    
+    # Save attachments
+    for filename, content in uploads:
+        await save_attachment(ticket.id, filename, content)
+    
+    # Create history
+    await append_history(ticket.id, current_user.id, history_action)
+    
+    return ticket
+
+@api_router.get("/tickets")
+async def get_tickets(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    selected = parse_fields(fields, TICKET_FIELDS)
+    projection = fields_projection(selected)
+    wanted_names = [f for f in NAME_FIELDS if selected is None or f in selected]
+    if selected is not None and wanted_names:
+        # Legacy documents without names are filled from their ids
+        projection.update({"user_id": 1, "technician_id": 1, "category_id": 1})
+    
+    async def load_tickets():
+        if current_user.role == "cliente":
+            # Clientes solo ven sus tickets
+            tickets = await db.tickets.find({"user_id": current_user.id, **NOT_DELETED}, projection).to_list(1000)
+        else:
+            # Técnicos y admins ven todos
+            tickets = await db.tickets.find(NOT_DELETED, projection).to_list(1000)
+        
+        # Convert ISO strings to datetime
+        for ticket in tickets:
+            parse_ticket_dates(ticket)
+        
+        # Names are denormalized on the ticket; only legacy documents still need a lookup
+        legacy = [t for t in tickets if not all(f in t for f in wanted_names)]
+        if legacy:
+            await fill_ticket_names(legacy)
+        
+        if selected is not None:
+            tickets = [{f: t[f] for f in selected if f in t} for t in tickets]
+        return tickets
+    
+    params = {"fields": ",".join(selected)} if selected else {}
+    return await cached_json_response(ticket_list_scope(current_user), params, load_tickets)
+
+@api_router.get("/tickets/my-assigned")
+async def get_my_assigned_tickets(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    if current_user.role == "cliente":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    projection = fields_projection(parse_fields(fields, TICKET_FIELDS))
+    tickets = await db.tickets.find({"technician_id": current_user.id, **NOT_DELETED}, projection).to_list(1000)
+    
+    return [parse_ticket_dates(ticket) for ticket in tickets]
+
+async def find_tickets_by_due_date(due_range: dict, fields: Optional[str] = None) -> List[dict]:
+    """Open tickets whose due_at falls in due_range, most urgent first ({status, due_at} index)"""
+    tickets = await db.tickets.find(
+        {"status": {"$in": OPEN_STATUSES}, "due_at": due_range, **NOT_DELETED},
+        fields_projection(parse_fields(fields, TICKET_FIELDS))
+    ).sort("due_at", 1).to_list(1000)
+    return [parse_ticket_dates(ticket) for ticket in tickets]
+
+@api_router.get("/tickets/overdue")
+async def get_overdue_tickets(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    if current_user.role == "cliente":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    return await find_tickets_by_due_date({"$lt": now}, fields)
+
+@api_router.get("/tickets/due-soon")
+async def get_due_soon_tickets(within: float = Query(4, gt=0, description="Hours ahead"),
+                               fields: Optional[str] = FIELDS_QUERY,
+                               current_user: User = Depends(get_current_user)):
+    if current_user.role == "cliente":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    now = datetime.now(timezone.utc)
+    due_range = {"$gte": now.isoformat(), "$lt": (now + timedelta(hours=within)).isoformat()}
+    return await find_tickets_by_due_date(due_range, fields)
+
+# ----- Delta sync -----
+
+CHANGES_MAX_LIMIT = 500
+# Writes stamp updated_at before they commit; holding back the last few seconds keeps
+# a poll from moving its cursor past a write that is still in flight
+CHANGES_SETTLE_SECONDS = float(os.environ.get('CHANGES_SETTLE_SECONDS', '2'))
+TOMBSTONE_RETENTION_DAYS = int(os.environ.get('TOMBSTONE_RETENTION_DAYS', '30'))
+
+async def touch_ticket(ticket: dict):
+    """A sub-resource (comment, attachment) was written: bump updated_at so the ticket
+    shows up in /tickets/changes, and drop the cached lists that carry it"""
+    await db.tickets.update_one({"id": ticket['id']}, {"$set": {"updated_at": datetime.now(timezone.utc).isoformat()}})
+    await invalidate_ticket_lists(ticket['user_id'])
+
+async def write_tombstones(tickets: List[dict], reason: str, at: str):
+    """Record that tickets left the list (deleted or archived) for /tickets/changes"""
+    if not tickets:
+        return
+    expires_at = datetime.now(timezone.utc) + timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    await db.ticket_tombstones.bulk_write([
+        UpdateOne(
+            {"id": ticket['id']},
+            {"$set": {"user_id": ticket['user_id'], "reason": reason, "updated_at": at, "expires_at": expires_at}},
+            upsert=True
+        )
+        for ticket in tickets
+    ], ordered=False)
+
+@api_router.get("/tickets/changes")
+async def get_ticket_changes(since: Optional[str] = None, limit: int = Query(100, ge=1, le=CHANGES_MAX_LIMIT),
+                             fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    """Tickets created, modified or removed after the `since` cursor, oldest change first.
+
+    Items are {"op": "upsert", "ticket": {...}} or {"op": "delete", "id": ..., "reason": ...}.
+    Poll again with `cursor`; 410 means the cursor outlived the tombstones and the
+    client has to reload GET /tickets.
+    """
+    now = datetime.now(timezone.utc)
+    query = {"updated_at": {"$lt": (now - timedelta(seconds=CHANGES_SETTLE_SECONDS)).isoformat()}}
+    if since:
+        timestamp, entry_id = decode_cursor(since)
+        if timestamp < (now - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat():
+            raise HTTPException(status_code=410, detail="Cursor expired, reload the ticket list")
+        query = {"$and": [query, {"$or": [
+            {"updated_at": {"$gt": timestamp}},
+            {"updated_at": timestamp, "id": {"$gt": entry_id}},
+        ]}]}
+    if current_user.role == "cliente":
+        query["user_id"] = current_user.id
+    
+    projection = fields_projection(parse_fields(fields, TICKET_FIELDS))
+    if fields is not None:
+        projection["updated_at"] = 1
+    order = [("updated_at", 1), ("id", 1)]
+    tickets = await db.tickets.find({**query, **NOT_DELETED}, projection).sort(order).limit(limit + 1).to_list(limit + 1)
+    tombstones = await db.ticket_tombstones.find(
+        query, {"_id": 0, "id": 1, "reason": 1, "updated_at": 1}
+    ).sort(order).limit(limit + 1).to_list(limit + 1)
+    
+    entries = sorted(
+        [("upsert", t) for t in tickets] + [("delete", t) for t in tombstones],
+        key=lambda entry: (entry[1]['updated_at'], entry[1]['id'])
+    )
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    cursor = encode_cursor(entries[-1][1]['updated_at'], entries[-1][1]['id']) if entries else since
+    
+    items = [
+        {"op": "upsert", "ticket": parse_ticket_dates(doc)} if op == "upsert"
+        else {"op": "delete", "id": doc['id'], "reason": doc['reason'], "updated_at": doc['updated_at']}
+        for op, doc in entries
+    ]
+    return {"items": items, "cursor": cursor, "has_more": has_more}
+
+@api_router.post("/queue/claim", response_model=Ticket)
+async def claim_next_ticket(current_user: User = Depends(get_current_user)):
+    """Assign the most urgent, oldest unassigned ticket to the caller.
+
+    A single find_one_and_update, so concurrent claims never get the same ticket.
+    """
+    if current_user.role != "tecnico":
+        raise HTTPException(status_code=403, detail="Only technicians can claim tickets")
+    
+    now = datetime.now(timezone.utc).isoformat()
+    claimed = await db.tickets.find_one_and_update(
+        {"status": "abierto", "technician_id": None, **NOT_DELETED},
+        {"$set": {"technician_id": current_user.id, "technician_name": current_user.name,
+                  "assigned_at": now, "updated_at": now}},
+        sort=[("priority_rank", -1), ("created_at", 1)],
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not claimed:
+        raise HTTPException(status_code=404, detail="No unassigned tickets")
+    record_ticket_change({**claimed, "technician_id": None}, claimed)
+    await invalidate_ticket_lists(claimed['user_id'])
+    
+    await append_history(claimed['id'], current_user.id, f"Tomado de la cola por técnico {current_user.name}")
+    
+    return Ticket(**parse_ticket_dates(claimed))
+
+@api_router.get("/tickets/my-resolved")
+async def get_my_resolved_tickets(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    if current_user.role == "cliente":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    tickets = await db.tickets.find({
+        "technician_id": current_user.id,
+        "status": "cerrado",
+        **NOT_DELETED
+    }, fields_projection(parse_fields(fields, TICKET_FIELDS))).to_list(1000)
+    
+    return [parse_ticket_dates(ticket) for ticket in tickets]
+
+async def load_readable_ticket(ticket_id: str, current_user: User, projection: Optional[dict] = None) -> tuple:
+    """Return (ticket_doc, collections) for a hot or archived ticket the user may read"""
+    projection = projection or {"_id": 0}
+    ticket_doc = await db.tickets.find_one({"id": ticket_id, **NOT_DELETED}, projection)
+    collections = HOT_COLLECTIONS
+    if not ticket_doc:
+        # Closed tickets moved out by the archival job stay readable
+        ticket_doc = await db.tickets_archive.find_one({"id": ticket_id}, projection)
+        collections = ARCHIVE_COLLECTIONS
+    if not ticket_doc:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    
+    # Check permissions
+    if current_user.role == "cliente" and ticket_doc['user_id'] != current_user.id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return ticket_doc, collections
+
+def encode_cursor(timestamp: str, entry_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp}|{entry_id}".encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        timestamp, entry_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|', 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return timestamp, entry_id
+
+async def fetch_ticket_entries(collection: str, ticket_id: str, time_field: str, limit: int,
+                               after: Optional[str] = None, before: Optional[str] = None,
+                               descending: bool = False) -> tuple:
+    """Keyset page over {ticket_id, time_field}: returns (docs, has_more)"""
+    query = {"ticket_id": ticket_id}
+    if after:
+        timestamp, entry_id = decode_cursor(after)
+        query["$or"] = [{time_field: {"$gt": timestamp}}, {time_field: timestamp, "id": {"$gt": entry_id}}]
+        descending = False
+    elif before:
+        timestamp, entry_id = decode_cursor(before)
+        query["$or"] = [{time_field: {"$lt": timestamp}}, {time_field: timestamp, "id": {"$lt": entry_id}}]
+        descending = True
+    
+    direction = -1 if descending else 1
+    docs = await db[collection].find(query, {"_id": 0}).sort(
+        [(time_field, direction), ("id", direction)]
+    ).limit(limit + 1).to_list(limit + 1)
+    return docs[:limit], len(docs) > limit
+
+# History is stored in buckets: one document per ticket per HISTORY_BUCKET_SIZE events,
+# {id, ticket_id, count, first_at, last_at, events: [{id, user_id, action, timestamp}]}
+HISTORY_BUCKET_SIZE = int(os.environ.get('HISTORY_BUCKET_SIZE', '50'))
+
+async def append_history(ticket_id: str, user_id: str, action: str):
+    """Push an event into the ticket's open bucket; the upsert opens a new one when all are full"""
+    entry = TicketHistory(ticket_id=ticket_id, user_id=user_id, action=action).model_dump(exclude={"ticket_id"})
+    entry['timestamp'] = entry['timestamp'].isoformat()
+    await db[HOT_COLLECTIONS['ticket_history']].update_one(
+        {"ticket_id": ticket_id, "count": {"$lt": HISTORY_BUCKET_SIZE}},
+        {
+            "$push": {"events": entry},
+            "$inc": {"count": 1},
+            "$min": {"first_at": entry['timestamp']},
+            "$max": {"last_at": entry['timestamp']},
+            "$setOnInsert": {"id": str(uuid.uuid4())},
+        },
+        upsert=True
+    )
+
+async def fetch_history_entries(collection: str, ticket_id: str, limit: int,
+                                after: Optional[str] = None, before: Optional[str] = None) -> tuple:
+    """Keyset page over the events of the ticket's history buckets, newest first
+    (oldest first with `after`): returns (docs, has_more) like fetch_ticket_entries"""
+    query = {"ticket_id": ticket_id}
+    bound, descending = None, True
+    if after:
+        bound, descending = decode_cursor(after), False
+        query["last_at"] = {"$gte": bound[0]}
+    elif before:
+        bound = decode_cursor(before)
+        query["first_at"] = {"$lte": bound[0]}
+    
+    def key(event):
+        return event['timestamp'], event['id']
+    
+    entries = []
+    order = ("last_at", -1) if descending else ("first_at", 1)
+    async for bucket in db[collection].find(query, {"_id": 0, "events": 1, "first_at": 1, "last_at": 1}).sort(*order):
+        # Buckets arrive in last_at (first_at) order, so once limit + 1 events are
+        # closer than anything this bucket holds, no later bucket can contribute
+        if len(entries) > limit:
+            entries.sort(key=key, reverse=descending)
+            edge = entries[limit]['timestamp']
+            if (bucket['last_at'] < edge) if descending else (bucket['first_at'] > edge):
+                break
+        for event in bucket['events']:
+            if bound and (key(event) >= bound if descending else key(event) <= bound):
+                continue
+            entries.append(event)
+    
+    entries.sort(key=key, reverse=descending)
+    docs = [{**event, "ticket_id": ticket_id} for event in entries[:limit]]
+    return docs, len(entries) > limit
+
+async def count_history_entries(collection: str, ticket_id: str) -> int:
+    # Events, not the bucket counters: migrated buckets are closed with count = HISTORY_BUCKET_SIZE
+    result = await db[collection].aggregate([
+        {"$match": {"ticket_id": ticket_id}},
+        {"$group": {"_id": None, "total": {"$sum": {"$size": "$events"}}}},
+    ]).to_list(1)
+    return result[0]['total'] if result else 0
+
+def entries_to_dicts(docs: List[dict], time_field: str, model, author_names: Dict[str, str]) -> List[dict]:
+    entries = []
+    for doc in docs:
+        if isinstance(doc.get(time_field), str):
+            doc[time_field] = datetime.fromisoformat(doc[time_field])
+        entry = model(**doc).model_dump()
+        entry['user_name'] = author_names.get(entry['user_id'], "Unknown")
+        entries.append(entry)
+    return entries
+
+def page_cursor(docs: List[dict], time_field: str) -> Optional[str]:
+    """Cursor pointing at the last doc of a page (taken before datetime conversion)"""
+    if not docs:
+        return None
+    return encode_cursor(docs[-1][time_field], docs[-1]['id'])
+
+# Embedded documents of the ticket detail; `?fields=user.name` trims them too
+DETAIL_RELATION_FIELDS = {
+    "user": USER_FIELDS,
+    "technician": USER_FIELDS,
+    "category": set(Category.model_fields),
+    "equipment": EQUIPMENT_FIELDS,
+    "attachments": set(Attachment.model_fields),
+}
+DETAIL_FIELDS = (
+    TICKET_FIELDS | set(DETAIL_RELATION_FIELDS) | {"archived", "comments", "history", "comments_cursor", "history_cursor", "comments_total", "history_total"}
+    | {f"{relation}.{field}" for relation, names in DETAIL_RELATION_FIELDS.items() for field in names}
+)
+
+def parse_detail_fields(fields: Optional[str]) -> Optional[Dict[str, Optional[List[str]]]]:
+    """{top-level name: None for the whole value, or the sub-fields of an embedded document}"""
+    selected = parse_fields(fields, DETAIL_FIELDS)
+    if selected is None:
+        return None
+    result = {}
+    for name in selected:
+        top, _, sub = name.partition('.')
+        if not sub:
+            result[top] = None
+        elif result.get(top, []) is not None:
+            result.setdefault(top, []).append(sub)
+    return result
+
+@api_router.get("/tickets/{ticket_id}")
+async def get_ticket(ticket_id: str, fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    selected = parse_detail_fields(fields)
+    
+    def wants(name: str) -> bool:
+        return selected is None or name in selected
+    
+    def relation_projection(name: str, default: dict) -> dict:
+        sub_fields = selected.get(name) if selected else None
+        return fields_projection(["id", *sub_fields] if sub_fields else None, default)
+    
+    projection = {"_id": 0}
+    if selected is not None:
+        projection.update({name: 1 for name in selected if name in TICKET_FIELDS})
+        # Ids needed for the permission check and the embedded documents
+        projection.update({"user_id": 1, "technician_id": 1, "category_id": 1, "equipment_id": 1})
+    ticket_doc, collections = await load_readable_ticket(ticket_id, current_user, projection)
+    
+    if selected is None:
+        ticket_dict = Ticket(**ticket_doc).model_dump()
+    else:
+        ticket_dict = {name: value for name, value in parse_ticket_dates(ticket_doc).items() if name in selected}
+    if wants("archived"):
+        ticket_dict['archived'] = collections is ARCHIVE_COLLECTIONS
+    
+    # Get user info
+    if wants("user"):
+        ticket_dict['user'] = await db.users.find_one(
+            {"id": ticket_doc['user_id']}, relation_projection("user", USER_PROJECTION)
+        )
+    
+    # Get technician info
+    if wants("technician") and ticket_doc.get('technician_id'):
+        ticket_dict['technician'] = await db.users.find_one(
+            {"id": ticket_doc['technician_id']}, relation_projection("technician", USER_PROJECTION)
+        )
+    
+    # Get category
+    if wants("category"):
+        ticket_dict['category'] = await db.categories.find_one(
+            {"id": ticket_doc['category_id']}, relation_projection("category", {"_id": 0})
+        )
+    
+    # Get equipment
+    if wants("equipment") and ticket_doc.get('equipment_id'):
+        ticket_dict['equipment'] = await db.equipments.find_one(
+            {"id": ticket_doc['equipment_id']}, relation_projection("equipment", {"_id": 0})
+        )
+    
+    # Only the latest entries are embedded; older ones come from the paginated endpoints,
+    # starting at the *_cursor. Totals are only counted when there is more than the page.
+    comments_docs, history_docs = [], []
+    if wants("comments") or wants("comments_cursor") or wants("comments_total"):
+        comments_docs, comments_has_more = await fetch_ticket_entries(
+            collections['comments'], ticket_id, "created_at", DETAIL_EMBED_LIMIT, descending=True
+        )
+        if wants("comments_cursor"):
+            ticket_dict['comments_cursor'] = page_cursor(comments_docs, "created_at") if comments_has_more else None
+        if wants("comments_total"):
+            ticket_dict['comments_total'] = await db[collections['comments']].count_documents(
+                {"ticket_id": ticket_id}
+            ) if comments_has_more else len(comments_docs)
+    if wants("history") or wants("history_cursor") or wants("history_total"):
+        history_docs, history_has_more = await fetch_history_entries(
+            collections['ticket_history'], ticket_id, DETAIL_EMBED_LIMIT
+        )
+        if wants("history_cursor"):
+            ticket_dict['history_cursor'] = page_cursor(history_docs, "timestamp") if history_has_more else None
+        if wants("history_total"):
+            ticket_dict['history_total'] = await count_history_entries(
+                collections['ticket_history'], ticket_id
+            ) if history_has_more else len(history_docs)
+    
+    # Resolve author names for comments and history in one query
+    if wants("comments") or wants("history"):
+        author_names = await names_by_id(db.users, [c['user_id'] for c in comments_docs] + [h['user_id'] for h in history_docs])
+    
+    # Comments are shown oldest first
+    if wants("comments"):
+        ticket_dict['comments'] = entries_to_dicts(comments_docs[::-1], "created_at", Comment, author_names)
+    if wants("history"):
+        ticket_dict['history'] = entries_to_dicts(history_docs, "timestamp", TicketHistory, author_names)
+    
+    # Get attachments
+    if wants("attachments"):
+        # Thumbnails by default; the originals only when file_data is asked for explicitly
+        sub_fields = selected.get("attachments") if selected else None
+        with_data = bool(sub_fields) and "file_data" in sub_fields
+        derived = tuple(f for f in BLOB_DERIVED_FIELDS if not sub_fields or f in sub_fields)
+        projection = relation_projection("attachments", {"_id": 0})
+        if sub_fields and (with_data or derived):
+            projection["digest"] = 1  # needed to resolve the blob
+        attachments_docs = await db[collections['attachments']].find(
+            {"ticket_id": ticket_id}, projection
+        ).to_list(1000)
+        await resolve_attachment_blobs(attachments_docs, with_data, derived)
+        for att_doc in attachments_docs:
+            if isinstance(att_doc.get('uploaded_at'), str):
+                att_doc['uploaded_at'] = datetime.fromisoformat(att_doc['uploaded_at'])
+            if sub_fields and "digest" not in sub_fields:
+                att_doc.pop('digest', None)
+        ticket_dict['attachments'] = attachments_docs
+    
+    return ticket_dict
+
+@api_router.get("/tickets/{ticket_id}/comments")
+async def get_ticket_comments(ticket_id: str, after: Optional[str] = None, before: Optional[str] = None,
+                              limit: int = Query(50, ge=1, le=PAGE_MAX_LIMIT),
+                              current_user: User = Depends(get_current_user)):
+    """Comments oldest first; `after` pages forward, `before` pages back from a cursor"""
+    _, collections = await load_readable_ticket(ticket_id, current_user, {"_id": 0, "user_id": 1})
+    docs, has_more = await fetch_ticket_entries(collections['comments'], ticket_id, "created_at", limit, after, before)
+    next_cursor = page_cursor(docs, "created_at") if has_more else None
+    author_names = await names_by_id(db.users, [d['user_id'] for d in docs])
+    return {"items": entries_to_dicts(docs, "created_at", Comment, author_names), "next_cursor": next_cursor}
+
+@api_router.get("/tickets/{ticket_id}/history")
+async def get_ticket_history(ticket_id: str, before: Optional[str] = None, after: Optional[str] = None,
+                             limit: int = Query(50, ge=1, le=PAGE_MAX_LIMIT),
+                             current_user: User = Depends(get_current_user)):
+    """History newest first; `before` pages back, `after` returns newer entries"""
+    _, collections = await load_readable_ticket(ticket_id, current_user, {"_id": 0, "user_id": 1})
+    docs, has_more = await fetch_history_entries(collections['ticket_history'], ticket_id, limit, after, before)
+    next_cursor = page_cursor(docs, "timestamp") if has_more else None
+    author_names = await names_by_id(db.users, [d['user_id'] for d in docs])
+    return {"items": entries_to_dicts(docs, "timestamp", TicketHistory, author_names), "next_cursor": next_cursor}
+
+@api_router.put("/tickets/{ticket_id}")
+async def update_ticket(ticket_id: str, input: UpdateTicketInput, current_user: User = Depends(get_current_user)):
+    ticket_doc = await db.tickets.find_one({"id": ticket_id, **NOT_DELETED}, {"_id": 0})
+    if not ticket_doc:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    
+    ticket = Ticket(**ticket_doc)
+    
+    # Check permissions
+    if current_user.role == "cliente":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    update_data = {}
+    history_action = []
+    
+    if input.status:
+        update_data['status'] = input.status
+        history_action.append(f"Estado cambiado a {input.status}")
+        
+        if input.status == "cerrado":
+            update_data['closed_at'] = datetime.now(timezone.utc).isoformat()
+    
+    if input.priority:
+        old_priority = ticket.priority
+        now = datetime.now(timezone.utc)
+        update_data['priority'] = input.priority
+        update_data['priority_rank'] = priority_rank(input.priority)
+        update_data['last_priority_change'] = now.isoformat()
+        update_data['due_at'] = compute_due_at(input.priority, now).isoformat()
+        history_action.append(f"Prioridad cambiada de {old_priority} a {input.priority}")
+    
+    if input.technician_id:
+        if not ticket.technician_id:
+            update_data['assigned_at'] = datetime.now(timezone.utc).isoformat()
+        update_data['technician_id'] = input.technician_id
+        tech = await db.users.find_one({"id": input.technician_id}, {"_id": 0})
+        tech_name = tech['name'] if tech else "Unknown"
+        update_data['technician_name'] = tech_name
+        history_action.append(f"Asignado a técnico {tech_name}")
     
     if update_data:
+        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
         await db.tickets.update_one({"id": ticket_id}, {"$set": update_data})
+        record_ticket_change(ticket_doc, {**ticket_doc, **update_data})
+        await invalidate_ticket_lists(ticket.user_id)
         
         # Add history
-        history = TicketHistory(
-            ticket_id=ticket_id,
-            user_id=current_user.id,
-            action=" | ".join(history_action)
-        )
-        hist_doc = history.model_dump()
-        hist_doc['timestamp'] = hist_doc['timestamp'].isoformat()
-        await db.ticket_history.insert_one(hist_doc)
+        await append_history(ticket_id, current_user.id, " | ".join(history_action))
     
     # Get updated ticket
     updated_ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
-    if isinstance(updated_ticket.get('created_at'), str):
-        updated_ticket['created_at'] = datetime.fromisoformat(updated_ticket['created_at'])
-    if isinstance(updated_ticket.get('last_priority_change'), str):
-        updated_ticket['last_priority_change'] = datetime.fromisoformat(updated_ticket['last_priority_change'])
-    if updated_ticket.get('assigned_at') and isinstance(updated_ticket['assigned_at'], str):
-        updated_ticket['assigned_at'] = datetime.fromisoformat(updated_ticket['assigned_at'])
-    if updated_ticket.get('closed_at') and isinstance(updated_ticket['closed_at'], str):
-        updated_ticket['closed_at'] = datetime.fromisoformat(updated_ticket['closed_at'])
-    
-    return Ticket(**updated_ticket)
+    return Ticket(**parse_ticket_dates(updated_ticket))
 
 @api_router.delete("/tickets/{ticket_id}")
 async def delete_ticket(ticket_id: str, current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Only admins can delete tickets")
     
-    result = await db.tickets.delete_one({"id": ticket_id})
-    if result.deleted_count == 0:
+    # Soft delete: related data is purged later by collect_deleted_tickets
+    now = datetime.now(timezone.utc).isoformat()
+    deleted = await db.tickets.find_one_and_update(
+        {"id": ticket_id, **NOT_DELETED},
+        {"$set": {"deleted_at": now, "deleted_by": current_user.id, "updated_at": now}},
+        projection={"_id": 0}
+    )
+    if not deleted:
         raise HTTPException(status_code=404, detail="Ticket not found")
+    await write_tombstones([deleted], "deleted", now)
+    record_ticket_change(deleted, None)
+    await invalidate_ticket_lists(deleted['user_id'])
+    gc_metrics['soft_deleted'] += 1
+    
+    return {"message": "Ticket deleted successfully", "restorable_for_hours": RESTORE_WINDOW_HOURS}
+
+@api_router.post("/tickets/{ticket_id}/restore")
+async def restore_ticket(ticket_id: str, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can restore tickets")
     
-    # Delete related data
-    await db.comments.delete_many({"ticket_id": ticket_id})
-    await db.attachments.delete_many({"ticket_id": ticket_id})
-    await db.ticket_history.delete_many({"ticket_id": ticket_id})
+    window_start = (datetime.now(timezone.utc) - timedelta(hours=RESTORE_WINDOW_HOURS)).isoformat()
+    restored = await db.tickets.find_one_and_update(
+        {"id": ticket_id, "deleted_at": {"$gte": window_start}},
+        {"$unset": {"deleted_at": "", "deleted_by": ""}, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not restored:
+        raise HTTPException(status_code=404, detail="No deleted ticket to restore")
+    await db.ticket_tombstones.delete_one({"id": ticket_id})
+    record_ticket_change(None, restored)
+    await invalidate_ticket_lists(restored['user_id'])
+    gc_metrics['restored'] += 1
     
-    return {"message": "Ticket deleted successfully"}
+    return {"message": "Ticket restored successfully"}
 
 # ============= COMMENT ENDPOINTS =============
 
 @api_router.post("/tickets/{ticket_id}/comments")
 async def create_comment(ticket_id: str, input: CreateCommentInput, current_user: User = Depends(get_current_user)):
     # Check ticket exists
-    ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
+    ticket = await db.tickets.find_one({"id": ticket_id, **NOT_DELETED}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     
@@ -646,107 +2202,755 @@ async def create_comment(ticket_id: str, input: CreateCommentInput, current_user
     doc = comment.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     await db.comments.insert_one(doc)
+    await touch_ticket(ticket)
     
     # Add to history
-    history = TicketHistory(
-        ticket_id=ticket_id,
-        user_id=current_user.id,
-        action="Comentario agregado"
-    )
-    hist_doc = history.model_dump()
-    hist_doc['timestamp'] = hist_doc['timestamp'].isoformat()
-    await db.ticket_history.insert_one(hist_doc)
+    await append_history(ticket_id, current_user.id, "Comentario agregado")
     
     return comment
 
+# ============= ATTACHMENT STORAGE =============
+# Attachments are content-addressed: each row keeps {digest, size} and the bytes live
+# once per SHA-256 in attachment_blobs. A blob's refcount is the number of attachment
+# rows (hot or archived) pointing at it; blobs left at zero are collected after a grace period.
+
+BLOB_GC_GRACE_MINUTES = int(os.environ.get('BLOB_GC_GRACE_MINUTES', '60'))
+# Fields the processing pipeline stores on the blob and the ticket detail embeds
+BLOB_DERIVED_FIELDS = ("mime_type", "thumbnail", "text_preview")
+
+attachment_metrics = Counter()
+
+def decode_attachment(file_data: str) -> bytes:
+    try:
+        return base64.b64decode(file_data, validate=True)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Attachment file_data must be base64")
+
+async def reference_blob(content: bytes) -> str:
+    """Add a reference to the blob holding `content`, storing it only if its digest is new"""
+    digest = hashlib.sha256(content).hexdigest()
+    while True:
+        result = await db.attachment_blobs.update_one(
+            {"digest": digest},
+            {"$inc": {"refcount": 1}, "$unset": {"unreferenced_at": ""}}
+        )
+        if result.matched_count:
+            attachment_metrics['dedup_hits'] += 1
+            attachment_metrics['bytes_deduplicated'] += len(content)
+            return digest
+        try:
+            await db.attachment_blobs.insert_one({
+                "digest": digest,
+                "data": bson.Binary(content),
+                "size": len(content),
+                "refcount": 1,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+        except DuplicateKeyError:
+            continue  # a concurrent upload stored it first; reference that one
+        attachment_metrics['blobs_stored'] += 1
+        attachment_metrics['bytes_stored'] += len(content)
+        await enqueue_attachment_job(digest)  # new content only; duplicates were processed already
+        return digest
+
+async def release_blobs(digests: List[str]):
+    """Drop one reference per digest occurrence, after the attachment rows were deleted"""
+    for digest, count in Counter(d for d in digests if d).items():
+        blob = await db.attachment_blobs.find_one_and_update(
+            {"digest": digest}, {"$inc": {"refcount": -count}},
+            projection={"_id": 0, "refcount": 1}, return_document=ReturnDocument.AFTER
+        )
+        if blob and blob['refcount'] <= 0:
+            await db.attachment_blobs.update_one(
+                {"digest": digest, "refcount": {"$lte": 0}},
+                {"$set": {"unreferenced_at": datetime.now(timezone.utc).isoformat()}}
+            )
+
+async def save_attachment(ticket_id: str, filename: str, content: bytes) -> Attachment:
+    # Reference first: a crash in between leaves an over-counted blob, never a dangling row
+    digest = await reference_blob(content)
+    attachment = Attachment(ticket_id=ticket_id, filename=filename, digest=digest, size=len(content))
+    doc = attachment.model_dump(exclude={"file_data", *BLOB_DERIVED_FIELDS})  # these live on the blob
+    doc['uploaded_at'] = doc['uploaded_at'].isoformat()
+    await db.attachments.insert_one(doc)
+    return attachment
+
+async def resolve_attachment_blobs(attachments: List[dict], with_data: bool = False,
+                                   derived: tuple = BLOB_DERIVED_FIELDS):
+    """Fill file_data and/or the processed fields from the blobs in one query.
+    file_data is verified against the digest; originals are only loaded when asked for."""
+    digests = list({a['digest'] for a in attachments if a.get('digest')})
+    projection = {"_id": 0, "digest": 1, **{name: 1 for name in derived}}
+    if with_data:
+        projection["data"] = 1
+    blobs = {}
+    if digests and (with_data or derived):
+        async for blob in db.attachment_blobs.find({"digest": {"$in": digests}}, projection):
+            blobs[blob['digest']] = blob
+    for att in attachments:
+        legacy_data = att.pop('file_data', None)  # row that still embeds its data
+        if not att.get('digest'):
+            if with_data:
+                att['file_data'] = legacy_data
+            continue
+        blob = blobs.get(att['digest'], {})
+        for name in derived:
+            value = blob.get(name)
+            att[name] = base64.b64encode(value).decode('ascii') if isinstance(value, bytes) else value
+        if not with_data:
+            continue
+        content = blob.get('data')
+        if content is None or hashlib.sha256(content).hexdigest() != att['digest']:
+            logging.error(f"Attachment {att.get('id')} failed integrity check (blob {att['digest']})")
+            attachment_metrics['integrity_failures'] += 1
+            att['file_data'] = None
+            att['corrupted'] = True
+            continue
+        att['file_data'] = base64.b64encode(content).decode('ascii')
+
 # ============= ATTACHMENT ENDPOINTS =============
 
 @api_router.post("/tickets/{ticket_id}/attachments")
 async def add_attachment(ticket_id: str, filename: str, file_data: str, current_user: User = Depends(get_current_user)):
     # Check ticket exists
-    ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
+    ticket = await db.tickets.find_one({"id": ticket_id, **NOT_DELETED}, {"_id": 0})
     if not ticket:
         raise HTTPException(status_code=404, detail="Ticket not found")
     
-    attachment = Attachment(
-        ticket_id=ticket_id,
-        filename=filename,
-        file_data=file_data
+    attachment = await save_attachment(ticket_id, filename, decode_attachment(file_data))
+    await touch_ticket(ticket)
+    return attachment
+
+@api_router.get("/tickets/{ticket_id}/attachments/{attachment_id}/content")
+async def get_attachment_content(ticket_id: str, attachment_id: str, original: bool = False,
+                                 current_user: User = Depends(get_current_user)):
+    """The attachment bytes: the recompressed copy when there is one, unless original=true"""
+    _, collections = await load_readable_ticket(ticket_id, current_user, {"_id": 0, "user_id": 1})
+    att = await db[collections['attachments']].find_one(
+        {"id": attachment_id, "ticket_id": ticket_id}, {"_id": 0}
     )
+    if not att:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    if not att.get('digest'):
+        content = base64.b64decode(att.get('file_data') or "")
+        return Response(content=content, media_type=attachment_processing.sniff_mime(content))
     
-    doc = attachment.model_dump()
-    doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-    await db.attachments.insert_one(doc)
+    projection = {"_id": 0, "mime_type": 1}
+    projection.update({"data": 1} if original else {"data": 1, "optimized": 1, "optimized_mime_type": 1})
+    blob = await db.attachment_blobs.find_one({"digest": att['digest']}, projection) or {}
+    if not original and blob.get('optimized'):
+        content, media_type = blob['optimized'], blob['optimized_mime_type']
+    else:
+        content = blob.get('data')
+        if content is None or hashlib.sha256(content).hexdigest() != att['digest']:
+            logging.error(f"Attachment {attachment_id} failed integrity check (blob {att['digest']})")
+            attachment_metrics['integrity_failures'] += 1
+            raise HTTPException(status_code=500, detail="Attachment content is corrupted")
+        media_type = blob.get('mime_type') or "application/octet-stream"
+    filename = urllib.parse.quote(att['filename'])
+    return Response(content=content, media_type=media_type, headers={
+        "Cache-Control": "private, max-age=86400",  # content-addressed: never changes
+        "Content-Disposition": f"inline; filename*=UTF-8''{filename}",
+    })
+
+# ============= DEPARTMENT ENDPOINTS =============
+
+@api_router.post("/departments")
+async def create_department(input: CreateDepartmentInput, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create departments")
     
-    return attachment
+    department = Department(name=input.name, description=input.description)
+    await db.departments.insert_one(department.model_dump())
+    return department
+
+@api_router.get("/departments")
+async def get_departments():
+    departments = await db.departments.find({}, {"_id": 0}).to_list(1000)
+    return departments
+
+# ============= CATEGORY ENDPOINTS =============
+
+@api_router.post("/categories")
+async def create_category(input: CreateCategoryInput, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can create categories")
+    
+    category = Category(name=input.name, description=input.description)
+    await db.categories.insert_one(category.model_dump())
+    return category
+
+@api_router.get("/categories")
+async def get_categories():
+    categories = await db.categories.find({}, {"_id": 0}).to_list(1000)
+    return categories
+
+@api_router.put("/categories/{category_id}")
+async def update_category(category_id: str, input: UpdateCategoryInput, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can update categories")
+    
+    update_data = input.model_dump(exclude_none=True)
+    category = await db.categories.find_one_and_update(
+        {"id": category_id},
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    ) if update_data else await db.categories.find_one({"id": category_id}, {"_id": 0})
+    if not category:
+        raise HTTPException(status_code=404, detail="Category not found")
+    
+    if 'name' in update_data:
+        schedule_background(fan_out_rename("category", category_id, category['name']))
+    return category
+
+# ============= STREAMING IMPORTS =============
+
+# Shared by the equipment import and user provisioning: the body is parsed as it
+# arrives into (line, fields, error) records, and bad rows become per-line errors
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', '1000'))
+
+async def stream_lines(request: Request):
+    """(line number, text) of the request body as it arrives, without buffering it whole.
+
+    Lines are split as bytes and decoded one by one (a newline byte never occurs inside
+    a UTF-8 sequence), so invalid UTF-8 raises at the line that holds it.
+    """
+    pending = b""
+    number = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            number += 1
+            # utf-8-sig drops the BOM spreadsheets add
+            yield number, line.decode("utf-8-sig" if number == 1 else "utf-8").rstrip("\r")
+    if pending:
+        yield number + 1, pending.decode("utf-8-sig" if number == 0 else "utf-8").rstrip("\r")
+
+async def csv_records(lines):
+    """(line, fields, error) per CSV row, keyed by the lower-cased header row"""
+    header = None
+    async for number, text in lines:
+        # An odd number of quotes means a quoted field continues on the next line
+        while text.count('"') % 2:
+            try:
+                _, more = await anext(lines)
+            except StopAsyncIteration:
+                break
+            text += "\n" + more
+        if not text.strip():
+            continue
+        row = next(csv.reader([text]))
+        if header is None:
+            header = [column.strip().lower() for column in row]
+            continue
+        if len(row) > len(header):
+            yield number, None, f"Expected {len(header)} columns, got {len(row)}"
+            continue
+        yield number, dict(zip(header, row)), None
+
+async def ndjson_records(lines):
+    """(line, fields, error) per JSON object line"""
+    async for number, text in lines:
+        if not text.strip():
+            continue
+        try:
+            doc = json.loads(text)
+        except ValueError as e:
+            yield number, None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(doc, dict):
+            yield number, None, "Expected a JSON object"
+            continue
+        yield number, doc, None
+
+IMPORT_PARSERS = {
+    "text/csv": csv_records,
+    "application/x-ndjson": ndjson_records,
+    "application/jsonl": ndjson_records,
+}
+
+def import_parser(request: Request):
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    parser = IMPORT_PARSERS.get(content_type)
+    if parser is None:
+        raise HTTPException(status_code=415, detail=f"Send one of: {', '.join(IMPORT_PARSERS)}")
+    return parser
+
+def validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+
+def clean_row(fields: dict, columns) -> dict:
+    """Known columns only, stripped; empty cells are dropped"""
+    values = {}
+    for key, value in fields.items():
+        if isinstance(value, str):
+            value = value.strip()
+        if key in columns and value not in (None, ""):
+            values[key] = value
+    return values
+
+def add_import_error(report: dict, line: int, error: str):
+    report['failed'] += 1
+    if len(report['errors']) < IMPORT_MAX_ERRORS:
+        report['errors'].append({"line": line, "error": error})
+    else:
+        report['errors_truncated'] = True
+
+def new_import_report(**counters) -> dict:
+    return {"rows": 0, **counters, "failed": 0, "errors": [], "errors_truncated": False}
+
+async def run_import(records, parse_row, write_batch, batch_size: int, report: dict) -> dict:
+    """Validate records with parse_row and pass them to write_batch(batch, report)
+    batch_size at a time; a ValueError from parse_row fails only that row"""
+    started = time.perf_counter()
+    batch = []
+    line = 0
+    try:
+        async for line, fields, error in records:
+            report['rows'] += 1
+            try:
+                if error:
+                    raise ValueError(error)
+                batch.append((line, parse_row(fields)))
+            except ValueError as e:
+                add_import_error(report, line, str(e))
+            if len(batch) >= batch_size:
+                await write_batch(batch, report)
+                batch = []
+    except UnicodeDecodeError:
+        add_import_error(report, line + 1, "Not valid UTF-8; the rest of the file was not imported")
+    if batch:
+        await write_batch(batch, report)
+    
+    report['errors'].sort(key=lambda error: error['line'])  # reference checks run per batch, after parsing
+    report['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+async def known_ids(collection, ids) -> set:
+    """The subset of ids that exist, with a single $in query"""
+    if not ids:
+        return set()
+    docs = await collection.find({"id": {"$in": list(ids)}}, {"_id": 0, "id": 1}).to_list(None)
+    return {doc['id'] for doc in docs}
+
+# ============= EQUIPMENT ENDPOINTS =============
+
+EQUIPMENT_IMPORT_BATCH_SIZE = int(os.environ.get('EQUIPMENT_IMPORT_BATCH_SIZE', '500'))
+EQUIPMENT_IMPORT_COLUMNS = set(CreateEquipmentInput.model_fields)
+
+@api_router.post("/equipments")
+async def create_equipment(input: CreateEquipmentInput, current_user: User = Depends(get_current_user)):
+    equipment = Equipment(
+        name=input.name,
+        type=input.type,
+        brand=input.brand,
+        model=input.model,
+        serial_number=input.serial_number,
+        user_id=input.user_id,
+        department_id=input.department_id
+    )
+    try:
+        await db.equipments.insert_one(equipment.model_dump())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Serial number already registered")
+    return equipment
+
+@api_router.get("/equipments")
+async def get_equipments(user_id: Optional[str] = None, department_id: Optional[str] = None,
+                         after: Optional[str] = None, limit: int = Query(100, ge=1, le=PAGE_MAX_LIMIT),
+                         fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    """Devices ordered by id; `after` continues from the previous page's next_cursor.
+
+    Clientes only see the devices assigned to them or to their department.
+    """
+    query = {}
+    if user_id:
+        query["user_id"] = user_id
+    if department_id:
+        query["department_id"] = department_id
+    if current_user.role == "cliente":
+        if (user_id and user_id != current_user.id) or (department_id and department_id != current_user.department_id):
+            raise HTTPException(status_code=403, detail="Access denied")
+        if not query:
+            scopes = [{"user_id": current_user.id}]
+            if current_user.department_id:
+                scopes.append({"department_id": current_user.department_id})
+            query["$or"] = scopes
+    if after:
+        query["id"] = {"$gt": after}
+    
+    # {user_id, id} and {department_id, id} serve both the filter and the sort
+    projection = fields_projection(parse_fields(fields, EQUIPMENT_FIELDS))
+    docs = await db.equipments.find(query, projection).sort("id", 1).limit(limit + 1).to_list(limit + 1)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    return {"items": docs, "next_cursor": docs[-1]['id'] if has_more else None}
+
+def parse_equipment_row(fields: dict) -> dict:
+    """Validated values of one import row; empty cells mean "leave as is" """
+    try:
+        equipment = CreateEquipmentInput(**clean_row(fields, EQUIPMENT_IMPORT_COLUMNS))
+    except ValidationError as e:
+        raise ValueError(validation_message(e))
+    if not equipment.serial_number:
+        raise ValueError("serial_number: Field required")
+    return equipment.model_dump(exclude_none=True)
+
+async def import_equipment_batch(batch: List[tuple], report: dict):
+    """Upsert (line, values) rows by serial number with one unordered bulk_write"""
+    user_ids = {values['user_id'] for _, values in batch if 'user_id' in values}
+    department_ids = {values['department_id'] for _, values in batch if 'department_id' in values}
+    known_users = await known_ids(db.users, user_ids)
+    known_departments = await known_ids(db.departments, department_ids)
+    
+    # Within a batch the last row for a serial number wins, as it would row by row
+    rows = {}
+    for line, values in batch:
+        if 'user_id' in values and values['user_id'] not in known_users:
+            add_import_error(report, line, f"Unknown user_id {values['user_id']}")
+        elif 'department_id' in values and values['department_id'] not in known_departments:
+            add_import_error(report, line, f"Unknown department_id {values['department_id']}")
+        else:
+            if values['serial_number'] in rows:
+                report['superseded'] += 1
+            rows[values['serial_number']] = (line, values)
+    if not rows:
+        return
+    
+    rows = list(rows.values())
+    operations = [
+        UpdateOne(
+            {"serial_number": values['serial_number']},
+            {"$set": values, "$setOnInsert": {"id": str(uuid.uuid4())}},
+            upsert=True
+        )
+        for _, values in rows
+    ]
+    try:
+        result = (await db.equipments.bulk_write(operations, ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        for error in result['writeErrors']:
+            add_import_error(report, rows[error['index']][0], error['errmsg'])
+    report['inserted'] += result['nUpserted']
+    report['updated'] += result['nModified']
+    report['unchanged'] += result['nMatched'] - result['nModified']
+
+@api_router.post("/equipments/import")
+async def import_equipments(request: Request, current_user: User = Depends(get_current_user)):
+    """Create or update devices by serial_number from a CSV (header row first) or NDJSON body.
+
+    Rows are validated as they stream in and written every EQUIPMENT_IMPORT_BATCH_SIZE
+    rows; invalid rows are reported by line and do not stop the import.
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    parser = import_parser(request)
+    report = await run_import(
+        parser(stream_lines(request)), parse_equipment_row, import_equipment_batch, EQUIPMENT_IMPORT_BATCH_SIZE,
+        new_import_report(inserted=0, updated=0, unchanged=0, superseded=0)
+    )
+    logging.info(f"Equipment import by {current_user.id}: {report['rows']} rows, "
+                 f"{report['inserted']} inserted, {report['updated']} updated, {report['failed']} failed")
+    return report
+
+# ============= USERS ENDPOINTS =============
+
+@api_router.get("/users")
+async def get_users(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    if current_user.role not in ["admin", "tecnico"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    projection = fields_projection(parse_fields(fields, USER_FIELDS), USER_PROJECTION)
+    users = await db.users.find({}, projection).to_list(1000)
+    return users
+
+@api_router.put("/users/{user_id}")
+async def update_user(user_id: str, input: UpdateUserInput, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin" and current_user.id != user_id:
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    update_data = input.model_dump(exclude_none=True)
+    # The department scopes equipment visibility and ticket assignment
+    if 'department_id' in update_data and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can change the department")
+    user = await db.users.find_one_and_update(
+        {"id": user_id},
+        {"$set": update_data},
+        projection={"_id": 0, "password": 0},
+        return_document=ReturnDocument.AFTER
+    ) if update_data else await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    if 'name' in update_data:
+        schedule_background(fan_out_rename("user", user_id, user['name']))
+    if user['role'] == "tecnico" and user.get('status') == "activo":
+        assignment_engine.upsert_technician(user)
+    return user
+
+@api_router.get("/users/technicians")
+async def get_technicians(fields: Optional[str] = FIELDS_QUERY, current_user: User = Depends(get_current_user)):
+    projection = fields_projection(parse_fields(fields, USER_FIELDS), USER_PROJECTION)
+    technicians = await db.users.find({"role": "tecnico"}, projection).to_list(1000)
+    return technicians
+
+# ============= USER PROVISIONING =============
+
+USER_PROVISION_BATCH_SIZE = int(os.environ.get('USER_PROVISION_BATCH_SIZE', '1000'))
+# bcrypt is the bottleneck of provisioning: it runs on its own pool, all cores by default
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', '0')) or os.cpu_count() or 1
+PASSWORD_HASH_CHUNK = 16  # max passwords per pool task, so pickling and IPC stay negligible
+USER_ROLES = ("cliente", "tecnico", "admin")
+USER_IMPORT_COLUMNS = set(RegisterInput.model_fields)
+
+password_pool: Optional[ProcessPoolExecutor] = None
+
+def get_password_pool():
+    global password_pool
+    if password_pool is None:
+        password_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return password_pool
+
+def shutdown_password_pool():
+    global password_pool
+    if password_pool is not None:
+        password_pool.shutdown(wait=False, cancel_futures=True)
+        password_pool = None
+
+async def hash_passwords_parallel(passwords: List[str]) -> List[str]:
+    """Hashes in input order, computed in chunks across the password pool"""
+    loop = asyncio.get_running_loop()
+    pool = get_password_pool()
+    # Small batches are split evenly so every worker gets a share
+    size = max(1, min(PASSWORD_HASH_CHUNK, math.ceil(len(passwords) / PASSWORD_HASH_WORKERS)))
+    chunks = [passwords[i:i + size] for i in range(0, len(passwords), size)]
+    with start_span("bcrypt.hashpw_batch", attributes={"passwords": len(passwords)}):
+        try:
+            hashed = await asyncio.gather(*(
+                loop.run_in_executor(pool, password_hashing.hash_passwords, chunk) for chunk in chunks
+            ))
+        except BrokenProcessPool:
+            shutdown_password_pool()  # the next batch starts a fresh pool
+            raise
+    return [value for chunk in hashed for value in chunk]
+
+def parse_user_row(fields: dict) -> RegisterInput:
+    try:
+        user_input = RegisterInput(**clean_row(fields, USER_IMPORT_COLUMNS))
+    except ValidationError as e:
+        raise ValueError(validation_message(e))
+    if "@" not in user_input.email:
+        raise ValueError(f"email: not an email address: {user_input.email}")
+    if user_input.role not in USER_ROLES:
+        raise ValueError(f"role: must be one of {', '.join(USER_ROLES)}")
+    return user_input
+
+async def provision_user_batch(batch: List[tuple], report: dict):
+    """Hash the batch's passwords on the pool and insert it with one unordered insert_many.
+
+    There is no existence check: the unique email index rejects addresses that are
+    already registered (or repeated in the file) and only those rows fail.
+    """
+    known_departments = await known_ids(db.departments, {u.department_id for _, u in batch if u.department_id})
+    rows = []
+    for line, user_input in batch:
+        if user_input.department_id and user_input.department_id not in known_departments:
+            add_import_error(report, line, f"Unknown department_id {user_input.department_id}")
+        else:
+            rows.append((line, user_input))
+    if not rows:
+        return
+    
+    hashes = await hash_passwords_parallel([user_input.password for _, user_input in rows])
+    docs = []
+    for (_, user_input), hashed in zip(rows, hashes):
+        doc = User(**user_input.model_dump(exclude={'password'}), password=hashed).model_dump()
+        doc['created_at'] = doc['created_at'].isoformat()
+        docs.append(doc)
+    
+    failed = set()
+    try:
+        await db.users.insert_many(docs, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details['writeErrors']:
+            failed.add(error['index'])
+            message = "Email already registered" if error['code'] == 11000 else error['errmsg']
+            add_import_error(report, rows[error['index']][0], message)
+    for index, doc in enumerate(docs):
+        if index in failed:
+            continue
+        report['created'] += 1
+        if doc['role'] == "tecnico":
+            assignment_engine.upsert_technician(doc)
 
-# ============= DEPARTMENT ENDPOINTS =============
+async def provision_users(records) -> dict:
+    """Create users from (line, fields, error) records; shared by the endpoint and provision_users.py"""
+    report = await run_import(records, parse_user_row, provision_user_batch, USER_PROVISION_BATCH_SIZE,
+                              new_import_report(created=0))
+    seconds = report['elapsed_ms'] / 1000
+    report['users_per_second'] = round(report['created'] / seconds, 1) if seconds else None
+    logging.info(f"Provisioned {report['created']} of {report['rows']} users in {report['elapsed_ms']} ms "
+                 f"({report['users_per_second']}/s, {PASSWORD_HASH_WORKERS} hash workers)")
+    return report
 
-@api_router.post("/departments")
-async def create_department(input: CreateDepartmentInput, current_user: User = Depends(get_current_user)):
+@api_router.post("/users/bulk")
+async def bulk_provision_users(request: Request, current_user: User = Depends(get_current_user)):
+    """Create many users from a CSV (header row first) or NDJSON body of
+    email,name,password[,role,phone,department_id] rows; invalid rows are
+    reported by line and do not stop the rest"""
     if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Only admins can create departments")
-    
-    department = Department(name=input.name, description=input.description)
-    await db.departments.insert_one(department.model_dump())
-    return department
+        raise HTTPException(status_code=403, detail="Access denied")
+    parser = import_parser(request)
+    if not await email_index_ready():
+        raise HTTPException(status_code=503, detail="users.email unique index missing; resolve duplicate emails first")
+    return await provision_users(parser(stream_lines(request)))
 
-@api_router.get("/departments")
-async def get_departments():
-    departments = await db.departments.find({}, {"_id": 0}).to_list(1000)
-    return departments
+# ============= METRICS ENDPOINTS =============
 
-# ============= CATEGORY ENDPOINTS =============
+@api_router.get("/metrics/rate-limit")
+async def get_rate_limit_metrics(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return {
+        "backend": RATE_LIMIT_BACKEND,
+        "enabled": RATE_LIMIT_ENABLED,
+        "allowed": dict(rate_limit_metrics["allowed"]),
+        "throttled": dict(rate_limit_metrics["throttled"]),
+    }
 
-@api_router.post("/categories")
-async def create_category(input: CreateCategoryInput, current_user: User = Depends(get_current_user)):
+@api_router.get("/metrics/cache")
+async def get_cache_metrics(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
-        raise HTTPException(status_code=403, detail="Only admins can create categories")
+        raise HTTPException(status_code=403, detail="Access denied")
     
-    category = Category(name=input.name, description=input.description)
-    await db.categories.insert_one(category.model_dump())
-    return category
+    return {
+        "backend": RESPONSE_CACHE_BACKEND,
+        "ttl_seconds": RESPONSE_CACHE_TTL_SECONDS,
+        **{name: response_cache_metrics[name] for name in ("hits", "misses", "coalesced", "invalidations", "errors")},
+    }
 
-@api_router.get("/categories")
-async def get_categories():
-    categories = await db.categories.find({}, {"_id": 0}).to_list(1000)
-    return categories
+# ============= DENORMALIZED NAMES =============
 
-# ============= EQUIPMENT ENDPOINTS =============
+FANOUT_BATCH_SIZE = int(os.environ.get('FANOUT_BATCH_SIZE', '500'))
 
-@api_router.post("/equipments")
-async def create_equipment(input: CreateEquipmentInput, current_user: User = Depends(get_current_user)):
-    equipment = Equipment(
-        name=input.name,
-        type=input.type,
-        brand=input.brand,
-        model=input.model,
-        serial_number=input.serial_number,
-        user_id=input.user_id,
-        department_id=input.department_id
-    )
-    await db.equipments.insert_one(equipment.model_dump())
-    return equipment
+# Entity -> [(ticket field holding its id, ticket field holding its name)]
+DENORMALIZED_NAME_FIELDS = {
+    "user": [("user_id", "user_name"), ("technician_id", "technician_name")],
+    "category": [("category_id", "category_name")],
+}
 
-@api_router.get("/equipments")
-async def get_equipments(current_user: User = Depends(get_current_user)):
-    equipments = await db.equipments.find({}, {"_id": 0}).to_list(1000)
-    return equipments
+# Keep references so fire-and-forget tasks are not garbage collected mid-run
+background_tasks = set()
 
-# ============= USERS ENDPOINTS =============
+def schedule_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
 
-@api_router.get("/users")
-async def get_users(current_user: User = Depends(get_current_user)):
-    if current_user.role not in ["admin", "tecnico"]:
+def ticket_collections() -> List[str]:
+    # Archived tickets keep their names too: they are shown read-only and can be restored
+    return [HOT_COLLECTIONS['tickets'], ARCHIVE_COLLECTIONS['tickets']]
+
+async def fan_out_rename(entity: str, entity_id: str, new_name: str) -> int:
+    """Rewrite the denormalized name on every ticket (hot or archived) referencing entity_id, in batches"""
+    updated = 0
+    try:
+        for collection in ticket_collections():
+            for id_field, name_field in DENORMALIZED_NAME_FIELDS[entity]:
+                updated += await _rename_in_batches(collection, id_field, name_field, entity_id, new_name)
+        if updated:
+            await invalidate_all_ticket_lists()
+        logging.info(f"Renamed {entity} {entity_id} on {updated} tickets")
+    except Exception as e:
+        logging.error(f"Error in fan_out_rename({entity}, {entity_id}): {e}")
+    return updated
+
+async def _rename_in_batches(collection: str, id_field: str, name_field: str, entity_id: str, new_name: str) -> int:
+    updated = 0
+    query = {id_field: entity_id, name_field: {"$ne": new_name}}
+    while True:
+        batch = await db[collection].find(query, {"_id": 1}).limit(FANOUT_BATCH_SIZE).to_list(FANOUT_BATCH_SIZE)
+        if not batch:
+            return updated
+        result = await db[collection].update_many(
+            {"_id": {"$in": [t['_id'] for t in batch]}},
+            {"$set": {name_field: new_name, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        updated += result.modified_count
+
+async def check_denormalized_names(repair: bool = False) -> dict:
+    """Compare names stored on hot and archived tickets against users/categories; optionally fix them"""
+    names = {
+        "user": await names_by_id(db.users, await db.users.distinct("id")),
+        "category": await names_by_id(db.categories, await db.categories.distinct("id")),
+    }
+    fields = [(entity, id_field, name_field)
+              for entity, pairs in DENORMALIZED_NAME_FIELDS.items() for id_field, name_field in pairs]
+    projection = {"_id": 0, "id": 1}
+    for _, id_field, name_field in fields:
+        projection[id_field] = 1
+        projection[name_field] = 1
+    
+    report = {"tickets_checked": 0, "mismatches": 0, "repaired": 0}
+    stale = set()  # (entity, entity_id)
+    for collection in ticket_collections():
+        async for ticket in db[collection].find({}, projection):
+            report['tickets_checked'] += 1
+            for entity, id_field, name_field in fields:
+                entity_id = ticket.get(id_field)
+                if entity_id and ticket.get(name_field) != names[entity].get(entity_id, "Unknown"):
+                    report['mismatches'] += 1
+                    stale.add((entity, entity_id))
+    
+    if repair:
+        for entity, entity_id in stale:
+            report['repaired'] += await fan_out_rename(entity, entity_id, names[entity].get(entity_id, "Unknown"))
+    return report
+
+@api_router.get("/admin/denormalization/check")
+async def denormalization_check(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Access denied")
     
-    users = await db.users.find({}, {"_id": 0, "password": 0}).to_list(1000)
-    return users
+    return await check_denormalized_names()
 
-@api_router.get("/users/technicians")
-async def get_technicians(current_user: User = Depends(get_current_user)):
-    technicians = await db.users.find({"role": "tecnico"}, {"_id": 0, "password": 0}).to_list(1000)
-    return technicians
+@api_router.post("/admin/denormalization/repair")
+async def denormalization_repair(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    return await check_denormalized_names(repair=True)
+
+# ============= HEALTH ENDPOINTS =============
+
+@api_router.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    pool = pool_stats.snapshot()
+    result = {"status": "ok", "mongo": "ok", "pool": pool}
+    
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), timeout=HEALTH_PING_TIMEOUT_SECONDS)
+        result['ping_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    except Exception as e:
+        result['status'] = "unavailable"
+        result['mongo'] = f"error: {type(e).__name__}"
+    
+    if pool['saturation'] >= POOL_SATURATION_THRESHOLD:
+        result['status'] = "unavailable"
+        result['pool_exhausted'] = True
+    
+    status_code = 200 if result['status'] == "ok" else 503
+    return JSONResponse(status_code=status_code, content=result)
 
 # ============= PRIORITY ESCALATION TASK =============
 
@@ -757,7 +2961,8 @@ async def escalate_ticket_priorities():
         
         # Get all open and in-process tickets
         tickets = await db.tickets.find({
-            "status": {"$in": ["abierto", "en_proceso"]}
+            "status": {"$in": ["abierto", "en_proceso"]},
+            **NOT_DELETED
         }, {"_id": 0}).to_list(10000)
         
         for ticket_doc in tickets:
@@ -784,105 +2989,1119 @@ async def escalate_ticket_priorities():
                 should_update = True
             
             if should_update:
-                await db.tickets.update_one(
-                    {"id": ticket.id},
-                    {
-                        "$set": {
-                            "priority": new_priority,
-                            "last_priority_change": now.isoformat()
+                with start_span("escalation.escalate_ticket", attributes={"ticket.id": ticket.id, "ticket.priority": new_priority}):
+                    await db.tickets.update_one(
+                        {"id": ticket.id},
+                        {
+                            "$set": {
+                                "priority": new_priority,
+                                "priority_rank": priority_rank(new_priority),
+                                "last_priority_change": now.isoformat(),
+                                "due_at": compute_due_at(new_priority, now).isoformat(),
+                                "updated_at": now.isoformat()
+                            }
                         }
-                    }
-                )
+                    )
+                    record_ticket_change(ticket_doc, {**ticket_doc, "priority": new_priority})
+                    await invalidate_ticket_lists(ticket.user_id)
                 
-                # Add history
-                history = TicketHistory(
-                    ticket_id=ticket.id,
-                    user_id="system",
-                    action=f"Prioridad escalada automáticamente de {ticket.priority} a {new_priority}"
-                )
-                hist_doc = history.model_dump()
-                hist_doc['timestamp'] = hist_doc['timestamp'].isoformat()
-                await db.ticket_history.insert_one(hist_doc)
+                    # Add history
+                    await append_history(
+                        ticket.id, "system", f"Prioridad escalada automáticamente de {ticket.priority} a {new_priority}"
+                    )
                 
-                logging.info(f"Ticket {ticket.id} escalated from {ticket.priority} to {new_priority}")
+                    logging.info(f"Ticket {ticket.id} escalated from {ticket.priority} to {new_priority}")
         
     except Exception as e:
         logging.error(f"Error in escalate_ticket_priorities: {e}")
 
 def run_escalation_task():
     """Wrapper to run async task in scheduler"""
-    import asyncio
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     loop.run_until_complete(escalate_ticket_priorities())
+    loop.run_until_complete(close_response_cache())
     loop.close()
 
-# Initialize scheduler (will be started in startup event)
-scheduler = None
 
-# ============= SEED DATA ON STARTUP =============
+# ============= ARCHIVAL TASK =============
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '180'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '500'))
+
+# Hot collection -> archive collection for a ticket and its satellites
+HOT_COLLECTIONS = {
+    "tickets": "tickets",
+    "comments": "comments",
+    "attachments": "attachments",
+    "ticket_history": "ticket_history_buckets",
+}
+ARCHIVE_COLLECTIONS = {name: f"{collection}_archive" for name, collection in HOT_COLLECTIONS.items()}
+
+async def _move_documents(source: str, target: str, query: dict) -> tuple:
+    """Copy matching docs into the archive (idempotent upserts by id), then delete them"""
+    moved = size = 0
+    
+    async def flush(docs):
+        await db[target].bulk_write(
+            [ReplaceOne({"id": doc['id']}, doc, upsert=True) for doc in docs],
+            ordered=False
+        )
+        await db[source].delete_many({"_id": {"$in": [doc['_id'] for doc in docs]}})
+    
+    chunk = []
+    async for doc in db[source].find(query).batch_size(ARCHIVE_BATCH_SIZE):
+        chunk.append(doc)
+        size += len(bson.encode(doc))
+        if len(chunk) >= ARCHIVE_BATCH_SIZE:
+            await flush(chunk)
+            moved += len(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+        moved += len(chunk)
+    return moved, size
+
+async def archive_closed_tickets(older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """Move tickets closed more than `older_than_days` ago, with their comments,
+    attachments and history, into the *_archive collections."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    report = {name: 0 for name in HOT_COLLECTIONS}
+    report['bytes'] = 0
+    
+    while True:
+        batch = await db.tickets.find(
+            {"status": "cerrado", "closed_at": {"$lt": cutoff}, **NOT_DELETED},
+            {"_id": 0, "id": 1, "user_id": 1}
+        ).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+        ticket_ids = [t['id'] for t in batch]
+        
+        # Satellites first, so an interrupted run never leaves orphans in the hot set
+        for name in ("comments", "attachments", "ticket_history", "tickets"):
+            query = {"id": {"$in": ticket_ids}} if name == "tickets" else {"ticket_id": {"$in": ticket_ids}}
+            moved, size = await _move_documents(HOT_COLLECTIONS[name], ARCHIVE_COLLECTIONS[name], query)
+            report[name] += moved
+            report['bytes'] += size
+        # Replicas built from /tickets/changes drop archived tickets too
+        await write_tombstones(batch, "archived", datetime.now(timezone.utc).isoformat())
+    
+    if report['tickets']:
+        await invalidate_all_ticket_lists()
+    logging.info(f"Archived {report['tickets']} tickets ({report['bytes']} bytes moved)")
+    return report
+
+def run_archival_task():
+    """Wrapper to run async task in scheduler"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(archive_closed_tickets())
+    loop.run_until_complete(close_response_cache())
+    loop.close()
+
+@api_router.post("/admin/archive")
+async def trigger_archive(older_than_days: int = ARCHIVE_AFTER_DAYS, current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Only admins can archive tickets")
+    
+    return await archive_closed_tickets(older_than_days)
+
+# ============= DELETED TICKET COLLECTOR =============
+
+RESTORE_WINDOW_HOURS = int(os.environ.get('RESTORE_WINDOW_HOURS', '24'))
+GC_BATCH_SIZE = int(os.environ.get('GC_BATCH_SIZE', '500'))
+GC_PAUSE_SECONDS = float(os.environ.get('GC_PAUSE_SECONDS', '0.2'))  # between batches, keeps foreground latency flat
+GC_MAX_TICKETS_PER_RUN = int(os.environ.get('GC_MAX_TICKETS_PER_RUN', '1000'))
+
+gc_metrics = Counter()
+
+async def _purge_in_batches(collection: str, query: dict) -> int:
+    purged = 0
+    # Attachment rows hold blob references that must be released once they are gone
+    projection = {"_id": 1, "digest": 1} if collection == "attachments" else {"_id": 1}
+    while True:
+        batch = await db[collection].find(query, projection).limit(GC_BATCH_SIZE).to_list(GC_BATCH_SIZE)
+        if not batch:
+            return purged
+        result = await db[collection].delete_many({"_id": {"$in": [d['_id'] for d in batch]}})
+        purged += result.deleted_count
+        if collection == "attachments":
+            await release_blobs([d.get('digest') for d in batch])
+        await asyncio.sleep(GC_PAUSE_SECONDS)
+
+async def collect_deleted_tickets() -> dict:
+    """Purge tickets soft-deleted longer ago than the restore window, with their related data"""
+    start = time.perf_counter()
+    cutoff = (datetime.now(timezone.utc) - timedelta(hours=RESTORE_WINDOW_HOURS)).isoformat()
+    report = Counter()
+    
+    expired = await db.tickets.find(
+        {"deleted_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}
+    ).limit(GC_MAX_TICKETS_PER_RUN).to_list(GC_MAX_TICKETS_PER_RUN)
+    
+    for ticket in expired:
+        # Related data first: the ticket doc is the marker that work remains
+        for name in ("comments", "attachments", "ticket_history"):
+            report[name] += await _purge_in_batches(HOT_COLLECTIONS[name], {"ticket_id": ticket['id']})
+        await db.tickets.delete_one({"id": ticket['id'], "deleted_at": {"$lt": cutoff}})
+        await apply_rollups({ticket['id']: None})
+        report['tickets'] += 1
+    
+    gc_metrics.update(report)
+    gc_metrics['runs'] += 1
+    gc_metrics['last_run_ms'] = round((time.perf_counter() - start) * 1000)
+    if report['tickets']:
+        logging.info(f"Collected {report['tickets']} deleted tickets: {dict(report)}")
+    return dict(report)
+
+def run_gc_task():
+    """Wrapper to run async task in scheduler"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(collect_deleted_tickets())
+    loop.run_until_complete(close_response_cache())
+    loop.close()
+
+@api_router.get("/metrics/gc")
+async def get_gc_metrics(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    pending = await db.tickets.count_documents({"deleted_at": {"$exists": True, "$ne": None}})
+    return {**gc_metrics, "pending_tickets": pending, "restore_window_hours": RESTORE_WINDOW_HOURS}
+
+# ============= ATTACHMENT BLOB COLLECTOR =============
+
+async def collect_unreferenced_blobs() -> int:
+    """Delete blobs whose refcount stayed at zero for the grace period"""
+    cutoff = (datetime.now(timezone.utc) - timedelta(minutes=BLOB_GC_GRACE_MINUTES)).isoformat()
+    candidates = await db.attachment_blobs.find(
+        {"refcount": {"$lte": 0}, "unreferenced_at": {"$lt": cutoff}}, {"_id": 0, "digest": 1}
+    ).limit(GC_BATCH_SIZE).to_list(GC_BATCH_SIZE)
+    
+    removed = 0
+    for blob in candidates:
+        # The rows are the source of truth: a drifted refcount must never delete live content
+        references = (await db.attachments.count_documents({"digest": blob['digest']})
+                      + await db.attachments_archive.count_documents({"digest": blob['digest']}))
+        if references:
+            await db.attachment_blobs.update_one(
+                {"digest": blob['digest'], "refcount": {"$lte": 0}},
+                {"$inc": {"refcount": references}, "$unset": {"unreferenced_at": ""}}
+            )
+            attachment_metrics['refcounts_repaired'] += 1
+            continue
+        # An upload that referenced the blob meanwhile bumped refcount, so this no longer matches
+        result = await db.attachment_blobs.delete_one({"digest": blob['digest'], "refcount": {"$lte": 0}})
+        if result.deleted_count:
+            await db.attachment_jobs.delete_one({"digest": blob['digest']})
+        removed += result.deleted_count
+    
+    attachment_metrics['blobs_collected'] += removed
+    if removed:
+        logging.info(f"Collected {removed} unreferenced attachment blobs")
+    return removed
+
+def run_blob_gc_task():
+    """Wrapper to run async task in scheduler"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(collect_unreferenced_blobs())
+    loop.run_until_complete(close_response_cache())
+    loop.close()
+
+@api_router.get("/metrics/attachments")
+async def get_attachment_metrics(current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    
+    blobs = await db.attachment_blobs.count_documents({})
+    unreferenced = await db.attachment_blobs.count_documents({"refcount": {"$lte": 0}})
+    jobs = {status: await db.attachment_jobs.count_documents({"status": status})
+            for status in ("pending", "running", "failed")}
+    return {**attachment_metrics, "blobs": blobs, "unreferenced_blobs": unreferenced,
+            "gc_grace_minutes": BLOB_GC_GRACE_MINUTES, "jobs": jobs}
+
+# ============= ATTACHMENT PROCESSING =============
+# New blobs get a job in attachment_jobs; the worker claims jobs with a lease and runs
+# attachment_processing.process_attachment (MIME sniffing, thumbnail, recompression,
+# text preview) on a process pool, so the CPU work never blocks an event loop.
+
+ATTACHMENT_WORKERS = int(os.environ.get('ATTACHMENT_WORKERS', '2'))  # pool processes = jobs in flight
+ATTACHMENT_JOBS_PER_RUN = int(os.environ.get('ATTACHMENT_JOBS_PER_RUN', '50'))
+ATTACHMENT_JOB_MAX_ATTEMPTS = int(os.environ.get('ATTACHMENT_JOB_MAX_ATTEMPTS', '5'))
+ATTACHMENT_JOB_TIMEOUT_SECONDS = float(os.environ.get('ATTACHMENT_JOB_TIMEOUT_SECONDS', '60'))
+ATTACHMENT_RETRY_BASE_SECONDS = float(os.environ.get('ATTACHMENT_RETRY_BASE_SECONDS', '30'))
+
+class TrackingContext:
+    """The default multiprocessing context, remembering the processes started through it.
+
+    Handed to the pool as mp_context, which is how the executor launches its workers,
+    so a stuck pool's children can be found without reaching into the executor.
+    """
+
+    def __init__(self):
+        self._context = multiprocessing.get_context()
+        self.processes = []
 
-@app.on_event("startup")
-async def seed_initial_data():
-    """Seed initial categories and priorities"""
+    def __getattr__(self, name):
+        return getattr(self._context, name)
+
+    def Process(self, *args, **kwargs):
+        process = self._context.Process(*args, **kwargs)
+        self.processes.append(process)
+        return process
+
+attachment_pool = None
+attachment_pool_context: Optional[TrackingContext] = None
+
+def get_attachment_pool():
+    global attachment_pool, attachment_pool_context
+    if attachment_pool is None:
+        attachment_pool_context = TrackingContext()
+        attachment_pool = ProcessPoolExecutor(max_workers=ATTACHMENT_WORKERS, mp_context=attachment_pool_context)
+    return attachment_pool
+
+def shutdown_attachment_pool(terminate: bool = False):
+    """Drop the pool; with terminate, also kill its children, which shutdown() alone
+    leaves running when one is stuck in a job"""
+    global attachment_pool, attachment_pool_context
+    if attachment_pool is not None:
+        processes = attachment_pool_context.processes if terminate else []
+        attachment_pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        attachment_pool = attachment_pool_context = None
+
+async def enqueue_attachment_job(digest: str):
+    """Idempotent: one job per digest"""
+    now = datetime.now(timezone.utc).isoformat()
+    try:
+        await db.attachment_jobs.update_one(
+            {"digest": digest},
+            {"$setOnInsert": {"digest": digest, "status": "pending", "attempts": 0,
+                              "run_after": now, "created_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # enqueued concurrently
+
+async def claim_attachment_job() -> Optional[dict]:
+    """Lease the next due job; a running job whose lease expired (crashed worker) is due
+    again while it has attempts left"""
+    now = datetime.now(timezone.utc)
+    lease = timedelta(seconds=ATTACHMENT_JOB_TIMEOUT_SECONDS * 2)
+    return await db.attachment_jobs.find_one_and_update(
+        {"$or": [
+            {"status": "pending", "run_after": {"$lte": now.isoformat()}},
+            {"status": "running", "locked_until": {"$lt": now.isoformat()},
+             "attempts": {"$lt": ATTACHMENT_JOB_MAX_ATTEMPTS}},
+        ]},
+        {"$set": {"status": "running", "locked_until": (now + lease).isoformat()}, "$inc": {"attempts": 1}},
+        projection={"_id": 0}, sort=[("run_after", 1)], return_document=ReturnDocument.AFTER
+    )
+
+async def fail_exhausted_attachment_jobs() -> int:
+    """Jobs whose last attempt never reported back (it kept crashing the worker) are failed"""
+    result = await db.attachment_jobs.update_many(
+        {"status": "running", "locked_until": {"$lt": datetime.now(timezone.utc).isoformat()},
+         "attempts": {"$gte": ATTACHMENT_JOB_MAX_ATTEMPTS}},
+        {"$set": {"status": "failed", "error": "Lease expired on the last attempt"},
+         "$unset": {"locked_until": ""}}
+    )
+    return result.modified_count
+
+async def run_attachment_job(job: dict) -> str:
+    global attachment_pool
+    blob = await db.attachment_blobs.find_one({"digest": job['digest']}, {"_id": 0, "data": 1})
+    if blob is None:  # collected before it was processed
+        await db.attachment_jobs.delete_one({"digest": job['digest']})
+        return "dropped"
+    
+    loop = asyncio.get_running_loop()
+    try:
+        result = await asyncio.wait_for(
+            loop.run_in_executor(get_attachment_pool(), attachment_processing.process_attachment, blob['data']),
+            ATTACHMENT_JOB_TIMEOUT_SECONDS
+        )
+    except Exception as exc:
+        if isinstance(exc, (asyncio.TimeoutError, BrokenProcessPool)):
+            shutdown_attachment_pool(terminate=True)  # a stuck or dead child: start from a fresh pool
+        failed = job['attempts'] >= ATTACHMENT_JOB_MAX_ATTEMPTS
+        retry_at = datetime.now(timezone.utc) + timedelta(
+            seconds=ATTACHMENT_RETRY_BASE_SECONDS * 2 ** (job['attempts'] - 1))
+        await db.attachment_jobs.update_one(
+            {"digest": job['digest'], "status": "running"},
+            {"$set": {"status": "failed" if failed else "pending", "run_after": retry_at.isoformat(),
+                      "error": repr(exc)[:500]},
+             "$unset": {"locked_until": ""}}
+        )
+        logging.warning(f"Attachment job {job['digest']} attempt {job['attempts']} failed: {exc!r}")
+        return "failed" if failed else "retried"
+    
+    for name in ("thumbnail", "optimized"):
+        if name in result:
+            result[name] = bson.Binary(result[name])
+    await db.attachment_blobs.update_one(
+        {"digest": job['digest']},
+        {"$set": {**result, "processed_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    await db.attachment_jobs.delete_one({"digest": job['digest']})
+    return "processed"
+
+async def process_attachment_jobs() -> dict:
+    """Run due jobs, at most ATTACHMENT_WORKERS at a time and ATTACHMENT_JOBS_PER_RUN per run"""
+    report = Counter()
+    budget = ATTACHMENT_JOBS_PER_RUN
+    exhausted = await fail_exhausted_attachment_jobs()
+    if exhausted:
+        report["failed"] += exhausted
+    
+    async def lane():
+        nonlocal budget
+        while budget > 0:
+            budget -= 1
+            job = await claim_attachment_job()
+            if job is None:
+                return
+            report[await run_attachment_job(job)] += 1
+    
+    await asyncio.gather(*(lane() for _ in range(ATTACHMENT_WORKERS)))
+    attachment_metrics.update({f"jobs_{outcome}": count for outcome, count in report.items()})
+    if report:
+        logging.info(f"Attachment jobs: {dict(report)}")
+    return dict(report)
+
+def run_attachment_jobs_task():
+    """Wrapper to run async task in scheduler"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(process_attachment_jobs())
+    loop.run_until_complete(close_response_cache())
+    loop.close()
+
+# ============= REPORTING ROLLUPS =============
+# report_buckets holds one document per (dimension, key, day) with event counts and
+# time-to-assign / time-to-close histograms. The rollup job follows the tickets'
+# (updated_at, id) order like the changes feed, and applies each ticket's contribution
+# as a diff against the one recorded in report_ticket_state, so seeing a ticket again
+# is a no-op and a reassignment or reopening moves its counts. Reports read buckets only.
+
+ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', '500'))
+REPORT_MAX_DAYS = int(os.environ.get('REPORT_MAX_DAYS', '366'))
+REPORT_DIMENSIONS = ("category", "department", "technician", "priority")
+# Upper bounds, in minutes, of the duration histogram bins; the last bin is open-ended
+REPORT_BINS_MINUTES = [1, 2, 5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 360, 480, 720,
+                       1080, 1440, 2160, 2880, 4320, 7200, 10080, 20160, 43200]
+
+rollup_metrics = Counter()
+
+def as_datetime(value) -> datetime:
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def duration_bin(minutes: float) -> int:
+    return bisect.bisect_left(REPORT_BINS_MINUTES, minutes)
+
+def ticket_contributions(ticket: dict, department_id: Optional[str]) -> List[list]:
+    """[day, dimension, key, event, bin, minutes] entries this ticket adds to the buckets"""
+    if ticket.get('deleted_at'):
+        return []
+    created_at = as_datetime(ticket['created_at'])
+    events = [("created", created_at, None)]
+    if ticket.get('assigned_at'):
+        assigned_at = as_datetime(ticket['assigned_at'])
+        events.append(("assigned", assigned_at, (assigned_at - created_at).total_seconds() / 60))
+    if ticket.get('status') == "cerrado" and ticket.get('closed_at'):
+        closed_at = as_datetime(ticket['closed_at'])
+        events.append(("closed", closed_at, (closed_at - created_at).total_seconds() / 60))
+    
+    keys = {"all": "all", "category": ticket.get('category_id'), "department": department_id,
+            "technician": ticket.get('technician_id'), "priority": ticket.get('priority')}
+    contributions = []
+    for event, at, minutes in events:
+        day = at.astimezone(timezone.utc).date().isoformat()
+        minutes = round(max(minutes, 0), 1) if minutes is not None else None
+        for dimension, key in keys.items():
+            if key:
+                contributions.append([day, dimension, key, event,
+                                      duration_bin(minutes) if minutes is not None else None, minutes])
+    return contributions
+
+async def apply_rollups(changes: Dict[str, Optional[List[list]]]):
+    """Move the buckets from each ticket's recorded contribution to the new one.
+    None drops the ticket from the reports and forgets it (purged tickets)."""
+    states = {doc['id']: doc['contributions'] async for doc in db.report_ticket_state.find(
+        {"id": {"$in": list(changes)}}, {"_id": 0}
+    )}
+    increments = {}
+    for ticket_id, new in changes.items():
+        diff = Counter(tuple(c) for c in new or [])
+        diff.subtract(Counter(tuple(c) for c in states.get(ticket_id, [])))
+        for (day, dimension, key, event, bin_index, minutes), sign in diff.items():
+            if not sign:
+                continue
+            inc = increments.setdefault((dimension, key, day), Counter())
+            inc[event] += sign
+            if minutes is not None:
+                inc[f"{event}_minutes"] += sign * minutes
+                inc[f"{event}_hist.{bin_index}"] += sign
+    
+    if increments:
+        await db.report_buckets.bulk_write([
+            UpdateOne({"dimension": dimension, "key": key, "day": day}, {"$inc": dict(inc)}, upsert=True)
+            for (dimension, key, day), inc in increments.items()
+        ], ordered=False)
+    await db.report_ticket_state.bulk_write([
+        ReplaceOne({"id": ticket_id}, {"id": ticket_id, "contributions": new}, upsert=True) if new is not None
+        else DeleteOne({"id": ticket_id})
+        for ticket_id, new in changes.items()
+    ], ordered=False)
+    rollup_metrics['bucket_writes'] += len(increments)
+
+async def rollup_ticket_docs(tickets: List[dict]):
+    # A ticket counts for the department its requester belongs to when it is rolled up
+    users = await db.users.find(
+        {"id": {"$in": list({t['user_id'] for t in tickets})}}, {"_id": 0, "id": 1, "department_id": 1}
+    ).to_list(None)
+    departments = {u['id']: u.get('department_id') for u in users}
+    await apply_rollups({t['id']: ticket_contributions(t, departments.get(t['user_id'])) for t in tickets})
+    rollup_metrics['tickets'] += len(tickets)
+
+ROLLUP_PROJECTION = {"_id": 0, "id": 1, "user_id": 1, "technician_id": 1, "category_id": 1, "priority": 1,
+                     "status": 1, "created_at": 1, "assigned_at": 1, "closed_at": 1, "deleted_at": 1,
+                     "updated_at": 1}
+
+async def rollup_archived_tickets():
+    """First run only: archived tickets never change again, so they are rolled up once"""
+    last_id = ""
+    while True:
+        batch = await db.tickets_archive.find({"id": {"$gt": last_id}}, ROLLUP_PROJECTION).sort("id", 1).limit(
+            ROLLUP_BATCH_SIZE).to_list(ROLLUP_BATCH_SIZE)
+        if not batch:
+            return
+        await rollup_ticket_docs(batch)
+        last_id = batch[-1]['id']
+
+async def update_report_rollups() -> int:
+    """Roll up every ticket written since the stored cursor"""
+    start = time.perf_counter()
+    state = await db.report_state.find_one({"id": "rollup_cursor"}, {"_id": 0})
+    if state is None:
+        await rollup_archived_tickets()
+        state = {"updated_at": "", "ticket_id": ""}
+    
+    settled = (datetime.now(timezone.utc) - timedelta(seconds=CHANGES_SETTLE_SECONDS)).isoformat()
+    processed = 0
+    while True:
+        batch = await db.tickets.find(
+            {"$and": [{"updated_at": {"$lt": settled}}, {"$or": [
+                {"updated_at": {"$gt": state['updated_at']}},
+                {"updated_at": state['updated_at'], "id": {"$gt": state['ticket_id']}},
+            ]}]},
+            ROLLUP_PROJECTION
+        ).sort([("updated_at", 1), ("id", 1)]).limit(ROLLUP_BATCH_SIZE).to_list(ROLLUP_BATCH_SIZE)
+        if not batch:
+            break
+        await rollup_ticket_docs(batch)
+        state = {"updated_at": batch[-1]['updated_at'], "ticket_id": batch[-1]['id']}
+        await db.report_state.update_one({"id": "rollup_cursor"}, {"$set": state}, upsert=True)
+        processed += len(batch)
+    
+    if not processed:
+        await db.report_state.update_one({"id": "rollup_cursor"}, {"$setOnInsert": state}, upsert=True)
+    rollup_metrics['runs'] += 1
+    rollup_metrics['last_run_ms'] = round((time.perf_counter() - start) * 1000)
+    if processed:
+        logging.info(f"Rolled up {processed} tickets into report buckets")
+    return processed
+
+async def rebuild_report_rollups():
+    """Recompute every bucket from the tickets (after changing the contribution rules)"""
+    for name in ("report_buckets", "report_ticket_state", "report_state"):
+        await db[name].delete_many({})
+    await update_report_rollups()
+
+def run_rollup_task():
+    """Wrapper to run async task in scheduler"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(update_report_rollups())
+    loop.run_until_complete(close_response_cache())
+    loop.close()
+
+def hist_percentile(hist: Counter, total: int, pct: float) -> Optional[float]:
+    """Nearest-rank percentile in minutes, interpolated linearly inside its bin"""
+    if not total:
+        return None
+    rank = max(1, math.ceil(pct / 100 * total))
+    seen = 0
+    for index in range(len(REPORT_BINS_MINUTES) + 1):
+        count = hist.get(str(index), 0)
+        if count and seen + count >= rank:
+            lower = REPORT_BINS_MINUTES[index - 1] if index else 0
+            if index == len(REPORT_BINS_MINUTES):
+                return lower  # open-ended bin: report its lower bound
+            return lower + (REPORT_BINS_MINUTES[index] - lower) * (rank - seen) / count
+        seen += count
+    return None
+
+def hours(minutes: Optional[float]) -> Optional[float]:
+    return round(minutes / 60, 2) if minutes is not None else None
+
+def duration_stats(totals: Counter, event: str) -> dict:
+    count = totals[event]
+    hist = Counter({name.rsplit('.', 1)[1]: value for name, value in totals.items()
+                    if name.startswith(f"{event}_hist.")})
+    return {
+        "mean_hours": hours(totals[f"{event}_minutes"] / count) if count else None,
+        "p50_hours": hours(hist_percentile(hist, count, 50)),
+        "p90_hours": hours(hist_percentile(hist, count, 90)),
+        "p95_hours": hours(hist_percentile(hist, count, 95)),
+    }
+
+def report_row(totals: Counter) -> dict:
+    return {
+        "created": totals["created"],
+        "assigned": totals["assigned"],
+        "closed": totals["closed"],
+        "time_to_assign": duration_stats(totals, "assigned"),
+        "time_to_close": duration_stats(totals, "closed"),
+    }
+
+def flatten_bucket(bucket: dict) -> Counter:
+    totals = Counter()
+    for name, value in bucket.items():
+        if isinstance(value, dict):
+            totals.update({f"{name}.{index}": count for index, count in value.items()})
+        elif isinstance(value, (int, float)):
+            totals[name] = value
+    return totals
+
+def report_range(date_from: Optional[str], date_to: Optional[str]) -> tuple:
+    """Validated (from, to) days; the last 30 days by default"""
+    try:
+        end = datetime.strptime(date_to, "%Y-%m-%d").date() if date_to else datetime.now(timezone.utc).date()
+        begin = datetime.strptime(date_from, "%Y-%m-%d").date() if date_from else end - timedelta(days=29)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Dates must be YYYY-MM-DD")
+    if begin > end:
+        raise HTTPException(status_code=400, detail="'from' must not be after 'to'")
+    if (end - begin).days >= REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {REPORT_MAX_DAYS} days")
+    return begin.isoformat(), end.isoformat()
+
+async def load_buckets(dimension: str, date_from: Optional[str], date_to: Optional[str], key: Optional[str] = None):
+    begin, end = report_range(date_from, date_to)
+    query = {"dimension": dimension, "day": {"$gte": begin, "$lte": end}}
+    if key is not None:
+        query["key"] = key
+    buckets = await db.report_buckets.find(query, {"_id": 0}).to_list(None)
+    cursor = await db.report_state.find_one({"id": "rollup_cursor"}, {"_id": 0, "updated_at": 1})
+    meta = {"from": begin, "to": end, "rolled_up_to": (cursor or {}).get('updated_at') or None}
+    return buckets, meta
+
+@api_router.get("/reports/summary")
+async def get_report_summary(date_from: Optional[str] = Query(None, alias="from"),
+                             date_to: Optional[str] = Query(None, alias="to"),
+                             current_user: User = Depends(get_current_user)):
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    buckets, meta = await load_buckets("all", date_from, date_to, "all")
+    totals = Counter()
+    for bucket in buckets:
+        totals.update(flatten_bucket(bucket))
+    return {**meta, **report_row(totals)}
+
+@api_router.get("/reports/daily")
+async def get_report_daily(date_from: Optional[str] = Query(None, alias="from"),
+                           date_to: Optional[str] = Query(None, alias="to"),
+                           dimension: str = "all", key: str = "all",
+                           current_user: User = Depends(get_current_user)):
+    """One row per day with activity, for a single dimension key (all tickets by default)"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    if dimension != "all" and dimension not in REPORT_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown dimension '{dimension}'")
+    buckets, meta = await load_buckets(dimension, date_from, date_to, key)
+    days = [{"day": b['day'], **report_row(flatten_bucket(b))} for b in sorted(buckets, key=lambda b: b['day'])]
+    return {**meta, "dimension": dimension, "key": key, "days": days}
+
+@api_router.get("/reports/{dimension}")
+async def get_report_by_dimension(dimension: str, date_from: Optional[str] = Query(None, alias="from"),
+                                  date_to: Optional[str] = Query(None, alias="to"),
+                                  current_user: User = Depends(get_current_user)):
+    """Totals per category, department, technician or priority over the range"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    if dimension not in REPORT_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown dimension '{dimension}'")
+    buckets, meta = await load_buckets(dimension, date_from, date_to)
+    totals_by_key = {}
+    for bucket in buckets:
+        totals_by_key.setdefault(bucket['key'], Counter()).update(flatten_bucket(bucket))
+    
+    name_sources = {"category": db.categories, "department": db.departments, "technician": db.users}
+    names = (await names_by_id(name_sources[dimension], list(totals_by_key))
+             if dimension in name_sources else {key: key for key in totals_by_key})
+    rows = [{"key": key, "name": names.get(key, "Unknown"), **report_row(totals)}
+            for key, totals in totals_by_key.items()]
+    rows.sort(key=lambda row: row['created'], reverse=True)
+    return {**meta, "dimension": dimension, "rows": rows}
+
+# ============= INDEXES =============
+
+async def ensure_indexes():
+    """Create the indexes the queries above rely on (no-op when they exist)"""
+    await db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+    await ensure_unique_emails()
+    # Sparse: legacy sessions have no token_hash until migrate_legacy_sessions, which runs after this
+    await db.user_sessions.create_index("token_hash", unique=True, sparse=True)
+    await db.user_sessions.create_index("user_id")
+    await db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+    await db.tickets.create_index([("status", 1), ("closed_at", 1)])
+    await db.tickets.create_index("deleted_at", sparse=True)
+    await db.tickets.create_index([("status", 1), ("due_at", 1)])
+    await db.tickets.create_index([("updated_at", 1), ("id", 1)])
+    await db.ticket_tombstones.create_index("id", unique=True)
+    await db.ticket_tombstones.create_index([("updated_at", 1), ("id", 1)])
+    await db.ticket_tombstones.create_index("expires_at", expireAfterSeconds=0)
+    await db.tickets.create_index([("status", 1), ("technician_id", 1), ("priority_rank", -1), ("created_at", 1)])
+    await db.tickets.create_index("user_id")
+    await db.tickets.create_index([("technician_id", 1), ("status", 1)])
+    await db.tickets.create_index("category_id")
+    await db.comments.create_index([("ticket_id", 1), ("created_at", 1)])
+    await db.ticket_history_buckets.create_index([("ticket_id", 1), ("last_at", 1)])
+    for name in ARCHIVE_COLLECTIONS.values():
+        await db[name].create_index("id", unique=True)
+    await db.comments_archive.create_index([("ticket_id", 1), ("created_at", 1)])
+    await db.ticket_history_buckets_archive.create_index([("ticket_id", 1), ("last_at", 1)])
+    await db.attachments_archive.create_index("ticket_id")
+    # Used by fan_out_rename on archived tickets
+    for field in ("user_id", "technician_id", "category_id"):
+        await db.tickets_archive.create_index(field)
+    await db.attachment_blobs.create_index("digest", unique=True)
+    await db.attachment_blobs.create_index([("refcount", 1), ("unreferenced_at", 1)])
+    await db.attachments.create_index("digest")
+    await db.attachments_archive.create_index("digest")
+    await db.attachment_jobs.create_index("digest", unique=True)
+    await db.attachment_jobs.create_index([("status", 1), ("run_after", 1)])
+    await db.report_buckets.create_index([("dimension", 1), ("key", 1), ("day", 1)], unique=True)
+    await db.report_buckets.create_index([("dimension", 1), ("day", 1)])
+    await db.report_ticket_state.create_index("id", unique=True)
+    await db.report_state.create_index("id", unique=True)
+    await db.migrations.create_index("id", unique=True)
+    await db.equipments.create_index("id", unique=True)
+    await db.equipments.create_index([("user_id", 1), ("id", 1)])
+    await db.equipments.create_index([("department_id", 1), ("id", 1)])
+    # Imports upsert by serial number; replaces the plain index documented before
+    legacy_serial = (await db.equipments.index_information()).get("serial_number_1")
+    if legacy_serial and not legacy_serial.get("unique"):
+        await db.equipments.drop_index("serial_number_1")
+    await db.equipments.create_index(
+        "serial_number", unique=True, partialFilterExpression={"serial_number": {"$type": "string"}}
+    )
+    # Reference data is upserted by name, so concurrent seeders cannot duplicate it
+    await db.categories.create_index("name", unique=True)
+    await db.departments.create_index("name", unique=True)
+
+async def email_index_ready() -> bool:
+    index = (await db.users.index_information()).get("email_1")
+    return bool(index and index.get("unique"))
+
+async def ensure_unique_emails():
+    """Unique index on users.email. Earlier check-then-insert registrations could store
+    duplicates; those are reported and the index is left out until they are resolved,
+    so the rest of setup (and the API) still starts."""
+    if await email_index_ready():
+        return
+    duplicates = await db.users.aggregate([
+        {"$group": {"_id": "$email", "ids": {"$push": "$id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+        {"$limit": 20},
+    ]).to_list(20)
+    if duplicates:
+        listing = "; ".join(f"{d['_id']} ({', '.join(d['ids'])})" for d in duplicates)
+        logging.error(
+            f"users.email unique index not created, duplicate emails: {listing}. "
+            "Merge or rename those accounts and run `python server.py setup` again; "
+            "bulk provisioning stays disabled until then"
+        )
+        return
+    await db.users.create_index("email", unique=True)
+
+async def migrate_legacy_sessions():
+    """Convert sessions stored with a raw token and ISO-string expiry to the hashed/TTL layout"""
+    async for doc in db.user_sessions.find({"token_hash": {"$exists": False}}):
+        if not doc.get('session_token'):
+            await db.user_sessions.delete_one({"_id": doc['_id']})
+            continue
+        expires_at = doc.get('expires_at')
+        if isinstance(expires_at, str):
+            expires_at = datetime.fromisoformat(expires_at)
+        await db.user_sessions.update_one(
+            {"_id": doc['_id']},
+            {
+                "$set": {"token_hash": hash_session_token(doc['session_token']), "expires_at": expires_at},
+                "$unset": {"session_token": ""}
+            }
+        )
+
+async def backfill_due_dates():
+    """Give open tickets created before SLA tracking a due_at"""
+    async for ticket in db.tickets.find(
+        {"status": {"$in": OPEN_STATUSES}, "due_at": None},
+        {"_id": 0, "id": 1, "priority": 1, "last_priority_change": 1, "created_at": 1}
+    ):
+        since = ticket.get('last_priority_change') or ticket['created_at']
+        if isinstance(since, str):
+            since = datetime.fromisoformat(since)
+        await db.tickets.update_one(
+            {"id": ticket['id']},
+            {"$set": {"due_at": compute_due_at(ticket['priority'], since).isoformat()}}
+        )
+
+async def backfill_updated_at():
+    """Give tickets written before delta sync an updated_at (their latest known timestamp)"""
+    async for ticket in db.tickets.find(
+        {"updated_at": None},
+        {"_id": 0, "id": 1, "created_at": 1, "assigned_at": 1, "closed_at": 1, "last_priority_change": 1}
+    ):
+        timestamps = [ticket.get(f) for f in ('created_at', 'assigned_at', 'closed_at', 'last_priority_change')]
+        timestamps = [t if isinstance(t, str) else t.isoformat() for t in timestamps if t]
+        await db.tickets.update_one({"id": ticket['id']}, {"$set": {"updated_at": max(timestamps)}})
+
+async def migrate_attachment_blobs():
+    """Move the base64 payload of legacy attachment rows into content-addressed blobs"""
+    for name in ("attachments", "attachments_archive"):
+        async for row in db[name].find({"file_data": {"$exists": True}}, {"_id": 1, "id": 1, "file_data": 1}):
+            try:
+                content = base64.b64decode(row['file_data'] or "", validate=True)
+            except ValueError:
+                logging.error(f"Attachment {row.get('id')} in {name} is not valid base64; left as is")
+                continue
+            digest = await reference_blob(content)
+            result = await db[name].update_one(
+                {"_id": row['_id'], "file_data": {"$exists": True}},
+                {"$set": {"digest": digest, "size": len(content)}, "$unset": {"file_data": ""}}
+            )
+            if not result.modified_count:
+                await release_blobs([digest])  # a concurrent setup migrated this row first
+
+async def migrate_history_to_buckets():
+    """Regroup one-document-per-event history (and its archive) into buckets.
+
+    Migrated buckets get deterministic ids and are closed to appends (count = bucket
+    size), so an interrupted run can simply be repeated."""
+    for legacy, target in (("ticket_history", HOT_COLLECTIONS['ticket_history']),
+                           ("ticket_history_archive", ARCHIVE_COLLECTIONS['ticket_history'])):
+        migrated = 0
+        
+        async def flush(ticket_id, events):
+            buckets = []
+            for start in range(0, len(events), HISTORY_BUCKET_SIZE):
+                chunk = events[start:start + HISTORY_BUCKET_SIZE]
+                bucket_id = f"{ticket_id}:legacy:{start // HISTORY_BUCKET_SIZE}"
+                buckets.append(ReplaceOne({"id": bucket_id}, {
+                    "id": bucket_id,
+                    "ticket_id": ticket_id,
+                    "count": HISTORY_BUCKET_SIZE,
+                    "first_at": chunk[0]['timestamp'],
+                    "last_at": chunk[-1]['timestamp'],
+                    "events": [{k: e.get(k) for k in ("id", "user_id", "action", "timestamp")} for e in chunk],
+                }, upsert=True))
+            await db[target].bulk_write(buckets, ordered=False)
+            await db[legacy].delete_many({"_id": {"$in": [e['_id'] for e in events]}})
+        
+        ticket_id, events = None, []
+        async for entry in db[legacy].find({}).sort([("ticket_id", 1), ("timestamp", 1), ("id", 1)]):
+            if entry['ticket_id'] != ticket_id and events:
+                await flush(ticket_id, events)
+                migrated += len(events)
+                events = []
+            ticket_id = entry['ticket_id']
+            if isinstance(entry.get('timestamp'), datetime):
+                entry['timestamp'] = entry['timestamp'].isoformat()
+            events.append(entry)
+        if events:
+            await flush(ticket_id, events)
+            migrated += len(events)
+        if migrated:
+            logging.info(f"Moved {migrated} history entries from {legacy} into {target}")
+
+async def enqueue_unprocessed_blobs():
+    """Jobs for blobs that were never processed (migrated, or stored before the pipeline)"""
+    async for blob in db.attachment_blobs.find({"processed_at": None}, {"_id": 0, "digest": 1}):
+        await enqueue_attachment_job(blob['digest'])
+
+async def backfill_priority_ranks():
+    """Set priority_rank on tickets written before the work queue existed"""
+    for name, priority in PRIORITIES.items():
+        await db.tickets.update_many(
+            {"priority": name, "priority_rank": None},
+            {"$set": {"priority_rank": priority.rank}}
+        )
+
+# ============= STARTUP =============
+
+# Setup (indexes, pending migrations, seeds) runs before the app serves; completed
+# migrations are recorded, so a restart only re-checks indexes and seeds. Set it to
+# false for multi-worker API processes, with worker.py or `python server.py setup` doing it
+DB_SETUP_ON_STARTUP = os.environ.get('DB_SETUP_ON_STARTUP', 'true').lower() == 'true'
+# Run the scheduled jobs inside the API process (single-process deployments).
+# With several API workers, set it to false and run worker.py once instead.
+RUN_SCHEDULER = os.environ.get('RUN_SCHEDULER', 'true').lower() == 'true'
+
+DEFAULT_CATEGORIES = [
+    ("Hardware", "Problemas de hardware"),
+    ("Software", "Problemas de software"),
+    ("Red", "Problemas de red"),
+    ("Acceso", "Problemas de acceso"),
+    ("Otro", "Otros problemas"),
+]
+DEFAULT_DEPARTMENTS = [
+    ("IT", "Departamento de TI"),
+    ("Ventas", "Departamento de ventas"),
+    ("RRHH", "Recursos Humanos"),
+    ("Finanzas", "Departamento financiero"),
+]
+
+boot_timings: Dict[str, float] = {}
+
+@contextmanager
+def boot_phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        boot_timings[name] = round((time.perf_counter() - start) * 1000, 1)
+        logging.info(f"Boot phase '{name}' took {boot_timings[name]} ms")
+
+async def upsert_by_name(collection, entries):
+    """Insert the (name, description) entries that are missing; existing ones are left untouched"""
+    inserted = 0
+    for name, description in entries:
+        try:
+            result = await collection.update_one(
+                {"name": name},
+                {"$setOnInsert": {"id": str(uuid.uuid4()), "name": name, "description": description}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            continue  # another process inserted it first
+        if result.upserted_id is not None:
+            inserted += 1
+    return inserted
+
+async def seed_reference_data():
+    """Idempotent seed of the default categories and departments"""
+    categories = await upsert_by_name(db.categories, DEFAULT_CATEGORIES)
+    departments = await upsert_by_name(db.departments, DEFAULT_DEPARTMENTS)
+    if categories or departments:
+        logging.info(f"Seeded {categories} categories and {departments} departments")
+
+async def setup_database():
+    """Indexes, data migrations and reference data; safe to run any number of times"""
+    with boot_phase("indexes"):
+        await ensure_indexes()
+    with boot_phase("migrations"):
+        applied = await run_migrations()
+    with boot_phase("seed"):
+        await seed_reference_data()
+    if applied:
+        await invalidate_all_ticket_lists()  # migrations may have rewritten tickets
+
+# One-shot data migrations, in order. Each is recorded in the migrations collection
+# once it completes, so later setups skip its scans; delete the record to run it again.
+MIGRATIONS = [
+    ("legacy_sessions", migrate_legacy_sessions),
+    ("due_dates", backfill_due_dates),
+    ("priority_ranks", backfill_priority_ranks),
+    ("updated_at", backfill_updated_at),
+    ("attachment_blobs", migrate_attachment_blobs),
+    ("history_buckets", migrate_history_to_buckets),
+    ("unprocessed_blobs", enqueue_unprocessed_blobs),
+]
+
+async def run_migrations() -> int:
+    """Run the migrations not recorded yet; returns how many ran"""
+    done = {doc['id'] for doc in await db.migrations.find({}, {"_id": 0, "id": 1}).to_list(None)}
+    applied = 0
+    for name, migration in MIGRATIONS:
+        if name in done:
+            continue
+        with boot_phase(f"migration:{name}"):
+            await migration()
+        await db.migrations.update_one(
+            {"id": name},
+            {"$setOnInsert": {"id": name, "completed_at": datetime.now(timezone.utc).isoformat()}},
+            upsert=True
+        )
+        applied += 1
+    return applied
+
+# Scheduled jobs: (id, callable, interval trigger kwargs). Shared by the in-process
+# scheduler and worker.py
+SCHEDULED_JOBS = [
+    ("priority_escalation", run_escalation_task, {"hours": 1}),
+    ("ticket_archival", run_archival_task, {"hours": 24}),
+    ("deleted_ticket_gc", run_gc_task, {"minutes": 10}),
+    ("attachment_blob_gc", run_blob_gc_task, {"minutes": 30}),
+    ("attachment_processing", run_attachment_jobs_task, {"seconds": 15}),
+    ("report_rollup", run_rollup_task, {"minutes": 5}),
+]
+
+def add_scheduled_jobs(scheduler):
+    for job_id, func, interval in SCHEDULED_JOBS:
+        scheduler.add_job(traced_job(job_id, func), 'interval', id=job_id, **interval)
+
+# Initialize scheduler (started by start_scheduler)
+scheduler = None
+assignment_refresh = None
+
+def start_scheduler():
     global scheduler
+    from apscheduler.schedulers.background import BackgroundScheduler
     
-    # Initialize and start scheduler
     if scheduler is None or not scheduler.running:
         scheduler = BackgroundScheduler()
-        scheduler.add_job(run_escalation_task, 'interval', hours=1, id='priority_escalation')
+        add_scheduled_jobs(scheduler)
         scheduler.start()
-        logging.info("Priority escalation scheduler started successfully")
-    
-    # Check if categories exist
-    cat_count = await db.categories.count_documents({})
-    if cat_count == 0:
-        categories = [
-            {"id": str(uuid.uuid4()), "name": "Hardware", "description": "Problemas de hardware"},
-            {"id": str(uuid.uuid4()), "name": "Software", "description": "Problemas de software"},
-            {"id": str(uuid.uuid4()), "name": "Red", "description": "Problemas de red"},
-            {"id": str(uuid.uuid4()), "name": "Acceso", "description": "Problemas de acceso"},
-            {"id": str(uuid.uuid4()), "name": "Otro", "description": "Otros problemas"}
-        ]
-        await db.categories.insert_many(categories)
-        logging.info("Initial categories seeded")
-    
-    # Check if departments exist
-    dept_count = await db.departments.count_documents({})
-    if dept_count == 0:
-        departments = [
-            {"id": str(uuid.uuid4()), "name": "IT", "description": "Departamento de TI"},
-            {"id": str(uuid.uuid4()), "name": "Ventas", "description": "Departamento de ventas"},
-            {"id": str(uuid.uuid4()), "name": "RRHH", "description": "Recursos Humanos"},
-            {"id": str(uuid.uuid4()), "name": "Finanzas", "description": "Departamento financiero"}
-        ]
-        await db.departments.insert_many(departments)
-        logging.info("Initial departments seeded")
-    
-    # Log scheduler status
-    if scheduler:
-        logging.info(f"Background scheduler status: running={scheduler.running}, jobs={len(scheduler.get_jobs())}")
-
-@app.on_event("shutdown")
-async def shutdown_event():
+        logging.info(f"Background scheduler started with {len(scheduler.get_jobs())} jobs")
+
+async def startup():
+    global assignment_refresh
+    logging.info(f"Boot phase 'import' took {boot_timings.get('import')} ms")
+    started = time.perf_counter()
+    
+    if DB_SETUP_ON_STARTUP:
+        await setup_database()
+    # After setup, so no job runs before the indexes and backfills exist
+    if RUN_SCHEDULER:
+        with boot_phase("scheduler"):
+            start_scheduler()
+    with boot_phase("assignment_engine"):
+        await rebuild_assignment_engine()
+    assignment_refresh = asyncio.create_task(refresh_assignment_engine())
+    
+    logging.info(f"Startup complete in {round((time.perf_counter() - started) * 1000, 1)} ms")
+
+async def shutdown():
+    if assignment_refresh:
+        assignment_refresh.cancel()
     if scheduler and scheduler.running:
         scheduler.shutdown()
-        logging.info("Priority escalation scheduler shut down")
+        logging.info("Background scheduler shut down")
+    shutdown_attachment_pool()
+    shutdown_password_pool()
+    await close_response_cache()
+    await asyncio.to_thread(span_exporter.flush, wait=True)
     client.close()
 
-# Include router
-app.include_router(api_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await shutdown()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# ============= APP FACTORY =============
+
+async def profile_db_queries(request: Request, call_next):
+    profile = QueryProfile()
+    token = _current_profile.set(profile)
+    try:
+        response = await call_next(request)
+    finally:
+        _current_profile.reset(token)
+    
+    route = request.scope.get('route')
+    route_key = f"{request.method} {route.path if route else request.url.path}"
+    
+    for shape, count in profile.repeated_shapes().items():
+        logging.warning(f"Possible N+1 in {route_key}: '{shape}' issued {count} times")
+    
+    response.headers['X-DB-Queries'] = str(len(profile))
+    response.headers['Server-Timing'] = f'db;dur={profile.total_ms:.2f};desc="{len(profile)} queries"'
+    
+    budget = QUERY_BUDGETS.get(route_key)
+    if budget is not None and len(profile) > budget:
+        logging.error(f"Query budget exceeded in {route_key}: {len(profile)} > {budget}")
+        if DB_QUERY_BUDGET_STRICT:
+            return JSONResponse(
+                status_code=500,
+                content={"detail": f"Query budget exceeded: {len(profile)} > {budget}"},
+                headers={'X-DB-Queries': str(len(profile))}
+            )
+    
+    return response
+
+async def trace_requests(request: Request, call_next):
+    """Server span for the request; joins the caller's trace when a traceparent header is sent"""
+    incoming = parse_traceparent(request.headers.get('traceparent'))
+    trace_id, parent_id, sampled = incoming or (None, None, None)
+    span = Span(request.method, "server", trace_id=trace_id, parent_id=parent_id, sampled=sampled, attributes={
+        "http.request.method": request.method,
+        "url.path": request.url.path,
+    })
+    span_token = _current_span.set(span)
+    trace_token = _request_trace.set({})
+    try:
+        response = await call_next(request)
+        span.set_attribute("http.response.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.error = f"HTTP {response.status_code}"
+        response.headers['traceparent'] = span.traceparent
+        return response
+    except BaseException as exc:
+        span.record_exception(exc)
+        raise
+    finally:
+        _request_trace.reset(trace_token)
+        _current_span.reset(span_token)
+        route = request.scope.get('route')
+        if route is not None:
+            span.name = f"{request.method} {route.path}"
+            span.set_attribute("http.route", route.path)
+        span.end()
+
+def create_app() -> FastAPI:
+    """ASGI app factory: uvicorn server:create_app --factory --workers N"""
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(api_router)
+    
+    if DB_PROFILING:
+        app.middleware("http")(profile_db_queries)
+    # Added last so it wraps the profiler: its queries land inside the request span
+    if TRACING_ENABLED:
+        app.middleware("http")(trace_requests)
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    return app
+
+app = create_app()
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
-logger = logging.getLogger(__name__)
\ No newline at end of file
+logger = logging.getLogger(__name__)
+
+boot_timings['import'] = round((time.perf_counter() - boot_started) * 1000, 1)
+
+if __name__ == "__main__":
+    # python server.py setup: run setup_database once, e.g. as a deploy step before
+    # starting API processes with DB_SETUP_ON_STARTUP=false
+    # python server.py rebuild-reports: recompute the report buckets from the tickets
+    import sys
+    commands = {"setup": setup_database, "rebuild-reports": rebuild_report_rollups}
+    if len(sys.argv) != 2 or sys.argv[1] not in commands:
+        sys.exit("usage: python server.py setup | rebuild-reports")
+    asyncio.run(commands[sys.argv[1]]())
+    client.close()
@@ -0,0 +1,64 @@
+"""
+Background worker: runs the scheduled jobs (escalation, archival, deleted-ticket
+and attachment blob GC, attachment processing, report rollups) in their own
+process so API processes only serve requests.
+
+    python worker.py          # setup_database once, then run the jobs on their schedule
+    python worker.py --once   # run every job once and exit (cron, smoke tests)
+
+API processes started next to it should use RUN_SCHEDULER=false and
+DB_SETUP_ON_STARTUP=false, leaving both to this process.
+"""
+
+import argparse
+import asyncio
+import logging
+import signal
+import sys
+
+import server
+
+
+def run_once():
+    for job_id, func, _ in server.SCHEDULED_JOBS:
+        logging.info(f"Running job {job_id}")
+        server.traced_job(job_id, func)()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TechAssist background worker")
+    parser.add_argument("--once", action="store_true", help="Run every job once and exit")
+    parser.add_argument("--skip-setup", action="store_true", help="Do not run setup_database before starting")
+    args = parser.parse_args()
+
+    if not args.skip_setup:
+        with server.boot_phase("setup_database"):
+            asyncio.run(server.setup_database())
+
+    if args.once:
+        run_once()
+        server.shutdown_attachment_pool()
+        server.client.close()
+        return 0
+
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    scheduler = BlockingScheduler()
+    server.add_scheduled_jobs(scheduler)
+
+    def stop(signum, frame):
+        logging.info(f"Received signal {signum}, shutting down worker")
+        scheduler.shutdown(wait=False)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logging.info(f"Worker started with {len(scheduler.get_jobs())} jobs")
+    scheduler.start()
+    server.shutdown_attachment_pool()
+    server.client.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -384,13 +384,43 @@ class TechAssistAPITester:
         print("\n🔍 Testing Equipment Endpoints...")
         
         if self.client_token:
-            self.run_test(
+            success, response = self.run_test(
                 "Get Equipments",
                 "GET",
                 "equipments",
                 200,
                 token=self.client_token
             )
+            if success:
+                self.log_test(
+                    "Equipments Page Shape",
+                    isinstance(response.get('items'), list) and 'next_cursor' in response,
+                    f"Keys: {sorted(response)}"
+                )
+        
+        # Page through the inventory one device at a time
+        if self.tech_token:
+            success, first = self.run_test(
+                "Get Equipments First Page",
+                "GET",
+                "equipments?limit=1",
+                200,
+                token=self.tech_token
+            )
+            if success and first.get('next_cursor'):
+                success, second = self.run_test(
+                    "Get Equipments Next Page",
+                    "GET",
+                    f"equipments?limit=1&after={first['next_cursor']}",
+                    200,
+                    token=self.tech_token
+                )
+                if success:
+                    self.log_test(
+                        "Equipments Cursor Advances",
+                        len(first['items']) == 1 and all(e['id'] > first['next_cursor'] for e in second['items']),
+                        f"First: {first['next_cursor']}, next: {[e['id'] for e in second['items']]}"
+                    )
 
     def test_unauthorized_access(self):
         """Test unauthorized access scenarios"""
@@ -15,6 +15,8 @@ import { Plus, LogOut, Ticket, Upload, X } from "lucide-react";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Only the columns the ticket cards render
+const CARD_FIELDS = "title,description,status,priority,category_name,technician_name,created_at";
 
 export default function ClientDashboard() {
   const { user, token, logout } = useAuth();
@@ -39,13 +41,13 @@ export default function ClientDashboard() {
   const fetchData = async () => {
     try {
       const [ticketsRes, categoriesRes, equipmentsRes] = await Promise.all([
-        axios.get(`${API}/tickets`, { headers: { Authorization: `Bearer ${token}` } }),
+        axios.get(`${API}/tickets?fields=${CARD_FIELDS}`, { headers: { Authorization: `Bearer ${token}` } }),
         axios.get(`${API}/categories`),
-        axios.get(`${API}/equipments`, { headers: { Authorization: `Bearer ${token}` } })
+        axios.get(`${API}/equipments?fields=name,type`, { headers: { Authorization: `Bearer ${token}` } })
       ]);
       setTickets(ticketsRes.data);
       setCategories(categoriesRes.data);
-      setEquipments(equipmentsRes.data);
+      setEquipments(equipmentsRes.data.items);
     } catch (error) {
       toast.error("Error al cargar datos");
     } finally {
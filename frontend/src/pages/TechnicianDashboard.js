@@ -7,10 +7,12 @@ import { Card, CardContent } from "@/components/ui/card";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs";
 import { Badge } from "@/components/ui/badge";
 import { toast } from "sonner";
-import { LogOut, Ticket, Filter } from "lucide-react";
+import { LogOut, Ticket, Filter, Hand } from "lucide-react";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Only the columns TicketCard renders
+const CARD_FIELDS = "title,description,status,priority,user_name,category_name,technician_name,created_at";
 
 export default function TechnicianDashboard() {
   const { user, token, logout } = useAuth();
@@ -20,6 +22,7 @@ export default function TechnicianDashboard() {
   const [resolvedTickets, setResolvedTickets] = useState([]);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState("all");
+  const [claiming, setClaiming] = useState(false);
 
   useEffect(() => {
     fetchData();
@@ -28,9 +31,9 @@ export default function TechnicianDashboard() {
   const fetchData = async () => {
     try {
       const [allRes, assignedRes, resolvedRes] = await Promise.all([
-        axios.get(`${API}/tickets`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/tickets/my-assigned`, { headers: { Authorization: `Bearer ${token}` } }),
-        axios.get(`${API}/tickets/my-resolved`, { headers: { Authorization: `Bearer ${token}` } })
+        axios.get(`${API}/tickets?fields=${CARD_FIELDS}`, { headers: { Authorization: `Bearer ${token}` } }),
+        axios.get(`${API}/tickets/my-assigned?fields=${CARD_FIELDS}`, { headers: { Authorization: `Bearer ${token}` } }),
+        axios.get(`${API}/tickets/my-resolved?fields=${CARD_FIELDS}`, { headers: { Authorization: `Bearer ${token}` } })
       ]);
       setAllTickets(allRes.data);
       setAssignedTickets(assignedRes.data);
@@ -42,6 +45,25 @@ export default function TechnicianDashboard() {
     }
   };
 
+  const claimNextTicket = async () => {
+    setClaiming(true);
+    try {
+      const response = await axios.post(`${API}/queue/claim`, {}, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      toast.success(`Ticket asignado: ${response.data.title}`);
+      navigate(`/ticket/${response.data.id}`);
+    } catch (error) {
+      if (error.response?.status === 404) {
+        toast.info("No hay tickets sin asignar");
+      } else {
+        toast.error("Error al tomar ticket");
+      }
+    } finally {
+      setClaiming(false);
+    }
+  };
+
   const getPriorityColor = (priority) => {
     switch (priority) {
       case "baja": return "bg-green-500";
@@ -181,6 +203,15 @@ export default function TechnicianDashboard() {
                 Resueltos por mí ({resolvedTickets.length})
               </TabsTrigger>
             </TabsList>
+            <Button
+              onClick={claimNextTicket}
+              disabled={claiming}
+              className="bg-teal-600 hover:bg-teal-700"
+              data-testid="claim-next-ticket-button"
+            >
+              <Hand className="w-4 h-4 mr-2" />
+              {claiming ? "Asignando..." : "Tomar siguiente"}
+            </Button>
           </div>
 
           <TabsContent value="all" className="space-y-4" data-testid="all-tickets-content">
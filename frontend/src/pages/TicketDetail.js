@@ -23,6 +23,11 @@ export default function TicketDetail() {
   const [ticket, setTicket] = useState(null);
   const [technicians, setTechnicians] = useState([]);
   const [newComment, setNewComment] = useState("");
+  // The detail embeds the latest comments and history; older pages are loaded on demand
+  const [olderComments, setOlderComments] = useState([]);
+  const [commentsCursor, setCommentsCursor] = useState(null);
+  const [olderHistory, setOlderHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
   const [loading, setLoading] = useState(true);
   const [updating, setUpdating] = useState(false);
   const [editMode, setEditMode] = useState({
@@ -44,6 +49,10 @@ export default function TicketDetail() {
         headers: { Authorization: `Bearer ${token}` }
       });
       setTicket(response.data);
+      setOlderComments([]);
+      setCommentsCursor(response.data.comments_cursor);
+      setOlderHistory([]);
+      setHistoryCursor(response.data.history_cursor);
     } catch (error) {
       toast.error("Error al cargar ticket");
       navigate("/dashboard");
@@ -52,9 +61,49 @@ export default function TicketDetail() {
     }
   };
 
+  const loadOlderComments = async () => {
+    try {
+      const response = await axios.get(`${API}/tickets/${ticketId}/comments`, {
+        params: { before: commentsCursor },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      // Pages before a cursor come newest first; the list is shown oldest first
+      setOlderComments([...response.data.items.reverse(), ...olderComments]);
+      setCommentsCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error("Error al cargar comentarios anteriores");
+    }
+  };
+
+  const loadOlderHistory = async () => {
+    try {
+      const response = await axios.get(`${API}/tickets/${ticketId}/history`, {
+        params: { before: historyCursor },
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setOlderHistory([...olderHistory, ...response.data.items]);
+      setHistoryCursor(response.data.next_cursor);
+    } catch (error) {
+      toast.error("Error al cargar historial anterior");
+    }
+  };
+
+  // The detail only carries thumbnails; the file itself is downloaded on demand
+  const openAttachment = async (att) => {
+    try {
+      const response = await axios.get(`${API}/tickets/${ticketId}/attachments/${att.id}/content`, {
+        headers: { Authorization: `Bearer ${token}` },
+        responseType: "blob"
+      });
+      window.open(URL.createObjectURL(response.data), "_blank");
+    } catch (error) {
+      toast.error("Error al abrir el adjunto");
+    }
+  };
+
   const fetchTechnicians = async () => {
     try {
-      const response = await axios.get(`${API}/users/technicians`, {
+      const response = await axios.get(`${API}/users/technicians?fields=name`, {
         headers: { Authorization: `Bearer ${token}` }
       });
       setTechnicians(response.data);
@@ -140,6 +189,8 @@ export default function TicketDetail() {
   if (!ticket) return null;
 
   const isTechnician = user.role === "tecnico" || user.role === "admin";
+  const comments = [...olderComments, ...(ticket.comments || [])];
+  const history = [...(ticket.history || []), ...olderHistory];
 
   return (
     <div className="min-h-screen" style={{
@@ -197,12 +248,22 @@ export default function TicketDetail() {
                     </h3>
                     <div className="grid grid-cols-2 md:grid-cols-3 gap-4">
                       {ticket.attachments.map(att => (
-                        <div key={att.id} className="relative group">
-                          <img
-                            src={`data:image/jpeg;base64,${att.file_data}`}
-                            alt={att.filename}
-                            className="w-full h-40 object-cover rounded-lg border border-gray-200"
-                          />
+                        <div key={att.id} className="relative group cursor-pointer" onClick={() => openAttachment(att)}>
+                          {att.thumbnail ? (
+                            <img
+                              src={`data:image/jpeg;base64,${att.thumbnail}`}
+                              alt={att.filename}
+                              className="w-full h-40 object-cover rounded-lg border border-gray-200"
+                            />
+                          ) : (
+                            <div className="w-full h-40 rounded-lg border border-gray-200 bg-gray-50 p-2 overflow-hidden">
+                              {att.text_preview ? (
+                                <pre className="text-[10px] text-gray-600 whitespace-pre-wrap">{att.text_preview}</pre>
+                              ) : (
+                                <FileText className="w-8 h-8 text-gray-400 mx-auto mt-12" />
+                              )}
+                            </div>
+                          )}
                           <div className="absolute inset-0 bg-black/50 opacity-0 group-hover:opacity-100 transition-opacity rounded-lg flex items-center justify-center">
                             <span className="text-white text-xs text-center px-2">{att.filename}</span>
                           </div>
@@ -218,13 +279,18 @@ export default function TicketDetail() {
                 <div>
                   <h3 className="font-semibold text-gray-900 mb-4 flex items-center gap-2">
                     <MessageSquare className="w-4 h-4" />
-                    Comentarios ({ticket.comments?.length || 0})
+                    Comentarios ({ticket.comments_total ?? comments.length})
                   </h3>
 
                   <ScrollArea className="h-80 pr-4">
                     <div className="space-y-4">
-                      {ticket.comments && ticket.comments.length > 0 ? (
-                        ticket.comments.map(comment => (
+                      {commentsCursor && (
+                        <Button variant="ghost" size="sm" className="w-full" onClick={loadOlderComments} data-testid="older-comments-button">
+                          Ver comentarios anteriores
+                        </Button>
+                      )}
+                      {comments.length > 0 ? (
+                        comments.map(comment => (
                           <div key={comment.id} className="bg-gray-50 rounded-lg p-4">
                             <div className="flex items-start justify-between mb-2">
                               <span className="font-medium text-gray-900">{comment.user_name}</span>
@@ -388,13 +454,13 @@ export default function TicketDetail() {
             {/* History Card */}
             <Card className="bg-white/70 backdrop-blur border-0 shadow-lg">
               <CardHeader>
-                <CardTitle className="text-lg">Historial</CardTitle>
+                <CardTitle className="text-lg">Historial ({ticket.history_total ?? history.length})</CardTitle>
               </CardHeader>
               <CardContent>
                 <ScrollArea className="h-60">
                   <div className="space-y-3">
-                    {ticket.history && ticket.history.length > 0 ? (
-                      ticket.history.map((hist, index) => (
+                    {history.length > 0 ? (
+                      history.map((hist, index) => (
                         <div key={hist.id} className="relative pl-4 pb-3 border-l-2 border-gray-200 last:border-0">
                           <div className="absolute left-0 top-0 w-2 h-2 -translate-x-[5px] rounded-full bg-teal-500"></div>
                           <p className="text-sm text-gray-900">{hist.action}</p>
@@ -406,6 +472,11 @@ export default function TicketDetail() {
                     ) : (
                       <p className="text-gray-500 text-sm text-center py-4">Sin historial</p>
                     )}
+                    {historyCursor && (
+                      <Button variant="ghost" size="sm" className="w-full" onClick={loadOlderHistory} data-testid="older-history-button">
+                        Ver anteriores
+                      </Button>
+                    )}
                   </div>
                 </ScrollArea>
               </CardContent>
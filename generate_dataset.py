@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Generador de datos sintéticos a escala de producción.
+
+A diferencia de seed_database.py (un puñado de registros de ejemplo), produce
+volúmenes configurables y reproducibles (misma semilla = mismos datos) con
+distribuciones realistas de estado y prioridad, e inserta en lotes
+desordenados (insert_many ordered=False) con varios lotes en paralelo.
+
+Uso:
+    python generate_dataset.py --users 10000 --tickets 1000000 \\
+        --comments 10000000 --history 10000000 --drop
+
+Todos los usuarios comparten la contraseña --password, hasheada una sola vez.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+import bcrypt
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = os.getenv("DB_NAME", "soporte_ti_db")
+
+DEPARTMENTS = [
+    ("IT", "Departamento de TI"),
+    ("Ventas", "Departamento de ventas"),
+    ("RRHH", "Recursos Humanos"),
+    ("Finanzas", "Departamento financiero"),
+]
+CATEGORIES = [
+    ("Hardware", "Problemas de hardware"),
+    ("Software", "Problemas de software"),
+    ("Red", "Problemas de red"),
+    ("Acceso", "Problemas de acceso"),
+    ("Otro", "Otros problemas"),
+]
+STATUS_WEIGHTS = {"abierto": 0.20, "en_proceso": 0.15, "cerrado": 0.65}
+PRIORITY_WEIGHTS = {"baja": 0.55, "media": 0.30, "alta": 0.15}
+RESPONSE_HOURS = {"baja": 72, "media": 24, "alta": 4}
+PRIORITY_RANKS = {"baja": 1, "media": 2, "alta": 3}
+HISTORY_BUCKET_SIZE = 50  # events per ticket_history_buckets document, as in the backend
+TITLES = [
+    "Laptop no enciende", "Error al abrir Excel", "Sin acceso a la VPN",
+    "Impresora atascada", "Contraseña bloqueada", "Pantalla azul al iniciar",
+    "Correo no sincroniza", "Red lenta en la oficina", "Teclado no responde",
+]
+COMMENTS = [
+    "Revisando el equipo.", "¿Puede reiniciar y probar de nuevo?",
+    "Ya funciona, gracias.", "Se solicitó el repuesto.", "Sigue fallando.",
+]
+
+
+def stable_id(seed, kind, index):
+    """Deterministic uuid4-shaped id, so rows can reference each other without keeping ids in memory"""
+    digest = hashlib.md5(f"{seed}:{kind}:{index}".encode()).digest()
+    return str(uuid.UUID(bytes=digest, version=4))
+
+
+class Generator:
+    """Builds documents with the same shape the backend writes"""
+
+    def __init__(self, args):
+        self.args = args
+        self.seed = args.seed
+        self.now = datetime(2025, 1, 1, tzinfo=timezone.utc) if args.fixed_clock else datetime.now(timezone.utc)
+        self.password_hash = bcrypt.hashpw(args.password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+        # Users: [0] admin, [1..technicians] técnicos, rest clientes
+        self.n_technicians = max(1, min(args.technicians, args.users - 2))
+        self.digests = {}  # attachment variant -> sha256
+
+    def rng(self, kind, batch_start):
+        return random.Random(f"{self.seed}:{kind}:{batch_start}")
+
+    def user_id(self, i):
+        return stable_id(self.seed, "user", i)
+
+    def user_name(self, i):
+        return f"Usuario {i}"
+
+    def ticket_id(self, i):
+        return stable_id(self.seed, "ticket", i)
+
+    def random_client(self, rng):
+        return self.user_id(rng.randrange(self.n_technicians + 1, self.args.users))
+
+    def random_technician(self, rng):
+        return self.user_id(rng.randrange(1, self.n_technicians + 1))
+
+    def departments(self):
+        return [{"id": stable_id(self.seed, "department", i), "name": name, "description": desc}
+                for i, (name, desc) in enumerate(DEPARTMENTS)]
+
+    def categories(self):
+        return [{"id": stable_id(self.seed, "category", i), "name": name, "description": desc}
+                for i, (name, desc) in enumerate(CATEGORIES)]
+
+    def users(self, start, end):
+        rng = self.rng("users", start)
+        docs = []
+        for i in range(start, end):
+            role = "admin" if i == 0 else "tecnico" if i <= self.n_technicians else "cliente"
+            docs.append({
+                "id": self.user_id(i),
+                "email": f"{role}{i}@techassist.test",
+                "name": self.user_name(i),
+                "password": self.password_hash,
+                "role": role,
+                "phone": f"555-{i % 10000:04d}",
+                "department_id": stable_id(self.seed, "department", rng.randrange(len(DEPARTMENTS))),
+                "status": "activo" if rng.random() < 0.97 else "inactivo",
+                "created_at": (self.now - timedelta(days=rng.uniform(0, 3 * 365))).isoformat(),
+            })
+        return docs
+
+    def tickets(self, start, end):
+        rng = self.rng("tickets", start)
+        statuses, status_weights = zip(*STATUS_WEIGHTS.items())
+        priorities, priority_weights = zip(*PRIORITY_WEIGHTS.items())
+        docs = []
+        for i in range(start, end):
+            created_at = self.now - timedelta(days=rng.uniform(0, self.args.days))
+            status = rng.choices(statuses, status_weights)[0]
+            client = rng.randrange(self.n_technicians + 1, self.args.users)
+            category = rng.randrange(len(CATEGORIES))
+            assigned_at = closed_at = technician = None
+            if status != "abierto" or rng.random() < 0.3:
+                technician = rng.randrange(1, self.n_technicians + 1)
+                assigned_at = created_at + timedelta(hours=rng.expovariate(1 / 4))
+            if status == "cerrado":
+                closed_at = (assigned_at or created_at) + timedelta(hours=rng.expovariate(1 / 30))
+            title = rng.choice(TITLES)
+            priority = rng.choices(priorities, priority_weights)[0]
+            docs.append({
+                "id": self.ticket_id(i),
+                "user_id": self.user_id(client),
+                "technician_id": self.user_id(technician) if technician else None,
+                "equipment_id": None,
+                "category_id": stable_id(self.seed, "category", category),
+                "title": title,
+                "description": "Ticket generado por generate_dataset.py",
+                "priority": priority,
+                "priority_rank": PRIORITY_RANKS[priority],
+                "status": status,
+                "created_at": created_at.isoformat(),
+                "assigned_at": assigned_at.isoformat() if assigned_at else None,
+                "closed_at": closed_at.isoformat() if closed_at else None,
+                "last_priority_change": created_at.isoformat(),
+                "due_at": (created_at + timedelta(hours=RESPONSE_HOURS[priority])).isoformat(),
+                "updated_at": (closed_at or assigned_at or created_at).isoformat(),
+                "user_name": self.user_name(client),
+                "technician_name": self.user_name(technician) if technician else None,
+                "category_name": CATEGORIES[category][0],
+            })
+        return docs
+
+    def comments(self, start, end):
+        rng = self.rng("comments", start)
+        return [{
+            "id": stable_id(self.seed, "comment", i),
+            "ticket_id": self.ticket_id(rng.randrange(self.args.tickets)),
+            "user_id": self.random_technician(rng) if rng.random() < 0.5 else self.random_client(rng),
+            "comment": rng.choice(COMMENTS),
+            "created_at": (self.now - timedelta(days=rng.uniform(0, self.args.days))).isoformat(),
+        } for i in range(start, end)]
+
+    def history(self, start, end):
+        """History buckets for tickets [start, end); --history events are spread evenly over the tickets"""
+        rng = self.rng("history", start)
+        per_ticket, extra = divmod(self.args.history, self.args.tickets)
+        docs = []
+        for t in range(start, end):
+            events = sorted((
+                {
+                    "id": stable_id(self.seed, "history", f"{t}:{n}"),
+                    "user_id": self.random_technician(rng),
+                    "action": rng.choice(["Estado cambiado a en_proceso", "Comentario agregado",
+                                          "Prioridad cambiada de baja a media", "Estado cambiado a cerrado"]),
+                    "timestamp": (self.now - timedelta(days=rng.uniform(0, self.args.days))).isoformat(),
+                } for n in range(per_ticket + (1 if t < extra else 0))
+            ), key=lambda e: e["timestamp"])
+            for b in range(0, len(events), HISTORY_BUCKET_SIZE):
+                chunk = events[b:b + HISTORY_BUCKET_SIZE]
+                docs.append({
+                    "id": stable_id(self.seed, "history_bucket", f"{t}:{b}"),
+                    "ticket_id": self.ticket_id(t),
+                    "count": len(chunk),
+                    "first_at": chunk[0]["timestamp"],
+                    "last_at": chunk[-1]["timestamp"],
+                    "events": chunk,
+                })
+        return docs
+
+    def blob_content(self, variant):
+        return random.Random(f"{self.seed}:blob:{variant}").randbytes(self.args.attachment_kb * 1024)
+
+    def blob_digest(self, variant):
+        if variant not in self.digests:
+            self.digests[variant] = hashlib.sha256(self.blob_content(variant)).hexdigest()
+        return self.digests[variant]
+
+    def attachments(self, start, end):
+        """Rows reference one of --attachment-variants contents, like repeated uploads of the same file"""
+        rng = self.rng("attachments", start)
+        variants = max(1, min(self.args.attachment_variants, self.args.attachments))
+        docs = []
+        for i in range(start, end):
+            ticket = rng.randrange(self.args.tickets)
+            variant = rng.randrange(variants)
+            docs.append({
+                "id": stable_id(self.seed, "attachment", i),
+                "ticket_id": self.ticket_id(ticket),
+                "filename": f"captura_{variant}.png",
+                "digest": self.blob_digest(variant),
+                "size": self.args.attachment_kb * 1024,
+                "uploaded_at": (self.now - timedelta(days=rng.uniform(0, self.args.days))).isoformat(),
+            })
+        return docs
+
+    def blobs(self, refcounts):
+        """One blob per distinct content, with refcount = number of rows pointing at it"""
+        variants = max(1, min(self.args.attachment_variants, self.args.attachments))
+        return [{
+            "digest": self.blob_digest(variant),
+            "data": self.blob_content(variant),
+            "size": self.args.attachment_kb * 1024,
+            "refcount": refcounts[self.blob_digest(variant)],
+            "created_at": self.now.isoformat(),
+        } for variant in range(variants) if self.blob_digest(variant) in refcounts]
+
+
+async def insert_batched(collection, build, total, batch_size, parallel):
+    """Insert the docs built for `total` items with at most `parallel` unordered batches in flight"""
+    semaphore = asyncio.Semaphore(parallel)
+    tasks = []
+    inserted = 0
+
+    async def insert(docs):
+        try:
+            if docs:
+                await collection.insert_many(docs, ordered=False)
+        finally:
+            semaphore.release()
+
+    start = time.perf_counter()
+    for batch_start in range(0, total, batch_size):
+        await semaphore.acquire()
+        docs = build(batch_start, min(batch_start + batch_size, total))
+        inserted += len(docs)
+        tasks.append(asyncio.create_task(insert(docs)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        "documents": inserted,
+        "seconds": round(elapsed, 2),
+        "docs_per_second": round(inserted / elapsed, 1) if elapsed else None,
+    }
+
+
+async def generate(args):
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client[DB_NAME]
+    gen = Generator(args)
+
+    if args.drop:
+        print("🗑️  Eliminando colecciones existentes...", file=sys.stderr)
+        for name in ("users", "tickets", "comments", "attachments", "attachment_blobs", "ticket_history_buckets",
+                     "categories", "departments"):
+            await db[name].drop()
+
+    await db.departments.insert_many(gen.departments())
+    await db.categories.insert_many(gen.categories())
+
+    plan = [
+        ("users", db.users, gen.users, args.users),
+        ("tickets", db.tickets, gen.tickets, args.tickets),
+        ("comments", db.comments, gen.comments, args.comments),
+        # Built per ticket: each unit of `total` yields that ticket's history buckets
+        ("ticket_history_buckets", db.ticket_history_buckets, gen.history, args.tickets if args.history > 0 else 0),
+        ("attachments", db.attachments, gen.attachments, args.attachments),
+    ]
+    report = {"seed": args.seed, "database": DB_NAME, "collections": {}}
+    start = time.perf_counter()
+    for name, collection, build, total in plan:
+        if total <= 0:
+            continue
+        print(f"📥 Insertando {total} documentos en {name}...", file=sys.stderr)
+        report["collections"][name] = await insert_batched(collection, build, total, args.batch_size, args.parallel)
+    if args.attachments > 0:
+        refcounts = {}
+        async for group in db.attachments.aggregate([{"$group": {"_id": "$digest", "count": {"$sum": 1}}}]):
+            refcounts[group["_id"]] = group["count"]
+        blobs = gen.blobs(refcounts)
+        await db.attachment_blobs.insert_many(blobs)
+        report["collections"]["attachment_blobs"] = {"documents": len(blobs)}
+    elapsed = time.perf_counter() - start
+    documents = sum(c["documents"] for c in report["collections"].values())
+    report["total"] = {
+        "documents": documents,
+        "seconds": round(elapsed, 2),
+        "docs_per_second": round(documents / elapsed, 1) if elapsed else None,
+    }
+
+    client.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generador de datos sintéticos para TechAssist")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--technicians", type=int, default=200, help="Cuántos de los usuarios son técnicos")
+    parser.add_argument("--tickets", type=int, default=100_000)
+    parser.add_argument("--comments", type=int, default=500_000)
+    parser.add_argument("--history", type=int, default=500_000, help="Eventos de historial (en buckets por ticket)")
+    parser.add_argument("--attachments", type=int, default=0, help="Adjuntos con contenido aleatorio")
+    parser.add_argument("--attachment-kb", type=int, default=64, help="Tamaño de cada adjunto en KB")
+    parser.add_argument("--attachment-variants", type=int, default=50,
+                        help="Contenidos distintos entre los adjuntos (se guardan una vez por SHA-256)")
+    parser.add_argument("--days", type=float, default=365, help="Ventana de fechas de creación")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fixed-clock", action="store_true",
+                        help="Usar una fecha de referencia fija para que las fechas también sean reproducibles")
+    parser.add_argument("--password", default="password123", help="Contraseña compartida (se hashea una vez)")
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--parallel", type=int, default=4, help="Lotes insert_many simultáneos")
+    parser.add_argument("--drop", action="store_true", help="Eliminar las colecciones antes de generar")
+    args = parser.parse_args()
+
+    if args.users < 3:
+        parser.error("--users debe ser al menos 3 (admin, técnico y cliente)")
+    if args.tickets <= 0 and (args.comments or args.history or args.attachments):
+        parser.error("comentarios, historial y adjuntos necesitan --tickets > 0")
+
+    report = asyncio.run(generate(args))
+    print(json.dumps(report, indent=2))
+    print("✅ Datos generados exitosamente!", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
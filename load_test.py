@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Prueba de carga de la API de TechAssist.
+
+Reproduce una mezcla realista de tráfico (clientes creando tickets, técnicos
+revisando el dashboard, vistas de detalle y logins) con concurrencia
+configurable y reporta throughput y latencias p50/p95/p99 por endpoint en JSON,
+para poder comparar resultados entre commits.
+
+Uso:
+    # En proceso (importa backend/server.py, requiere MONGO_URL/DB_NAME locales)
+    python load_test.py --concurrency 50 --duration 30 --output bench.json
+
+    # Contra un uvicorn local (arrancado con RATE_LIMIT_ENABLED=false, ya que
+    # todos los usuarios virtuales comparten IP)
+    python load_test.py --base-url http://localhost:8001 --concurrency 50
+
+    # Comparar con una ejecución anterior
+    python load_test.py --compare bench_prev.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+
+DEFAULT_MIX = "client=0.35,technician=0.30,detail=0.25,login=0.10"
+PASSWORD = "LoadTest123!"
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile over an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(pct / 100 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(rank, len(sorted_values) - 1))]
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        weights[name.strip()] = float(weight)
+    unknown = set(weights) - set(SCENARIOS)
+    if unknown:
+        raise SystemExit(f"Escenarios desconocidos: {', '.join(sorted(unknown))}")
+    return weights
+
+
+class Recorder:
+    """Per-endpoint latency samples"""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, http, label, method, url, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = await http.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.errors[label] += 1
+            return None
+        finally:
+            self.samples[label].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors[label] += 1
+            return None
+        return response
+
+    def report(self, elapsed):
+        endpoints = {}
+        for label, values in sorted(self.samples.items()):
+            values = sorted(values)
+            endpoints[label] = {
+                "count": len(values),
+                "errors": self.errors[label],
+                "throughput_rps": round(len(values) / elapsed, 2),
+                "mean_ms": round(sum(values) / len(values), 2),
+                "p50_ms": round(percentile(values, 50), 2),
+                "p95_ms": round(percentile(values, 95), 2),
+                "p99_ms": round(percentile(values, 99), 2),
+                "max_ms": round(values[-1], 2),
+            }
+        total = sum(len(v) for v in self.samples.values())
+        return {
+            "total_requests": total,
+            "total_errors": sum(self.errors.values()),
+            "duration_s": round(elapsed, 2),
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+class LoadState:
+    """Users, tokens and ticket ids shared by the virtual users"""
+
+    def __init__(self):
+        self.clients = []      # [(email, token)]
+        self.technicians = []  # [(email, token)]
+        self.category_ids = []
+        self.ticket_ids = []
+
+
+# ============= ESCENARIOS =============
+
+async def client_scenario(http, rec, state, rng):
+    """Un cliente crea un ticket y revisa su lista"""
+    _, token = rng.choice(state.clients)
+    headers = {"Authorization": f"Bearer {token}"}
+    response = await rec.call(http, "POST /api/tickets", "POST", "/api/tickets", headers=headers, json={
+        "title": f"Problema {rng.randint(1, 10_000)}",
+        "description": "La impresora no responde desde esta mañana.",
+        "category_id": rng.choice(state.category_ids),
+    })
+    if response is not None:
+        state.ticket_ids.append(response.json()["id"])
+    await rec.call(http, "GET /api/tickets", "GET", "/api/tickets", headers=headers)
+
+
+async def technician_scenario(http, rec, state, rng):
+    """Un técnico abre su dashboard"""
+    _, token = rng.choice(state.technicians)
+    headers = {"Authorization": f"Bearer {token}"}
+    await rec.call(http, "GET /api/tickets", "GET", "/api/tickets", headers=headers)
+    await rec.call(http, "GET /api/tickets/my-assigned", "GET", "/api/tickets/my-assigned", headers=headers)
+    await rec.call(http, "GET /api/users/technicians", "GET", "/api/users/technicians", headers=headers)
+
+
+async def detail_scenario(http, rec, state, rng):
+    """Vista de detalle de un ticket existente"""
+    if not state.ticket_ids:
+        return
+    _, token = rng.choice(state.technicians)
+    ticket_id = rng.choice(state.ticket_ids)
+    await rec.call(http, "GET /api/tickets/{ticket_id}", "GET", f"/api/tickets/{ticket_id}",
+                   headers={"Authorization": f"Bearer {token}"})
+
+
+async def login_scenario(http, rec, state, rng):
+    """Login con contraseña (bcrypt)"""
+    email, _ = rng.choice(state.clients + state.technicians)
+    await rec.call(http, "POST /api/auth/login", "POST", "/api/auth/login",
+                   json={"email": email, "password": PASSWORD})
+
+
+SCENARIOS = {
+    "client": client_scenario,
+    "technician": technician_scenario,
+    "detail": detail_scenario,
+    "login": login_scenario,
+}
+
+
+# ============= EJECUCIÓN =============
+
+async def prepare(http, args):
+    """Register the load-test population and a few starting tickets"""
+    state = LoadState()
+    run_id = uuid.uuid4().hex[:8]
+
+    async def register(role, i):
+        response = await http.post("/api/auth/register", json={
+            "email": f"load_{role}_{run_id}_{i}@test.com",
+            "name": f"Load {role} {i}",
+            "password": PASSWORD,
+            "role": role,
+        })
+        response.raise_for_status()
+        data = response.json()
+        return data["user"]["email"], data["token"]
+
+    state.clients = await asyncio.gather(*(register("cliente", i) for i in range(args.clients)))
+    state.technicians = await asyncio.gather(*(register("tecnico", i) for i in range(args.technicians)))
+
+    response = await http.get("/api/categories")
+    response.raise_for_status()
+    state.category_ids = [c["id"] for c in response.json()]
+    if not state.category_ids:
+        raise SystemExit("No hay categorías; ejecuta `python server.py setup` (o inicia el backend con "
+                         "DB_SETUP_ON_STARTUP=true) para sembrarlas")
+
+    for i in range(args.initial_tickets):
+        _, token = state.clients[i % len(state.clients)]
+        response = await http.post("/api/tickets", headers={"Authorization": f"Bearer {token}"}, json={
+            "title": f"Ticket inicial {i}",
+            "description": "Generado por load_test.py",
+            "category_id": state.category_ids[i % len(state.category_ids)],
+        })
+        response.raise_for_status()
+        state.ticket_ids.append(response.json()["id"])
+    return state
+
+
+async def virtual_user(http, rec, state, weights, deadline, seed):
+    rng = random.Random(seed)
+    names = list(weights)
+    scenario_weights = list(weights.values())
+    while time.perf_counter() < deadline:
+        scenario = SCENARIOS[rng.choices(names, scenario_weights)[0]]
+        await scenario(http, rec, state, rng)
+
+
+@asynccontextmanager
+async def open_client(base_url):
+    if base_url:
+        async with httpx.AsyncClient(base_url=base_url, timeout=30) as http:
+            yield http
+        return
+
+    # In-process: import the ASGI app and run its startup/shutdown hooks.
+    # Every virtual user shares one client IP, so auth throttling is off by default.
+    os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+    sys.path.insert(0, str(Path(__file__).parent / "backend"))
+    import server
+
+    async with server.app.router.lifespan_context(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=30) as http:
+            yield http
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args):
+    weights = parse_mix(args.mix)
+    async with open_client(args.base_url) as http:
+        print("🛠️  Preparando usuarios y tickets...", file=sys.stderr)
+        state = await prepare(http, args)
+
+        print(f"🚀 {args.concurrency} usuarios virtuales durante {args.duration}s...", file=sys.stderr)
+        rec = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*(
+            virtual_user(http, rec, state, weights, deadline, args.seed + i)
+            for i in range(args.concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+
+    report = rec.report(elapsed)
+    report["config"] = {
+        "target": args.base_url or "in-process",
+        "concurrency": args.concurrency,
+        "duration_s": args.duration,
+        "mix": weights,
+        "seed": args.seed,
+    }
+    report["commit"] = git_commit()
+    return report
+
+
+def compare(report, baseline):
+    """Print p95 and throughput deltas against a previous report"""
+    print(f"\n📊 Comparación con {baseline.get('commit') or 'baseline'}:", file=sys.stderr)
+    for label, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(label)
+        if not previous:
+            print(f"  {label}: nuevo", file=sys.stderr)
+            continue
+        p95_delta = current["p95_ms"] - previous["p95_ms"]
+        rps_delta = current["throughput_rps"] - previous["throughput_rps"]
+        print(f"  {label}: p95 {current['p95_ms']}ms ({p95_delta:+.2f}), "
+              f"rps {current['throughput_rps']} ({rps_delta:+.2f})", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API de TechAssist")
+    parser.add_argument("--base-url", help="URL del backend (sin /api); por defecto se ejecuta en proceso")
+    parser.add_argument("--concurrency", type=int, default=20, help="Usuarios virtuales concurrentes")
+    parser.add_argument("--duration", type=float, default=30, help="Duración en segundos")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"Pesos por escenario (por defecto {DEFAULT_MIX})")
+    parser.add_argument("--clients", type=int, default=20, help="Clientes a registrar")
+    parser.add_argument("--technicians", type=int, default=5, help="Técnicos a registrar")
+    parser.add_argument("--initial-tickets", type=int, default=50, help="Tickets creados antes de medir")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla para la mezcla de escenarios")
+    parser.add_argument("--output", help="Archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--compare", help="Reporte JSON anterior para comparar")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+        print(f"✅ Reporte guardado en {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        compare(report, json.loads(Path(args.compare).read_text()))
+    return 0 if report["total_errors"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
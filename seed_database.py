@@ -5,7 +5,7 @@ Se ejecuta automáticamente al iniciar el backend.
 """
 
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 import bcrypt
 from motor.motor_asyncio import AsyncIOMotorClient
 
@@ -23,7 +23,7 @@ async def seed_database():
     await db.tickets.delete_many({})
     await db.comments.delete_many({})
     await db.attachments.delete_many({})
-    await db.ticket_history.delete_many({})
+    await db.ticket_history_buckets.delete_many({})
     await db.categories.delete_many({})
     await db.departments.delete_many({})
     await db.equipments.delete_many({})
@@ -156,11 +156,17 @@ async def seed_database():
             "title": "Laptop no enciende",
             "description": "Mi laptop Dell no responde al presionar el botón de encendido. La luz LED parpadea en naranja.",
             "priority": "alta",
+            "priority_rank": 3,
             "status": "en_proceso",
             "created_at": datetime.now(timezone.utc).isoformat(),
             "assigned_at": datetime.now(timezone.utc).isoformat(),
             "closed_at": None,
-            "last_priority_change": datetime.now(timezone.utc).isoformat()
+            "last_priority_change": datetime.now(timezone.utc).isoformat(),
+            "due_at": (datetime.now(timezone.utc) + timedelta(hours=4)).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "user_name": users[3]["name"],
+            "technician_name": users[1]["name"],
+            "category_name": categories[0]["name"]
         },
         {
             "id": str(uuid.uuid4()),
@@ -171,11 +177,17 @@ async def seed_database():
             "title": "Error al abrir Excel",
             "description": "Cuando intento abrir archivos de Excel me sale un error de 'archivo corrupto'.",
             "priority": "media",
+            "priority_rank": 2,
             "status": "abierto",
             "created_at": datetime.now(timezone.utc).isoformat(),
             "assigned_at": None,
             "closed_at": None,
-            "last_priority_change": datetime.now(timezone.utc).isoformat()
+            "last_priority_change": datetime.now(timezone.utc).isoformat(),
+            "due_at": (datetime.now(timezone.utc) + timedelta(hours=24)).isoformat(),
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "user_name": users[4]["name"],
+            "technician_name": None,
+            "category_name": categories[1]["name"]
         }
     ]
     await db.tickets.insert_many(tickets)
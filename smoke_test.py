@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Smoke test del modelo de procesos de producción.
+
+Arranca localmente el worker de tareas programadas y la API con varios workers de
+uvicorn (app factory), contra el MongoDB de MONGO_URL/DB_NAME, y comprueba que:
+
+  1. `worker.py --once` prepara la base de datos y ejecuta todas las tareas.
+  2. La API responde en /api/health/ready con N procesos y sin scheduler propio.
+  3. Registro, creación y listado de tickets funcionan de punta a punta.
+  4. El worker en modo programado arranca y se detiene limpio con SIGTERM.
+
+Uso:
+    MONGO_URL=mongodb://localhost:27017 DB_NAME=smoke_db python smoke_test.py --workers 2
+"""
+
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+
+
+def step(message):
+    print(f"▶️  {message}", file=sys.stderr)
+
+
+def wait_ready(base_url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/health/ready", timeout=2).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def exercise_api(base_url):
+    with httpx.Client(base_url=base_url, timeout=10) as http:
+        categories = http.get("/api/categories").json()
+        assert categories, "el worker no sembró categorías"
+
+        email = f"smoke_{uuid.uuid4().hex[:8]}@test.com"
+        response = http.post("/api/auth/register", json={
+            "email": email, "name": "Smoke Test", "password": "Smoke123!", "role": "cliente",
+        })
+        response.raise_for_status()
+        headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+        response = http.post("/api/tickets", headers=headers, json={
+            "title": "Smoke test", "description": "Generado por smoke_test.py",
+            "category_id": categories[0]["id"],
+        })
+        response.raise_for_status()
+        ticket_id = response.json()["id"]
+
+        tickets = http.get("/api/tickets", headers=headers).json()
+        assert any(t["id"] == ticket_id for t in tickets), "el ticket creado no aparece en el listado"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Smoke test de API + worker")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--workers", type=int, default=2, help="Procesos de uvicorn")
+    parser.add_argument("--timeout", type=float, default=30, help="Segundos de espera por cada proceso")
+    args = parser.parse_args()
+
+    env = {
+        **os.environ,
+        "RUN_SCHEDULER": "false",
+        "DB_SETUP_ON_STARTUP": "false",
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    step("worker.py --once (setup + todas las tareas)")
+    subprocess.run([sys.executable, "worker.py", "--once"], cwd=BACKEND_DIR, env=env,
+                   check=True, timeout=args.timeout * 4)
+
+    step(f"API con {args.workers} workers en {base_url}")
+    api = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:create_app", "--factory",
+         "--host", "127.0.0.1", "--port", str(args.port), "--workers", str(args.workers)],
+        cwd=BACKEND_DIR, env=env,
+    )
+    worker = None
+    try:
+        if not wait_ready(base_url, args.timeout):
+            raise SystemExit("❌ La API no respondió en /api/health/ready")
+
+        step("registro, creación y listado de tickets")
+        exercise_api(base_url)
+
+        step("worker programado + SIGTERM")
+        worker = subprocess.Popen([sys.executable, "worker.py", "--skip-setup"], cwd=BACKEND_DIR, env=env)
+        time.sleep(3)
+        if worker.poll() is not None:
+            raise SystemExit(f"❌ El worker terminó antes de tiempo (código {worker.returncode})")
+        worker.send_signal(signal.SIGTERM)
+        if worker.wait(timeout=args.timeout) != 0:
+            raise SystemExit(f"❌ El worker terminó con código {worker.returncode}")
+    finally:
+        for process in (worker, api):
+            if process and process.poll() is None:
+                process.terminate()
+                process.wait(timeout=args.timeout)
+
+    print("✅ Smoke test superado", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""
+Shared fixtures: the FastAPI app from backend/server.py on an in-memory mongomock
+database, with the per-request query profiler switched on.
+
+mongomock does not emit pymongo's command-monitoring events, so the collection
+methods are wrapped to feed the profiler the command each call would send to a
+real server (one per call; cursors are counted once, when created).
+"""
+
+import itertools
+import os
+import sys
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'techassist_test')
+os.environ['DB_PROFILING'] = 'true'
+os.environ['DB_SETUP_ON_STARTUP'] = 'true'
+os.environ['RUN_SCHEDULER'] = 'false'
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['RESPONSE_CACHE_BACKEND'] = 'memory'
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock.collection import Collection
+from mongomock_motor import AsyncMongoMockClient, AsyncMongoMockCollection
+
+import server
+
+# ----- mongomock -> query profiler -----
+
+_request_ids = itertools.count(1)
+
+def _command(method: str, collection: str, args: tuple, kwargs: dict) -> tuple:
+    """(command_name, command) pymongo would send for a collection method call"""
+    spec = args[0] if args else kwargs.get('filter', {})
+    if method in ('find', 'find_one'):
+        return 'find', {'find': collection, 'filter': spec or {}}
+    if method == 'aggregate':
+        return 'aggregate', {'aggregate': collection, 'pipeline': spec}
+    if method == 'count_documents':
+        return 'aggregate', {'aggregate': collection, 'pipeline': [{'$match': spec}]}
+    if method == 'distinct':
+        return 'distinct', {'distinct': collection, 'query': args[1] if len(args) > 1 else kwargs.get('filter', {})}
+    if method.startswith('find_one_and_'):
+        return 'findAndModify', {'findAndModify': collection, 'query': spec}
+    if method in ('update_one', 'update_many', 'replace_one', 'bulk_write'):
+        return 'update', {'update': collection, 'updates': [{'q': spec if method != 'bulk_write' else {}}]}
+    if method in ('delete_one', 'delete_many'):
+        return 'delete', {'delete': collection, 'deletes': [{'q': spec}]}
+    return 'insert', {'insert': collection}
+
+def _profiled(method: str, original):
+    def wrapper(self, *args, **kwargs):
+        command_name, command = _command(method, self.name, args, kwargs)
+        event = SimpleNamespace(command_name=command_name, command=command,
+                                request_id=next(_request_ids), duration_micros=0)
+        server.query_profiler.started(event)
+        server.query_profiler.succeeded(event)
+        return original(self, *args, **kwargs)
+    return wrapper
+
+for _method in ('find', 'find_one', 'aggregate', 'count_documents', 'distinct',
+                'find_one_and_update', 'find_one_and_delete', 'find_one_and_replace',
+                'update_one', 'update_many', 'replace_one', 'bulk_write',
+                'insert_one', 'insert_many', 'delete_one', 'delete_many'):
+    setattr(AsyncMongoMockCollection, _method, _profiled(_method, getattr(AsyncMongoMockCollection, _method)))
+
+# ----- mongomock find_one_and_* with an _id-less projection -----
+
+_find_and_modify = Collection._find_and_modify
+
+def _find_and_modify_keeping_id(self, query, projection=None, *args, **kwargs):
+    """mongomock (4.3) finds the target with the caller's projection, so with {"_id": 0}
+    it loses the _id it then updates and re-reads by. It falls back to the original
+    query: the update hits the first match rather than the sorted one, and the AFTER
+    read returns None once the update changed a queried field (e.g. a lease's
+    locked_until). Find the full document and drop the _id from the result instead."""
+    doc = _find_and_modify(self, query, None, *args, **kwargs)
+    if doc is not None and projection and projection.get('_id') == 0:
+        doc.pop('_id', None)
+    return doc
+
+# ----- fixtures -----
+
+@pytest.fixture
+def db(monkeypatch):
+    monkeypatch.setattr(Collection, '_find_and_modify', _find_and_modify_keeping_id)
+    database = AsyncMongoMockClient()[os.environ['DB_NAME']]
+    monkeypatch.setattr(server, 'db', database)
+    # Cached lists and engine loads are process-wide: start each test from scratch
+    monkeypatch.setattr(server, 'response_cache', server.MemoryResponseCache(server.RESPONSE_CACHE_MAX_ENTRIES))
+    monkeypatch.setattr(server, 'single_flight', server.SingleFlight())
+    monkeypatch.setattr(server, 'assignment_engine', server.AssignmentEngine())
+    return database
+
+@pytest.fixture
+def client(db):
+    with TestClient(server.create_app()) as test_client:
+        yield test_client
+
+@pytest.fixture
+def run(client):
+    """Await a coroutine function on the app's event loop: run(server.setup_database)"""
+    return client.portal.call
+
+@pytest.fixture
+def make_user(client):
+    """Register a user and return (user, auth headers)"""
+    def make_user(role: str = "cliente", **fields):
+        email = f"{role}-{uuid.uuid4().hex[:8]}@example.com"
+        response = client.post('/api/auth/register', json={
+            "email": email, "name": email.split('@')[0], "password": "secret123", "role": role, **fields
+        })
+        assert response.status_code == 200, response.text
+        body = response.json()
+        return body['user'], {"Authorization": f"Bearer {body['token']}"}
+    return make_user
+
+@pytest.fixture
+def categories(client):
+    return client.get('/api/categories').json()
+
+@pytest.fixture
+def make_ticket(client, categories):
+    def make_ticket(headers: dict, **fields):
+        response = client.post('/api/tickets', headers=headers, json={
+            "title": "Printer jam", "description": "Paper stuck", "category_id": categories[0]['id'], **fields
+        })
+        assert response.status_code == 200, response.text
+        return response.json()
+    return make_ticket
@@ -0,0 +1,87 @@
+"""Archival: old closed tickets leave the live set but their detail, comments and history stay readable"""
+
+import base64
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+REPORT = base64.b64encode(b"%PDF quarterly report" * 50).decode()
+
+
+@pytest.fixture
+def desk(client, run, make_user, make_ticket):
+    _, requester = make_user("cliente")
+    _, admin = make_user("admin")
+    old = make_ticket(requester, attachments=[{"filename": "report.pdf", "file_data": REPORT}])
+    recent, still_open = make_ticket(requester), make_ticket(requester)
+    client.post(f"/api/tickets/{old['id']}/comments", json={"comment": "Fixed, thanks"}, headers=requester)
+    for ticket in (old, recent):
+        client.put(f"/api/tickets/{ticket['id']}", json={"status": "cerrado"}, headers=admin)
+    closed_at = (datetime.now(timezone.utc) - timedelta(days=server.ARCHIVE_AFTER_DAYS + 1)).isoformat()
+    run(lambda: server.db.tickets.update_one({"id": old['id']}, {"$set": {"closed_at": closed_at}}))
+    return {"requester": requester, "admin": admin, "old": old, "recent": recent, "open": still_open}
+
+
+def archive(client, headers, **params):
+    response = client.post('/api/admin/archive', headers=headers, params=params)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_only_tickets_closed_long_ago_are_archived(client, run, desk):
+    report = archive(client, desk['admin'])
+
+    assert (report['tickets'], report['comments'], report['attachments'], report['ticket_history']) == (1, 1, 1, 1)
+    assert report['bytes'] > 0
+    live = {t['id'] for t in client.get('/api/tickets', headers=desk['requester']).json()}
+    assert live == {desk['recent']['id'], desk['open']['id']}
+    for name, collection in server.HOT_COLLECTIONS.items():
+        key = "id" if name == "tickets" else "ticket_id"
+        assert run(lambda: server.db[collection].count_documents({key: desk['old']['id']})) == 0
+        assert run(lambda: server.db[server.ARCHIVE_COLLECTIONS[name]].count_documents({key: desk['old']['id']})) == 1
+
+
+def test_archived_ticket_stays_readable(client, desk):
+    archive(client, desk['admin'])
+    ticket_id = desk['old']['id']
+
+    detail = client.get(f"/api/tickets/{ticket_id}", headers=desk['requester']).json()
+    assert detail['archived'] is True and detail['status'] == "cerrado"
+    assert [c['comment'] for c in detail['comments']] == ["Fixed, thanks"]
+    assert detail['history'][0]['action'] == "Estado cambiado a cerrado"
+    attachment = detail['attachments'][0]
+    content = client.get(f"/api/tickets/{ticket_id}/attachments/{attachment['id']}/content", headers=desk['requester'])
+    assert content.status_code == 200 and content.content == base64.b64decode(REPORT)
+
+    history = client.get(f"/api/tickets/{ticket_id}/history", headers=desk['requester']).json()['items']
+    assert [h['action'] for h in history][-1].startswith("Ticket creado")
+    comments = client.get(f"/api/tickets/{ticket_id}/comments", headers=desk['requester']).json()['items']
+    assert len(comments) == 1
+    live_detail = client.get(f"/api/tickets/{desk['recent']['id']}", headers=desk['requester']).json()
+    assert live_detail['archived'] is False
+
+
+def test_archived_ticket_keeps_its_permissions(client, make_user, desk):
+    archive(client, desk['admin'])
+    _, stranger = make_user("cliente")
+
+    assert client.get(f"/api/tickets/{desk['old']['id']}", headers=stranger).status_code == 403
+
+
+def test_rerun_moves_nothing_and_only_admins_archive(client, make_user, desk):
+    archive(client, desk['admin'])
+    _, technician = make_user("tecnico")
+
+    assert archive(client, desk['admin'])['tickets'] == 0
+    assert client.post('/api/admin/archive', headers=technician).status_code == 403
+
+
+def test_small_batches_archive_everything(client, run, desk):
+    run(lambda: server.db.tickets.update_many({}, {"$set": {"status": "cerrado", "closed_at": "2000-01-01T00:00:00+00:00"}}))
+
+    report = run(server.archive_closed_tickets, server.ARCHIVE_AFTER_DAYS, 1)
+
+    assert report['tickets'] == 3
+    assert client.get('/api/tickets', headers=desk['admin']).json() == []
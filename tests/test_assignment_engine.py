@@ -0,0 +1,131 @@
+"""Auto-assignment: least-loaded pick, department affinity rules, and nobody to assign to"""
+
+import pytest
+
+import server
+
+
+def engine_with(loads: dict, departments: dict = None, rules: list = None) -> server.AssignmentEngine:
+    engine = server.AssignmentEngine()
+    departments = departments or {}
+    technicians = [{"id": tech_id, "name": tech_id.title(), "department_id": departments.get(tech_id)} for tech_id in loads]
+    engine.rebuild(technicians, loads, rules or [])
+    return engine
+
+
+def test_picks_the_least_loaded_technician():
+    engine = engine_with({"ana": 5, "bea": 2, "carl": 3})
+
+    assert engine.pick() == {"id": "bea", "name": "Bea", "load": 2, "pool": None}
+
+
+def test_load_changes_move_the_next_pick():
+    engine = engine_with({"ana": 1, "bea": 2})
+
+    engine.adjust("ana", server.PRIORITY_WEIGHTS["alta"])
+    assert engine.pick()['id'] == "bea"
+    engine.adjust("ana", -server.PRIORITY_WEIGHTS["alta"])
+    assert engine.pick()['id'] == "ana"
+    engine.adjust("ghost", 5)  # unknown technicians are ignored
+    assert [t['id'] for t in engine.snapshot()] == ["ana", "bea"]
+
+
+def test_ties_break_by_id_so_picks_are_stable():
+    engine = engine_with({"zoe": 0, "ana": 0, "max": 0})
+
+    assert engine.pick()['id'] == "ana"
+
+
+def test_affinity_rule_restricts_the_pool():
+    rules = [{"category_id": "network", "technician_department_id": "infra"}]
+    engine = engine_with({"ana": 0, "bea": 4}, {"bea": "infra"}, rules)
+
+    assert engine.pick("network") == {"id": "bea", "name": "Bea", "load": 4, "pool": "infra"}
+    assert engine.pick("printers")['id'] == "ana"
+
+
+def test_first_matching_rule_wins_and_requester_department_counts():
+    rules = [
+        {"category_id": "network", "requester_department_id": "sales", "technician_department_id": "field"},
+        {"category_id": "network", "technician_department_id": "infra"},
+    ]
+    engine = engine_with({"ana": 0, "bea": 1, "carl": 2}, {"bea": "infra", "carl": "field"}, rules)
+
+    assert engine.pick("network", "sales")['id'] == "carl"
+    assert engine.pick("network", "finance")['id'] == "bea"
+
+
+def test_empty_affinity_pool_falls_back_to_everyone():
+    rules = [{"category_id": "network", "technician_department_id": "infra"}]
+    engine = engine_with({"ana": 3, "bea": 1}, rules=rules)
+
+    assert engine.pick("network") == {"id": "bea", "name": "Bea", "load": 1, "pool": None}
+
+
+def test_no_technicians_means_no_pick():
+    assert server.AssignmentEngine().pick("network", "sales") is None
+
+
+def test_stale_heap_entries_are_compacted():
+    engine = engine_with({"ana": 0, "bea": 0})
+    for _ in range(200):
+        engine.adjust("ana", 1)
+
+    assert len(engine.heaps[None]) <= 4 * 2 + 64
+    assert engine.pick()['id'] == "bea"
+
+
+@pytest.fixture
+def auto_assign(monkeypatch):
+    monkeypatch.setattr(server, 'AUTO_ASSIGN_MODE', "on")
+
+
+def test_new_tickets_spread_across_technicians(auto_assign, client, make_user, make_ticket):
+    _, requester = make_user()
+    technicians = {make_user("tecnico")[0]['id'] for _ in range(3)}
+
+    assigned = [make_ticket(requester)['technician_id'] for _ in range(6)]
+
+    assert set(assigned) == technicians
+    assert {t['load'] for t in server.assignment_engine.snapshot()} == {2 * server.PRIORITY_WEIGHTS["baja"]}
+
+
+def test_ticket_stays_unassigned_without_technicians(auto_assign, make_user, make_ticket):
+    _, requester = make_user()
+
+    ticket = make_ticket(requester)
+
+    assert ticket['technician_id'] is None and ticket['assigned_at'] is None
+
+
+def test_rules_from_the_api_route_tickets_to_the_department(auto_assign, client, make_user, make_ticket, categories):
+    departments = client.get('/api/departments').json()
+    _, admin = make_user("admin")
+    make_user("tecnico")
+    specialist, _ = make_user("tecnico", department_id=departments[0]['id'])
+    rule = client.post('/api/assignment/rules', headers=admin, json={
+        "category_id": categories[0]['id'], "technician_department_id": departments[0]['id']
+    }).json()
+    _, requester = make_user()
+
+    assert all(make_ticket(requester)['technician_id'] == specialist['id'] for _ in range(3))
+    preview = client.get('/api/assignment/preview', headers=admin, params={"category_id": categories[0]['id']}).json()
+    assert preview['technician']['pool'] == departments[0]['id']
+
+    client.delete(f"/api/assignment/rules/{rule['id']}", headers=admin)
+    assert make_ticket(requester)['technician_id'] != specialist['id']
+
+
+def test_rebuild_recounts_loads_from_open_tickets(auto_assign, client, run, make_user, make_ticket):
+    _, admin = make_user("admin")
+    tech, _ = make_user("tecnico")
+    _, requester = make_user()
+    first, second = make_ticket(requester), make_ticket(requester)
+    client.put(f"/api/tickets/{first['id']}", json={"priority": "alta"}, headers=admin)
+    client.put(f"/api/tickets/{second['id']}", json={"status": "cerrado"}, headers=admin)
+    live = server.assignment_engine.snapshot()
+
+    run(server.rebuild_assignment_engine)
+
+    assert server.assignment_engine.snapshot() == live
+    assert live[0]['id'] == tech['id'] and live[0]['load'] == server.PRIORITY_WEIGHTS["alta"]
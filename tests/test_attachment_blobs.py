@@ -0,0 +1,111 @@
+"""Content-addressed attachments: one blob per digest, refcounts, and the blob collector"""
+
+import base64
+import hashlib
+
+import pytest
+
+import server
+
+REPORT = base64.b64encode(b"%PDF quarterly report" * 50).decode()
+PHOTO = base64.b64encode(b"\x89PNG broken screen" * 50).decode()
+
+
+@pytest.fixture
+def immediate_gc(monkeypatch):
+    monkeypatch.setattr(server, 'BLOB_GC_GRACE_MINUTES', 0)
+    monkeypatch.setattr(server, 'GC_PAUSE_SECONDS', 0)
+    monkeypatch.setattr(server, 'RESTORE_WINDOW_HOURS', 0)
+
+
+def digest_of(file_data: str) -> str:
+    return hashlib.sha256(base64.b64decode(file_data)).hexdigest()
+
+
+def blob(run, file_data: str) -> dict:
+    return run(lambda: server.db.attachment_blobs.find_one({"digest": digest_of(file_data)}, {"_id": 0, "data": 0}))
+
+
+def with_file(filename: str, file_data: str) -> dict:
+    return {"attachments": [{"filename": filename, "file_data": file_data}]}
+
+
+def purge(client, run, admin_headers, *ticket_ids):
+    """Soft-delete, then let the collector purge the tickets with their attachment rows"""
+    for ticket_id in ticket_ids:
+        assert client.delete(f"/api/tickets/{ticket_id}", headers=admin_headers).status_code == 200
+    run(server.collect_deleted_tickets)
+
+
+def test_identical_uploads_share_one_blob(client, run, make_user, make_ticket):
+    _, headers = make_user()
+    tickets = [make_ticket(headers, **with_file("report.pdf", REPORT)) for _ in range(3)]
+    response = client.post(f"/api/tickets/{tickets[0]['id']}/attachments", headers=headers,
+                           params={"filename": "screen.png", "file_data": PHOTO})
+    assert response.status_code == 200, response.text
+
+    assert run(lambda: server.db.attachment_blobs.count_documents({})) == 2
+    assert blob(run, REPORT)['refcount'] == 3
+    assert blob(run, PHOTO)['refcount'] == 1
+    rows = run(lambda: server.db.attachments.find({}, {"_id": 0}).to_list(None))
+    assert all("file_data" not in row and row['digest'] for row in rows)
+
+    detail = client.get(f"/api/tickets/{tickets[0]['id']}", headers=headers,
+                        params={"fields": "attachments.filename,attachments.file_data"}).json()
+    assert sorted((a['filename'], a['file_data']) for a in detail['attachments']) == [
+        ("report.pdf", REPORT), ("screen.png", PHOTO)
+    ]
+
+
+def test_corrupted_blob_is_flagged_not_served(client, run, make_user, make_ticket):
+    _, headers = make_user()
+    ticket = make_ticket(headers, **with_file("report.pdf", REPORT))
+    run(lambda: server.db.attachment_blobs.update_one({"digest": digest_of(REPORT)}, {"$set": {"data": b"tampered"}}))
+
+    detail = client.get(f"/api/tickets/{ticket['id']}", headers=headers, params={"fields": "attachments.file_data"}).json()
+
+    assert detail['attachments'][0]['file_data'] is None
+    assert detail['attachments'][0]['corrupted'] is True
+
+
+def test_purge_releases_references_and_gc_keeps_shared_blobs(immediate_gc, client, run, make_user, make_ticket):
+    _, headers = make_user()
+    _, admin = make_user("admin")
+    shared_a = make_ticket(headers, **with_file("report.pdf", REPORT))
+    shared_b = make_ticket(headers, **with_file("report.pdf", REPORT))
+    alone = make_ticket(headers, **with_file("screen.png", PHOTO))
+
+    purge(client, run, admin, shared_a['id'], alone['id'])
+
+    assert blob(run, REPORT)['refcount'] == 1 and "unreferenced_at" not in blob(run, REPORT)
+    assert blob(run, PHOTO)['refcount'] == 0 and blob(run, PHOTO)['unreferenced_at']
+    assert run(server.collect_unreferenced_blobs) == 1
+    assert blob(run, PHOTO) is None
+    assert run(lambda: server.db.attachment_jobs.find_one({"digest": digest_of(PHOTO)})) is None
+    detail = client.get(f"/api/tickets/{shared_b['id']}", headers=headers, params={"fields": "attachments.file_data"}).json()
+    assert detail['attachments'][0]['file_data'] == REPORT
+
+
+def test_upload_revives_an_unreferenced_blob_before_gc(immediate_gc, client, run, make_user, make_ticket):
+    _, headers = make_user()
+    _, admin = make_user("admin")
+    purge(client, run, admin, make_ticket(headers, **with_file("screen.png", PHOTO))['id'])
+    assert blob(run, PHOTO)['refcount'] == 0
+
+    make_ticket(headers, **with_file("again.png", PHOTO))
+
+    assert blob(run, PHOTO)['refcount'] == 1 and "unreferenced_at" not in blob(run, PHOTO)
+    assert run(server.collect_unreferenced_blobs) == 0
+
+
+def test_gc_repairs_a_drifted_refcount_instead_of_deleting(immediate_gc, client, run, make_user, make_ticket):
+    _, headers = make_user()
+    make_ticket(headers, **with_file("report.pdf", REPORT))
+    make_ticket(headers, **with_file("report.pdf", REPORT))
+    run(lambda: server.db.attachment_blobs.update_one(
+        {"digest": digest_of(REPORT)}, {"$set": {"refcount": 0, "unreferenced_at": "2000-01-01T00:00:00+00:00"}}
+    ))
+
+    assert run(server.collect_unreferenced_blobs) == 0
+    assert blob(run, REPORT)['refcount'] == 2
+    assert "unreferenced_at" not in blob(run, REPORT)
@@ -0,0 +1,77 @@
+"""Attachment jobs on the process pool: a stuck child is killed and the job retried on a fresh pool"""
+
+import base64
+import time
+
+import pytest
+
+import attachment_processing
+import server
+
+REPORT = base64.b64encode(b"%PDF-1.4 quarterly report" * 50).decode()
+
+
+def stuck(content: bytes) -> dict:
+    time.sleep(60)
+    return {}
+
+
+@pytest.fixture
+def pools(monkeypatch):
+    """The tracking context of every pool the jobs start"""
+    contexts = []
+    get_attachment_pool = server.get_attachment_pool
+
+    def recording():
+        pool = get_attachment_pool()
+        if server.attachment_pool_context not in contexts:
+            contexts.append(server.attachment_pool_context)
+        return pool
+
+    monkeypatch.setattr(server, 'get_attachment_pool', recording)
+    monkeypatch.setattr(server, 'ATTACHMENT_WORKERS', 1)
+    yield contexts
+    server.shutdown_attachment_pool(terminate=True)
+
+
+def job_status(run) -> dict:
+    return run(lambda: server.db.attachment_jobs.find_one({}, {"_id": 0, "status": 1, "attempts": 1}))
+
+
+def test_timed_out_job_kills_its_child_and_retries_on_a_new_pool(monkeypatch, pools, run, make_user, make_ticket):
+    _, headers = make_user()
+    make_ticket(headers, attachments=[{"filename": "report.pdf", "file_data": REPORT}])
+    monkeypatch.setattr(server, 'ATTACHMENT_JOB_TIMEOUT_SECONDS', 0.5)
+    process_attachment = attachment_processing.process_attachment
+    monkeypatch.setattr(attachment_processing, 'process_attachment', stuck)
+
+    assert run(server.process_attachment_jobs) == {"retried": 1}
+
+    assert server.attachment_pool is None
+    (first,) = pools
+    for process in first.processes:
+        process.join(5)
+        assert not process.is_alive()
+    assert job_status(run) == {"status": "pending", "attempts": 1}
+
+    # The next pool forks its children with the real processing function
+    monkeypatch.setattr(attachment_processing, 'process_attachment', process_attachment)
+    run(lambda: server.db.attachment_jobs.update_many({}, {"$set": {"run_after": "2000-01-01T00:00:00+00:00"}}))
+    assert run(server.process_attachment_jobs) == {"processed": 1}
+    assert len(pools) == 2 and pools[1] is not first
+    assert job_status(run) is None
+    blob = run(lambda: server.db.attachment_blobs.find_one({}, {"_id": 0, "mime_type": 1}))
+    assert blob['mime_type'] == "application/pdf"
+
+
+def test_plain_shutdown_drops_the_pool(pools):
+    pool = server.get_attachment_pool()
+    assert pool.submit(pow, 2, 10).result(timeout=10) == 1024
+    (context,) = pools
+
+    server.shutdown_attachment_pool()
+
+    assert server.attachment_pool is None and server.attachment_pool_context is None
+    for process in context.processes:
+        process.join(5)
+        assert not process.is_alive()  # idle children exit on their own once the pool shuts down
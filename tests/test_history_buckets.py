@@ -0,0 +1,80 @@
+"""Ticket history buckets: rollover when full, paging across buckets, legacy migration"""
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def small_buckets(monkeypatch):
+    monkeypatch.setattr(server, 'HISTORY_BUCKET_SIZE', 3)
+
+
+def bucket_counts(run, ticket_id):
+    buckets = run(lambda: server.db.ticket_history_buckets.find({"ticket_id": ticket_id}).sort("first_at", 1).to_list(None))
+    return [(bucket['count'], len(bucket['events'])) for bucket in buckets]
+
+
+def test_full_bucket_rolls_over_into_a_new_one(small_buckets, run, make_user, make_ticket):
+    user, headers = make_user()
+    ticket = make_ticket(headers)  # "Ticket creado" is the first event
+    for i in range(7):
+        run(server.append_history, ticket['id'], user['id'], f"step {i}")
+
+    assert bucket_counts(run, ticket['id']) == [(3, 3), (3, 3), (2, 2)]
+
+
+def test_history_pages_across_buckets_newest_first(small_buckets, client, run, make_user, make_ticket):
+    user, headers = make_user()
+    ticket = make_ticket(headers)
+    for i in range(7):
+        run(server.append_history, ticket['id'], user['id'], f"step {i}")
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"before": cursor} if cursor else {})}
+        page = client.get(f"/api/tickets/{ticket['id']}/history", params=params, headers=headers).json()
+        seen += page['items']
+        cursor = page['next_cursor']
+        if not cursor:
+            break
+
+    assert [e['action'] for e in seen] == [f"step {i}" for i in reversed(range(7))] + ["Ticket creado con prioridad baja"]
+    assert len({e['id'] for e in seen}) == 8
+    detail = client.get(f"/api/tickets/{ticket['id']}", headers=headers).json()
+    assert detail['history_total'] == 8
+    assert detail['history'][0]['action'] == "step 6"
+
+
+def test_after_cursor_reads_forward_in_time(small_buckets, client, run, make_user, make_ticket):
+    user, headers = make_user()
+    ticket = make_ticket(headers)
+    for i in range(5):
+        run(server.append_history, ticket['id'], user['id'], f"step {i}")
+    newest_first = client.get(f"/api/tickets/{ticket['id']}/history", headers=headers).json()['items']
+    pivot = newest_first[3]
+
+    page = client.get(f"/api/tickets/{ticket['id']}/history", headers=headers,
+                      params={"after": server.encode_cursor(pivot['timestamp'], pivot['id'])}).json()
+
+    assert [e['id'] for e in page['items']] == [e['id'] for e in reversed(newest_first[:3])]
+
+
+def test_legacy_history_migrates_once_into_closed_buckets(small_buckets, run):
+    base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    legacy = [{"id": f"h{i}", "ticket_id": "t1", "user_id": "system", "action": f"a{i}",
+               "timestamp": (base + timedelta(minutes=i)).isoformat()} for i in range(5)]
+    run(lambda: server.db.ticket_history.insert_many(legacy))
+
+    run(server.migrate_history_to_buckets)
+    run(server.migrate_history_to_buckets)  # an interrupted run is simply repeated
+
+    assert run(lambda: server.db.ticket_history.count_documents({})) == 0
+    assert bucket_counts(run, "t1") == [(3, 3), (3, 2)]  # closed: count is the bucket size
+    run(server.append_history, "t1", "system", "new")
+    assert bucket_counts(run, "t1") == [(3, 3), (3, 2), (1, 1)]
+    docs, has_more = run(server.fetch_history_entries, "ticket_history_buckets", "t1", 3)
+    assert [d['action'] for d in docs] == ["new", "a4", "a3"] and has_more
+    assert run(server.count_history_entries, "ticket_history_buckets", "t1") == 6
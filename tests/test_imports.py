@@ -0,0 +1,160 @@
+"""Streaming imports: line splitting across chunks, CSV/NDJSON per-line errors, batch boundaries"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import server
+
+CSV = {"Content-Type": "text/csv"}
+NDJSON = {"Content-Type": "application/x-ndjson"}
+
+
+def body(*chunks: bytes):
+    """A request whose body arrives in the given chunks"""
+    async def stream():
+        for chunk in chunks:
+            yield chunk
+    return SimpleNamespace(stream=stream)
+
+
+def collect(records) -> list:
+    async def scenario():
+        return [record async for record in records]
+    return asyncio.run(scenario())
+
+
+def parse(parser, *chunks: bytes) -> list:
+    return collect(parser(server.stream_lines(body(*chunks))))
+
+
+def test_lines_survive_any_chunking():
+    text = "﻿name,type\r\nCafé,printer\r\nÜber,laptop".encode("utf-8")
+    expected = [(1, "name,type"), (2, "Café,printer"), (3, "Über,laptop")]
+
+    for size in (1, 2, 3, 7, len(text)):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert collect(server.stream_lines(body(*chunks))) == expected
+
+
+def test_trailing_newline_adds_no_empty_line():
+    assert collect(server.stream_lines(body(b"a\nb\n"))) == [(1, "a"), (2, "b")]
+    assert collect(server.stream_lines(body(b"a\nb"))) == [(1, "a"), (2, "b")]
+    assert collect(server.stream_lines(body())) == []
+
+
+def test_csv_reports_bad_rows_by_line():
+    rows = parse(server.csv_records, b'Name, Serial_Number\n\nprinter,S1\nlaptop,S2,extra\n"desk\nphone",S3\nlast,S4')
+
+    assert rows == [
+        (3, {"name": "printer", "serial_number": "S1"}, None),
+        (4, None, "Expected 2 columns, got 3"),
+        (5, {"name": "desk\nphone", "serial_number": "S3"}, None),  # reported where the quoted field starts
+        (7, {"name": "last", "serial_number": "S4"}, None),
+    ]
+
+
+def test_csv_unterminated_quote_at_the_end_is_still_a_row():
+    rows = parse(server.csv_records, b'name,serial_number\n"open,S1')
+
+    assert [(line, fields) for line, fields, _ in rows] == [(2, {"name": "open,S1"})]
+
+
+def test_ndjson_reports_bad_lines():
+    rows = parse(server.ndjson_records, b'{"name": "a"}\n{oops\n\n[1, 2]\n{"name": "b"}')
+
+    assert [(line, fields) for line, fields, _ in rows] == [(1, {"name": "a"}), (2, None), (4, None), (5, {"name": "b"})]
+    assert rows[1][2].startswith("Invalid JSON") and rows[2][2] == "Expected a JSON object"
+
+
+def run_rows(records, batch_size: int) -> tuple:
+    batches = []
+
+    def parse_row(fields):
+        if fields.get("bad"):
+            raise ValueError("bad row")
+        return fields
+
+    async def write_batch(batch, report):
+        batches.append([line for line, _ in batch])
+
+    async def scenario():
+        return await server.run_import(records, parse_row, write_batch, batch_size, server.new_import_report())
+
+    return asyncio.run(scenario()), batches
+
+
+async def records_of(rows):
+    for row in rows:
+        yield row
+
+
+def test_run_import_writes_full_batches_then_the_rest():
+    rows = [(line, {"n": line}, None) for line in range(1, 6)]
+
+    report, batches = run_rows(records_of(rows), 2)
+
+    assert batches == [[1, 2], [3, 4], [5]]
+    assert (report['rows'], report['failed']) == (5, 0)
+
+
+def test_failed_rows_do_not_count_towards_a_batch():
+    rows = [(1, {"n": 1}, None), (2, None, "Invalid JSON"), (3, {"bad": True}, None), (4, {"n": 4}, None)]
+
+    report, batches = run_rows(records_of(rows), 2)
+
+    assert batches == [[1, 4]]
+    assert report['errors'] == [{"line": 2, "error": "Invalid JSON"}, {"line": 3, "error": "bad row"}]
+
+
+def test_errors_beyond_the_cap_are_counted_but_not_listed(monkeypatch):
+    monkeypatch.setattr(server, 'IMPORT_MAX_ERRORS', 2)
+    rows = [(line, None, "broken") for line in range(1, 6)]
+
+    report, batches = run_rows(records_of(rows), 2)
+
+    assert batches == [] and report['failed'] == 5
+    assert len(report['errors']) == 2 and report['errors_truncated'] is True
+
+
+def test_invalid_utf8_stops_the_import_after_what_was_read():
+    # The rows ahead of the bad bytes share their chunk and are still imported
+    records = server.ndjson_records(server.stream_lines(body(b'{"n": 1}\n{"n": 2}\n\xff\xfe oops\n{"n": 4}\n')))
+
+    report, batches = run_rows(records, 10)
+
+    assert batches == [[1, 2]]
+    assert report['errors'] == [{"line": 3, "error": "Not valid UTF-8; the rest of the file was not imported"}]
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user("admin")[1]
+
+
+def test_equipment_import_streams_csv_in_batches(monkeypatch, client, admin):
+    monkeypatch.setattr(server, 'EQUIPMENT_IMPORT_BATCH_SIZE', 2)
+    csv = (b"name,type,serial_number,user_id\n"
+           b"Printer,printer,S1,\n"
+           b"Laptop,laptop,,\n"              # line 3: no serial number
+           b"Desk,pc,S2,nobody\n"            # line 4: unknown user
+           b"Phone,phone,S3,\n"
+           b"Printer v2,printer,S1,")        # no trailing newline; updates S1 from an earlier batch
+
+    chunks = [csv[i:i + 5] for i in range(0, len(csv), 5)]
+    report = client.post('/api/equipments/import', content=iter(chunks), headers={**admin, **CSV}).json()
+
+    assert (report['rows'], report['inserted'], report['updated'], report['failed']) == (5, 2, 1, 2)
+    assert [error['line'] for error in report['errors']] == [3, 4]
+    names = {e['serial_number']: e['name'] for e in client.get('/api/equipments', headers=admin).json()['items']}
+    assert names == {"S1": "Printer v2", "S3": "Phone"}
+
+
+def test_equipment_import_accepts_ndjson_and_rejects_other_types(client, admin):
+    ndjson = b'{"name": "Router", "type": "network", "serial_number": "R1"}\n{"name": "Broken"}'
+
+    report = client.post('/api/equipments/import', content=ndjson, headers={**admin, **NDJSON}).json()
+
+    assert (report['inserted'], report['failed']) == (1, 1) and report['errors'][0]['line'] == 2
+    assert client.post('/api/equipments/import', content=b"[]", headers={**admin, "Content-Type": "application/json"}).status_code == 415
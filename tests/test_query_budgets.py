@@ -0,0 +1,79 @@
+"""Every route in QUERY_BUDGETS stays within its Mongo query budget, however much data it serves"""
+
+import pytest
+
+import server
+
+
+def assert_query_budget(response, max_queries: int):
+    """Fail when a response (served with DB_PROFILING=true) used too many queries"""
+    used = int(response.headers['X-DB-Queries'])
+    assert used <= max_queries, f"{used} Mongo queries issued, budget is {max_queries}"
+
+
+@pytest.fixture
+def busy_desk(client, make_user, make_ticket):
+    """Several requesters and technicians, tickets in every state, one long conversation"""
+    admin, admin_headers = make_user("admin")
+    technicians = [make_user("tecnico") for _ in range(3)]
+    requesters = [make_user("cliente") for _ in range(3)]
+    tickets = []
+    for i in range(9):
+        user, headers = requesters[i % 3]
+        ticket = make_ticket(headers, attachments=[{"filename": f"log{i}.txt", "file_data": "bG9n"}])
+        tech, tech_headers = technicians[i % 3]
+        update = {"technician_id": tech['id'], "status": "cerrado" if i % 2 else "en_proceso"}
+        assert client.put(f"/api/tickets/{ticket['id']}", json=update, headers=admin_headers).status_code == 200
+        tickets.append(ticket)
+    busy = tickets[0]
+    for i in range(server.DETAIL_EMBED_LIMIT + 5):
+        author_headers = technicians[i % 3][1] if i % 2 else requesters[0][1]
+        response = client.post(f"/api/tickets/{busy['id']}/comments", json={"comment": f"update {i}"}, headers=author_headers)
+        assert response.status_code == 200, response.text
+    for i in range(4):
+        client.post('/api/equipments', headers=admin_headers, json={
+            "name": f"Laptop {i}", "type": "laptop", "serial_number": f"SN-{i}", "user_id": requesters[i % 3][0]['id']
+        })
+    return {"ticket": busy, "admin": admin_headers, "technician": technicians[0][1], "requester": requesters[0][1]}
+
+
+ROUTES = {
+    "GET /api/tickets": ("admin", "/api/tickets"),
+    "GET /api/tickets/{ticket_id}": ("technician", "/api/tickets/{ticket_id}"),
+    "GET /api/tickets/my-assigned": ("technician", "/api/tickets/my-assigned"),
+    "GET /api/tickets/my-resolved": ("technician", "/api/tickets/my-resolved"),
+    "GET /api/tickets/{ticket_id}/comments": ("requester", "/api/tickets/{ticket_id}/comments"),
+    "GET /api/tickets/{ticket_id}/history": ("requester", "/api/tickets/{ticket_id}/history"),
+    "GET /api/equipments": ("admin", "/api/equipments?limit=2"),
+}
+
+
+def test_every_budget_is_exercised():
+    assert set(ROUTES) == set(server.QUERY_BUDGETS)
+
+
+@pytest.mark.parametrize("route_key", sorted(ROUTES))
+def test_route_stays_within_query_budget(client, busy_desk, route_key):
+    role, url = ROUTES[route_key]
+    response = client.get(url.format(ticket_id=busy_desk['ticket']['id']), headers=busy_desk[role])
+
+    assert response.status_code == 200, response.text
+    assert_query_budget(response, server.QUERY_BUDGETS[route_key])
+
+
+def test_cached_ticket_list_skips_the_database(client, busy_desk):
+    first = client.get('/api/tickets', headers=busy_desk['admin'])
+    second = client.get('/api/tickets', headers=busy_desk['admin'])
+
+    assert second.json() == first.json()
+    assert int(second.headers['X-DB-Queries']) < int(first.headers['X-DB-Queries'])
+
+
+def test_strict_mode_rejects_a_route_over_budget(client, busy_desk, monkeypatch):
+    monkeypatch.setattr(server, 'DB_QUERY_BUDGET_STRICT', True)
+    monkeypatch.setitem(server.QUERY_BUDGETS, "GET /api/tickets/my-assigned", 0)
+
+    response = client.get('/api/tickets/my-assigned', headers=busy_desk['technician'])
+
+    assert response.status_code == 500
+    assert response.json()['detail'].startswith("Query budget exceeded")
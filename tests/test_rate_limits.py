@@ -0,0 +1,77 @@
+"""Auth throttling: token buckets in both stores, and the 429 the auth endpoints answer with"""
+
+import asyncio
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def store(request, db):
+    return server.MemoryRateLimitStore() if request.param == "memory" else server.MongoRateLimitStore(db.rate_limits)
+
+
+@pytest.fixture
+def throttled(monkeypatch, store):
+    """Rate limiting on, with small buckets: 3 logins per email, plenty per IP"""
+    monkeypatch.setattr(server, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setattr(server, 'rate_limit_store', store)
+    monkeypatch.setattr(server, 'RATE_LIMITS', {**server.RATE_LIMITS, "login:email": (3, 3 / 60), "login:ip": (100, 1)})
+
+
+def take_all(store, key: str, attempts: int, capacity: int = 3, refill_per_second: float = 20) -> list:
+    async def scenario():
+        return [await store.take(key, capacity, refill_per_second) for _ in range(attempts)]
+    return asyncio.run(scenario())
+
+
+def test_bucket_empties_after_its_capacity(store):
+    waits = take_all(store, "k", 5)
+
+    assert waits[:3] == [0, 0, 0]
+    assert all(0 < wait <= 1 / 20 for wait in waits[3:])
+
+
+def test_tokens_refill_over_time(store):
+    take_all(store, "k", 3)
+    time.sleep(0.11)  # two tokens at 20 per second
+
+    assert [wait > 0 for wait in take_all(store, "k", 3)] == [False, False, True]
+
+
+def test_each_key_has_its_own_bucket(store):
+    take_all(store, "a", 3)
+
+    assert take_all(store, "a", 1)[0] > 0
+    assert take_all(store, "b", 3) == [0, 0, 0]
+
+
+def test_memory_store_forgets_the_least_recently_used_keys():
+    store = server.MemoryRateLimitStore(max_keys=2)
+    for key in ("a", "b", "c"):
+        take_all(store, key, 1)
+
+    assert list(store.buckets) == ["b", "c"]
+
+
+def login(client, email: str):
+    return client.post('/api/auth/login', json={"email": email, "password": "wrong"})
+
+
+def test_login_answers_429_with_retry_after(throttled, client):
+    statuses = [login(client, "victim@example.com").status_code for _ in range(3)]
+    blocked = login(client, "victim@example.com")
+
+    assert statuses == [401] * 3
+    assert blocked.status_code == 429
+    assert 1 <= int(blocked.headers['Retry-After']) <= 20
+    assert login(client, "Victim@Example.com").status_code == 429  # counted per address, not per spelling
+    assert login(client, "someone-else@example.com").status_code == 401
+
+
+def test_disabled_rate_limit_never_throttles(client, monkeypatch, store):
+    monkeypatch.setattr(server, 'rate_limit_store', store)
+
+    assert all(login(client, "victim@example.com").status_code == 401 for _ in range(8))
@@ -0,0 +1,144 @@
+"""Report rollups: after every kind of ticket change the buckets equal a recount of the tickets"""
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(server, 'CHANGES_SETTLE_SECONDS', 0)
+
+
+@pytest.fixture
+def desk(client, make_user, make_ticket):
+    departments = client.get('/api/departments').json()
+    _, admin = make_user("admin")
+    sales, sales_headers = make_user("cliente", department_id=departments[0]['id'])
+    _, walk_in = make_user("cliente")
+    tickets = [make_ticket(sales_headers) for _ in range(3)] + [make_ticket(walk_in)]
+    # Technicians join after the tickets exist, so nothing was auto-assigned
+    first, _ = make_user("tecnico")
+    second, _ = make_user("tecnico")
+    return {"admin": admin, "tickets": tickets, "techs": [first['id'], second['id']]}
+
+
+def recount(run) -> dict:
+    """{(dimension, key, day): counters} computed straight from the live tickets"""
+    tickets = run(lambda: server.db.tickets.find({"deleted_at": None}, {"_id": 0}).to_list(None))
+    users = run(lambda: server.db.users.find({}, {"_id": 0, "id": 1, "department_id": 1}).to_list(None))
+    departments = {u['id']: u.get('department_id') for u in users}
+    expected = {}
+    for ticket in tickets:
+        created_at = datetime.fromisoformat(ticket['created_at'])
+        events = [("created", created_at)]
+        if ticket.get('assigned_at'):
+            events.append(("assigned", datetime.fromisoformat(ticket['assigned_at'])))
+        if ticket['status'] == "cerrado":
+            events.append(("closed", datetime.fromisoformat(ticket['closed_at'])))
+        keys = {"all": "all", "category": ticket['category_id'], "department": departments[ticket['user_id']],
+                "technician": ticket.get('technician_id'), "priority": ticket['priority']}
+        for event, at in events:
+            counters = Counter({event: 1})
+            if event != "created":
+                minutes = round((at - created_at).total_seconds() / 60, 1)
+                counters[f"{event}_minutes"] = minutes
+                counters[f"{event}_hist.{server.duration_bin(minutes)}"] = 1
+            for dimension, key in keys.items():
+                if key:
+                    expected.setdefault((dimension, key, at.date().isoformat()), Counter()).update(counters)
+    return expected
+
+
+def rolled_up(run) -> dict:
+    buckets = run(lambda: server.db.report_buckets.find({}, {"_id": 0}).to_list(None))
+    totals = {}
+    for bucket in buckets:
+        counters = Counter({name: value for name, value in server.flatten_bucket(bucket).items() if value})
+        if counters:
+            totals[(bucket['dimension'], bucket['key'], bucket['day'])] = counters
+    return totals
+
+
+def assert_matches_recount(run):
+    run(server.update_report_rollups)
+    expected, actual = recount(run), rolled_up(run)
+    assert set(actual) == set(expected)
+    for bucket, counters in expected.items():
+        assert set(actual[bucket]) == set(counters), bucket
+        for name, value in counters.items():
+            assert actual[bucket][name] == pytest.approx(value), (bucket, name)
+
+
+def backdate(run, ticket_id: str, hours: float):
+    """Move creation into the past so durations land in real histogram bins"""
+    created_at = (datetime.now(timezone.utc) - timedelta(hours=hours)).isoformat()
+    run(lambda: server.db.tickets.update_one({"id": ticket_id}, {"$set": {"created_at": created_at}}))
+
+
+def test_buckets_follow_create_resolve_reopen_and_reassign(client, run, desk):
+    admin, tickets, (first, second) = desk['admin'], desk['tickets'], desk['techs']
+    assert_matches_recount(run)
+
+    for ticket, hours in zip(tickets, (3, 30, 0.5)):
+        backdate(run, ticket['id'], hours)
+        client.put(f"/api/tickets/{ticket['id']}", json={"technician_id": first}, headers=admin)
+    assert_matches_recount(run)
+
+    for ticket in tickets[:2]:
+        client.put(f"/api/tickets/{ticket['id']}", json={"status": "cerrado", "priority": "alta"}, headers=admin)
+    assert_matches_recount(run)
+
+    client.put(f"/api/tickets/{tickets[0]['id']}", json={"status": "abierto"}, headers=admin)
+    assert_matches_recount(run)
+
+    client.put(f"/api/tickets/{tickets[1]['id']}", json={"technician_id": second}, headers=admin)
+    assert_matches_recount(run)
+
+    client.delete(f"/api/tickets/{tickets[2]['id']}", headers=admin)
+    assert_matches_recount(run)
+
+
+def test_a_second_run_without_changes_is_a_no_op(client, run, desk):
+    ticket = desk['tickets'][0]
+    client.put(f"/api/tickets/{ticket['id']}", json={"technician_id": desk['techs'][0]}, headers=desk['admin'])
+    assert run(server.update_report_rollups) == len(desk['tickets'])
+    before = rolled_up(run)
+
+    assert run(server.update_report_rollups) == 0
+    run(server.rebuild_report_rollups)
+    assert rolled_up(run) == before
+
+
+def test_report_endpoints_read_the_buckets(client, run, desk):
+    admin, tickets, (first, second) = desk['admin'], desk['tickets'], desk['techs']
+    backdate(run, tickets[0]['id'], 3)
+    client.put(f"/api/tickets/{tickets[0]['id']}", json={"technician_id": first, "status": "cerrado", "priority": "alta"},
+               headers=admin)
+    client.put(f"/api/tickets/{tickets[1]['id']}", json={"technician_id": second}, headers=admin)
+    run(server.update_report_rollups)
+
+    summary = client.get('/api/reports/summary', headers=admin).json()
+    assert (summary['created'], summary['assigned'], summary['closed']) == (4, 2, 1)
+    assert summary['rolled_up_to']
+    assert summary['time_to_close']['mean_hours'] == pytest.approx(3.0, abs=0.01)
+
+    by_technician = {row['key']: row for row in client.get('/api/reports/technician', headers=admin).json()['rows']}
+    assert set(by_technician) == {first, second}
+    assert (by_technician[first]['closed'], by_technician[second]['closed']) == (1, 0)
+
+    days = client.get('/api/reports/daily', headers=admin, params={"dimension": "priority", "key": "baja"}).json()['days']
+    assert sum(day['created'] for day in days) == 3  # the closed ticket moved to its own priority
+
+
+def test_reports_validate_their_input(client, make_user):
+    _, admin = make_user("admin")
+    _, requester = make_user("cliente")
+
+    assert client.get('/api/reports/summary', headers=requester).status_code == 403
+    assert client.get('/api/reports/colour', headers=admin).status_code == 400
+    assert client.get('/api/reports/summary', headers=admin, params={"from": "2024-02-01", "to": "2024-01-01"}).status_code == 400
+    assert client.get('/api/reports/summary', headers=admin, params={"from": "yesterday"}).status_code == 400
@@ -0,0 +1,142 @@
+"""Ticket list caching: writes invalidate the right scopes, coalesced loads survive cancellation"""
+
+import asyncio
+
+import pytest
+
+import server
+
+
+def served_from_cache(response) -> bool:
+    """A cached list only costs the auth lookup"""
+    return int(response.headers['X-DB-Queries']) == 1
+
+
+@pytest.fixture
+def desk(make_user, make_ticket):
+    _, alice = make_user("cliente")
+    _, bob = make_user("cliente")
+    _, staff = make_user("tecnico")
+    _, admin = make_user("admin")
+    ticket = make_ticket(alice)
+    return {"alice": alice, "bob": bob, "staff": staff, "admin": admin, "ticket": ticket}
+
+
+def test_second_read_is_served_from_cache(client, desk):
+    first = client.get('/api/tickets', headers=desk['staff'])
+    second = client.get('/api/tickets', headers=desk['staff'])
+
+    assert not served_from_cache(first)
+    assert served_from_cache(second)
+    assert second.json() == first.json()
+
+
+def test_new_ticket_invalidates_staff_and_its_requester_only(client, desk, make_ticket):
+    for who in ("alice", "bob", "staff"):
+        client.get('/api/tickets', headers=desk[who])
+
+    make_ticket(desk['alice'])
+
+    alice = client.get('/api/tickets', headers=desk['alice'])
+    staff = client.get('/api/tickets', headers=desk['staff'])
+    bob = client.get('/api/tickets', headers=desk['bob'])
+    assert len(alice.json()) == 2 and not served_from_cache(alice)
+    assert len(staff.json()) == 2 and not served_from_cache(staff)
+    assert bob.json() == [] and served_from_cache(bob)
+
+
+def test_update_and_delete_are_visible_on_the_next_read(client, desk):
+    ticket_id = desk['ticket']['id']
+    client.get('/api/tickets', headers=desk['alice'])
+    client.get('/api/tickets', headers=desk['staff'])
+
+    client.put(f"/api/tickets/{ticket_id}", json={"priority": "alta"}, headers=desk['admin'])
+    assert client.get('/api/tickets', headers=desk['alice']).json()[0]['priority'] == "alta"
+
+    client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+    assert client.get('/api/tickets', headers=desk['staff']).json() == []
+
+
+def test_version_counters_survive_lru_eviction():
+    cache = server.MemoryResponseCache(max_entries=1)
+
+    async def scenario():
+        await cache.incr("v")
+        await cache.set("a", b"1", 60)
+        await cache.set("b", b"2", 60)
+        return await cache.get_many(["v", "a", "b"])
+
+    assert asyncio.run(scenario()) == [b"1", None, b"2"]
+
+
+def test_follower_gets_the_result_when_the_first_caller_is_cancelled():
+    flight = server.SingleFlight()
+    computed = []
+
+    async def scenario():
+        started = asyncio.Event()
+
+        async def compute():
+            started.set()
+            await asyncio.sleep(0.05)
+            computed.append(1)
+            return b"body"
+
+        leader = asyncio.create_task(flight.do("k", compute))
+        await started.wait()
+        follower = asyncio.create_task(flight.do("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower, await asyncio.gather(leader, return_exceptions=True)
+
+    body, (leader_outcome,) = asyncio.run(scenario())
+    assert body == b"body"
+    assert isinstance(leader_outcome, asyncio.CancelledError)
+    assert computed == [1]
+    assert flight._inflight == {}
+
+
+def test_errors_reach_every_caller_and_free_the_key():
+    flight = server.SingleFlight()
+
+    async def scenario():
+        async def compute():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        return await asyncio.gather(flight.do("k", compute), flight.do("k", compute), return_exceptions=True)
+
+    outcomes = asyncio.run(scenario())
+    assert [type(outcome) for outcome in outcomes] == [ValueError, ValueError]
+    assert flight._inflight == {}
+
+
+def test_redis_cache_closes_the_loop_connections():
+    """Scheduler jobs run on short-lived loops; their sockets must not outlive them"""
+    open_connections = set()
+
+    async def serve(reader, writer):
+        open_connections.add(writer)
+        try:
+            while line := await reader.readline():
+                for _ in range(int(line[1:-2])):  # *<n> then $<len>/<data> per argument
+                    await reader.readline()
+                    await reader.readline()
+                writer.write(b":1\r\n")
+                await writer.drain()
+        finally:
+            open_connections.discard(writer)
+
+    async def scenario():
+        redis = await asyncio.start_server(serve, "127.0.0.1", 0)
+        port = redis.sockets[0].getsockname()[1]
+        cache = server.RedisResponseCache(f"redis://127.0.0.1:{port}/0")
+        await asyncio.gather(cache.incr("a"), cache.incr("b"))
+        await asyncio.sleep(0.01)
+        before = len(open_connections)
+        await cache.close()
+        await asyncio.sleep(0.01)
+        redis.close()
+        return before, len(open_connections), len(cache._idle)
+
+    assert asyncio.run(scenario()) == (2, 0, 0)
@@ -0,0 +1,91 @@
+"""Logout: per-session deletion, logout-all revoking JWTs by token version, legacy session migration"""
+
+from datetime import datetime, timedelta, timezone
+
+import server
+
+
+def bearer(token: str) -> dict:
+    return {"Authorization": f"Bearer {token}"}
+
+
+def login(client, user) -> dict:
+    response = client.post('/api/auth/login', json={"email": user['email'], "password": "secret123"})
+    assert response.status_code == 200, response.text
+    return bearer(response.json()['token'])
+
+
+def open_session(run, user, token: str, expires_in: timedelta = timedelta(days=7)):
+    """What /auth/session stores after a Google login"""
+    run(lambda: server.db.user_sessions.insert_one({
+        "user_id": user['id'], "token_hash": server.hash_session_token(token),
+        "expires_at": datetime.now(timezone.utc) + expires_in,
+    }))
+
+
+def me(client, headers) -> int:
+    return client.get('/api/auth/me', headers=headers).status_code
+
+
+def test_logout_all_revokes_every_jwt_and_session(client, run, make_user):
+    user, registered = make_user()
+    laptop, phone = login(client, user), login(client, user)
+    open_session(run, user, "google-token")
+    assert me(client, registered) == me(client, laptop) == me(client, bearer("google-token")) == 200
+
+    assert client.post('/api/auth/logout-all', headers=phone).status_code == 200
+
+    for headers in (registered, laptop, phone):
+        response = client.get('/api/auth/me', headers=headers)
+        assert response.status_code == 401 and response.json()['detail'] == "Token revoked"
+    assert me(client, bearer("google-token")) == 401
+    assert me(client, login(client, user)) == 200
+
+
+def test_logout_all_leaves_other_users_alone(client, make_user):
+    user, headers = make_user()
+    _, someone_else = make_user()
+
+    client.post('/api/auth/logout-all', headers=headers)
+
+    assert me(client, someone_else) == 200
+
+
+def test_logout_deletes_only_the_current_session(client, run, make_user):
+    user, jwt_headers = make_user()
+    open_session(run, user, "desktop-token")
+    open_session(run, user, "tablet-token")
+
+    assert client.post('/api/auth/logout', headers=bearer("desktop-token")).status_code == 200
+
+    assert me(client, bearer("desktop-token")) == 401
+    assert me(client, bearer("tablet-token")) == 200
+    assert me(client, jwt_headers) == 200
+    assert run(lambda: server.db.user_sessions.count_documents({"user_id": user['id']})) == 1
+
+
+def test_expired_session_is_rejected_before_the_ttl_removes_it(client, run, make_user):
+    user, _ = make_user()
+    open_session(run, user, "stale-token", expires_in=timedelta(minutes=-1))
+
+    assert me(client, bearer("stale-token")) == 401
+
+
+def test_legacy_sessions_are_hashed_in_place(client, run, make_user):
+    user, _ = make_user()
+    future = (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+    past = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    run(lambda: server.db.user_sessions.insert_many([
+        {"user_id": user['id'], "session_token": "legacy-live", "expires_at": future},
+        {"user_id": user['id'], "session_token": "legacy-expired", "expires_at": past},
+        {"user_id": user['id'], "expires_at": future},  # no token at all: unusable
+    ]))
+
+    run(server.migrate_legacy_sessions)
+    run(server.migrate_legacy_sessions)  # already migrated sessions are left alone
+
+    assert run(lambda: server.db.user_sessions.count_documents({"token_hash": {"$exists": False}})) == 0
+    live = run(lambda: server.db.user_sessions.find_one({"token_hash": server.hash_session_token("legacy-live")}))
+    assert "session_token" not in live and isinstance(live['expires_at'], datetime)  # a date the TTL index can expire
+    assert me(client, bearer("legacy-live")) == 200
+    assert me(client, bearer("legacy-expired")) == 401
@@ -0,0 +1,103 @@
+"""Soft delete: hidden at once, restorable within the window, purged later by the collector"""
+
+import base64
+
+import pytest
+
+import server
+
+REPORT = base64.b64encode(b"%PDF quarterly report" * 50).decode()
+
+
+@pytest.fixture
+def desk(client, make_user, make_ticket):
+    _, requester = make_user("cliente")
+    _, admin = make_user("admin")
+    ticket = make_ticket(requester, attachments=[{"filename": "report.pdf", "file_data": REPORT}])
+    client.post(f"/api/tickets/{ticket['id']}/comments", json={"comment": "Any news?"}, headers=requester)
+    return {"requester": requester, "admin": admin, "ticket": ticket}
+
+
+@pytest.fixture
+def released(monkeypatch):
+    """Digests passed to release_blobs, which still runs"""
+    digests = []
+    release_blobs = server.release_blobs
+
+    async def recording(batch):
+        digests.extend(batch)
+        return await release_blobs(batch)
+
+    monkeypatch.setattr(server, 'release_blobs', recording)
+    return digests
+
+
+def listed_ids(client, headers) -> list:
+    return [t['id'] for t in client.get('/api/tickets', headers=headers).json()]
+
+
+def related_counts(run, ticket_id: str) -> dict:
+    return {name: run(lambda: server.db[server.HOT_COLLECTIONS[name]].count_documents({"ticket_id": ticket_id}))
+            for name in ("comments", "attachments", "ticket_history")}
+
+
+def test_deleted_ticket_disappears_from_every_read(client, desk):
+    ticket_id = desk['ticket']['id']
+    assert ticket_id in listed_ids(client, desk['requester'])
+
+    response = client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+
+    assert response.status_code == 200 and response.json()['restorable_for_hours'] == server.RESTORE_WINDOW_HOURS
+    assert listed_ids(client, desk['requester']) == listed_ids(client, desk['admin']) == []
+    assert client.get(f"/api/tickets/{ticket_id}", headers=desk['admin']).status_code == 404
+    assert client.put(f"/api/tickets/{ticket_id}", json={"priority": "alta"}, headers=desk['admin']).status_code == 404
+    assert client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin']).status_code == 404
+
+
+def test_restore_brings_the_ticket_back_untouched(client, run, desk):
+    ticket_id = desk['ticket']['id']
+    before = related_counts(run, ticket_id)
+    client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+
+    assert client.post(f"/api/tickets/{ticket_id}/restore", headers=desk['admin']).status_code == 200
+
+    assert listed_ids(client, desk['requester']) == [ticket_id]
+    assert related_counts(run, ticket_id) == before
+    doc = run(lambda: server.db.tickets.find_one({"id": ticket_id}))
+    assert "deleted_at" not in doc and "deleted_by" not in doc
+    assert client.post(f"/api/tickets/{ticket_id}/restore", headers=desk['admin']).status_code == 404
+
+
+def test_only_admins_delete_and_restore(client, make_user, desk):
+    _, technician = make_user("tecnico")
+    ticket_id = desk['ticket']['id']
+
+    assert client.delete(f"/api/tickets/{ticket_id}", headers=technician).status_code == 403
+    client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+    assert client.post(f"/api/tickets/{ticket_id}/restore", headers=desk['requester']).status_code == 403
+
+
+def test_collector_waits_for_the_restore_window(client, run, desk, released):
+    ticket_id = desk['ticket']['id']
+    client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+
+    assert run(server.collect_deleted_tickets) == {}
+    assert run(lambda: server.db.tickets.count_documents({"id": ticket_id})) == 1
+    assert released == []
+
+
+def test_collector_purges_expired_tickets_and_releases_their_blobs(monkeypatch, client, run, desk, released):
+    monkeypatch.setattr(server, 'RESTORE_WINDOW_HOURS', 0)
+    monkeypatch.setattr(server, 'GC_PAUSE_SECONDS', 0)
+    ticket_id = desk['ticket']['id']
+    digest = run(lambda: server.db.attachments.find_one({"ticket_id": ticket_id}))['digest']
+    client.delete(f"/api/tickets/{ticket_id}", headers=desk['admin'])
+
+    report = run(server.collect_deleted_tickets)
+
+    assert report == {"comments": 1, "attachments": 1, "ticket_history": 1, "tickets": 1}
+    assert run(lambda: server.db.tickets.count_documents({"id": ticket_id})) == 0
+    assert related_counts(run, ticket_id) == {"comments": 0, "attachments": 0, "ticket_history": 0}
+    assert released == [digest]
+    assert run(lambda: server.db.attachment_blobs.find_one({"digest": digest}))['refcount'] == 0
+    assert client.post(f"/api/tickets/{ticket_id}/restore", headers=desk['admin']).status_code == 404
@@ -0,0 +1,115 @@
+"""GET /api/tickets/changes: keyset cursor, tombstones, and every write path bumping updated_at"""
+
+import base64
+
+import pytest
+
+import server
+
+PHOTO = base64.b64encode(b"\x89PNG broken screen" * 50).decode()
+
+
+@pytest.fixture(autouse=True)
+def no_settle(monkeypatch):
+    monkeypatch.setattr(server, 'CHANGES_SETTLE_SECONDS', 0)
+
+
+def changes(client, headers, since=None, **params):
+    response = client.get('/api/tickets/changes', headers=headers, params={**params, **({"since": since} if since else {})})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_cursor_pages_through_every_ticket_once(client, make_user, make_ticket):
+    _, headers = make_user("admin")
+    created = [make_ticket(headers)['id'] for _ in range(5)]
+
+    seen, cursor = [], None
+    while True:
+        page = changes(client, headers, cursor, limit=2)
+        seen += [item['ticket']['id'] for item in page['items']]
+        cursor = page['cursor']
+        if not page['has_more']:
+            break
+
+    assert seen == created
+    assert changes(client, headers, cursor) == {"items": [], "cursor": cursor, "has_more": False}
+
+
+@pytest.mark.parametrize("since", ["not a cursor", base64.urlsafe_b64encode(b"no separator").decode()])
+def test_bad_cursor_is_rejected(client, make_user, since):
+    _, headers = make_user("admin")
+
+    assert client.get('/api/tickets/changes', headers=headers, params={"since": since}).status_code == 400
+
+
+def test_expired_cursor_asks_for_a_reload(client, make_user):
+    _, headers = make_user("admin")
+    since = server.encode_cursor("2000-01-01T00:00:00+00:00", "x")
+
+    assert client.get('/api/tickets/changes', headers=headers, params={"since": since}).status_code == 410
+
+
+def test_deleted_and_archived_tickets_leave_tombstones(client, run, make_user, make_ticket):
+    _, admin = make_user("admin")
+    deleted, archived, kept = (make_ticket(admin) for _ in range(3))
+    client.put(f"/api/tickets/{archived['id']}", json={"status": "cerrado"}, headers=admin)
+    cursor = changes(client, admin)['cursor']
+
+    client.delete(f"/api/tickets/{deleted['id']}", headers=admin)
+    assert run(server.archive_closed_tickets, 0)['tickets'] == 1
+
+    items = changes(client, admin, cursor)['items']
+    assert sorted((item['op'], item['id'], item['reason']) for item in items) == sorted([
+        ("delete", deleted['id'], "deleted"), ("delete", archived['id'], "archived")
+    ])
+    assert kept['id'] not in {item.get('id') for item in items}
+
+
+def test_clients_only_see_their_own_changes(client, make_user, make_ticket):
+    _, alice = make_user("cliente")
+    _, bob = make_user("cliente")
+    mine = make_ticket(alice)
+    make_ticket(bob)
+
+    assert [item['ticket']['id'] for item in changes(client, alice)['items']] == [mine['id']]
+
+
+def comment(client, ticket, people):
+    return client.post(f"/api/tickets/{ticket['id']}/comments", json={"comment": "Still jammed"}, headers=people['requester'])
+
+
+def attach(client, ticket, people):
+    return client.post(f"/api/tickets/{ticket['id']}/attachments", headers=people['requester'],
+                       params={"filename": "screen.png", "file_data": PHOTO})
+
+
+def update(client, ticket, people):
+    return client.put(f"/api/tickets/{ticket['id']}", json={"priority": "alta"}, headers=people['admin'])
+
+
+def claim(client, ticket, people):
+    return client.post('/api/queue/claim', headers=people['technician'])
+
+
+def restore(client, ticket, people):
+    return client.post(f"/api/tickets/{ticket['id']}/restore", headers=people['admin'])
+
+
+@pytest.mark.parametrize("write", [comment, attach, update, claim, restore])
+def test_every_write_path_brings_the_ticket_back_into_the_feed(client, run, make_user, make_ticket, write):
+    _, requester = make_user("cliente")
+    _, admin = make_user("admin")
+    ticket = make_ticket(requester)
+    if write is restore:
+        client.delete(f"/api/tickets/{ticket['id']}", headers=admin)
+    people = {"requester": requester, "admin": admin, "technician": make_user("tecnico")[1]}
+    before = run(lambda: server.db.tickets.find_one({"id": ticket['id']}))['updated_at']
+    cursor = changes(client, requester)['cursor']
+
+    assert write(client, ticket, people).status_code == 200
+
+    after = run(lambda: server.db.tickets.find_one({"id": ticket['id']}))['updated_at']
+    assert after > before
+    items = changes(client, requester, cursor)['items']
+    assert [(item['op'], item['ticket']['id']) for item in items] == [("upsert", ticket['id'])]
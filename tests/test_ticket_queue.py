@@ -0,0 +1,47 @@
+"""POST /api/queue/claim hands each unassigned ticket to exactly one technician"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+
+def test_concurrent_claims_never_share_a_ticket(client, make_user, make_ticket):
+    _, requester = make_user("cliente")
+    tickets = {make_ticket(requester)['id'] for _ in range(4)}
+    technicians = [make_user("tecnico") for _ in range(6)]
+
+    with ThreadPoolExecutor(max_workers=len(technicians)) as pool:
+        responses = list(pool.map(lambda tech: client.post('/api/queue/claim', headers=tech[1]), technicians))
+
+    claimed = [r.json() for r in responses if r.status_code == 200]
+    assert sorted(r.status_code for r in responses) == [200] * 4 + [404] * 2
+    assert {ticket['id'] for ticket in claimed} == tickets
+    owners = {tech['id'] for tech, _ in technicians}
+    assert all(ticket['technician_id'] in owners for ticket in claimed)
+    assert len({ticket['technician_id'] for ticket in claimed}) == 4
+
+
+def test_claim_takes_the_most_urgent_oldest_ticket_and_loads_the_engine(client, make_user, make_ticket):
+    admin, admin_headers = make_user("admin")
+    _, requester = make_user("cliente")
+    oldest_low, newer_low, urgent = (make_ticket(requester) for _ in range(3))
+    client.put(f"/api/tickets/{urgent['id']}", json={"priority": "alta"}, headers=admin_headers)
+    tech, tech_headers = make_user("tecnico")
+
+    first = client.post('/api/queue/claim', headers=tech_headers).json()
+    second = client.post('/api/queue/claim', headers=tech_headers).json()
+
+    assert [first['id'], second['id']] == [urgent['id'], oldest_low['id']]
+    loads = {t['id']: t['load'] for t in server.assignment_engine.snapshot()}
+    assert loads[tech['id']] == server.PRIORITY_WEIGHTS["alta"] + server.PRIORITY_WEIGHTS["baja"]
+    history = client.get(f"/api/tickets/{urgent['id']}/history", headers=tech_headers).json()['items']
+    assert history[0]['action'].startswith("Tomado de la cola")
+
+
+def test_only_technicians_claim(client, make_user, make_ticket):
+    _, requester = make_user("cliente")
+    make_ticket(requester)
+    _, admin_headers = make_user("admin")
+
+    assert client.post('/api/queue/claim', headers=requester).status_code == 403
+    assert client.post('/api/queue/claim', headers=admin_headers).status_code == 403
@@ -0,0 +1,113 @@
+"""Bulk provisioning: conflicts fail only their rows, and email uniqueness holds everywhere"""
+
+import pytest
+from mongomock_motor import AsyncMongoMockCollection
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+CSV = {"Content-Type": "text/csv"}
+
+
+@pytest.fixture
+def admin(make_user):
+    return make_user("admin")
+
+
+def provision(client, headers, body: str, content_type: dict = CSV):
+    return client.post('/api/users/bulk', content=body, headers={**headers, **content_type})
+
+
+def users_with(client, query: dict) -> int:
+    return client.portal.call(lambda: server.db.users.count_documents(query))
+
+
+def test_conflicting_rows_fail_alone(client, admin, make_user):
+    existing, _ = make_user("cliente")
+    department_id = client.get('/api/departments').json()[0]['id']
+    body = (
+        "email,name,password,role,department_id\n"
+        "ana@example.com,Ana,pw-ana,cliente,\n"                        # line 2
+        f"tomas@example.com,Tomas,pw-tomas,tecnico,{department_id}\n"   # line 3
+        f"{existing['email']},Taken,pw,cliente,\n"                      # line 4: already registered
+        "ana@example.com,Ana again,pw,cliente,\n"                      # line 5: repeated in the file
+        "nodept@example.com,Nobody,pw,cliente,missing-department\n"   # line 6
+        "norole@example.com,Nobody,pw,jefe,\n"                         # line 7
+        "nopass@example.com,Nobody,,cliente,\n"                        # line 8
+    )
+
+    report = provision(client, admin[1], body).json()
+
+    assert report['rows'] == 7 and report['created'] == 2 and report['failed'] == 5
+    errors = {error['line']: error['error'] for error in report['errors']}
+    assert sorted(errors) == [4, 5, 6, 7, 8]
+    assert errors[4] == errors[5] == "Email already registered"
+    assert "missing-department" in errors[6]
+    assert client.post('/api/auth/login', json={"email": "tomas@example.com", "password": "pw-tomas"}).status_code == 200
+    assert users_with(client, {"email": "ana@example.com"}) == 1
+    assert any(t['name'] == "Tomas" for t in server.assignment_engine.snapshot())
+
+
+def test_ndjson_rows_and_rerun_are_idempotent(client, admin):
+    body = '{"email":"n1@example.com","name":"N1","password":"a"}\n{"email":"n2@example.com","name":"N2","password":"b"}\n'
+    ndjson = {"Content-Type": "application/x-ndjson"}
+
+    first = provision(client, admin[1], body, ndjson).json()
+    again = provision(client, admin[1], body, ndjson).json()
+
+    assert (first['created'], first['failed']) == (2, 0)
+    assert (again['created'], again['failed']) == (0, 2)
+    assert users_with(client, {"email": {"$in": ["n1@example.com", "n2@example.com"]}}) == 2
+
+
+def test_only_admins_provision(client, make_user):
+    _, headers = make_user("tecnico")
+
+    assert provision(client, headers, "email,name,password\na@example.com,A,pw\n").status_code == 403
+
+
+def test_duplicate_legacy_emails_keep_the_index_off_and_provisioning_closed(client, run, admin):
+    run(lambda: server.db.users.drop_index("email_1"))
+    run(lambda: server.db.users.insert_many([
+        {"id": "legacy-1", "email": "twice@example.com", "name": "Old"},
+        {"id": "legacy-2", "email": "twice@example.com", "name": "Older"},
+    ]))
+
+    run(server.ensure_unique_emails)
+    assert run(server.email_index_ready) is False
+    assert provision(client, admin[1], "email,name,password\nx@example.com,X,pw\n").status_code == 503
+
+    run(lambda: server.db.users.delete_one({"id": "legacy-2"}))
+    run(server.ensure_unique_emails)
+    assert run(server.email_index_ready) is True
+    assert provision(client, admin[1], "email,name,password\nx@example.com,X,pw\n").json()['created'] == 1
+
+
+def test_google_signup_racing_another_signup_reuses_that_account(client, monkeypatch):
+    """The account is created between our lookup and our insert: log into that one"""
+    class SessionData:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {"email": "race@example.com", "name": "Racer", "session_token": "tok-123"}
+
+    monkeypatch.setattr("requests.get", lambda *args, **kwargs: SessionData())
+    insert_one = AsyncMongoMockCollection.insert_one
+    winner = {"id": "winner", "email": "race@example.com", "name": "First", "role": "cliente",
+              "status": "activo", "created_at": "2024-01-01T00:00:00+00:00"}
+
+    async def insert_after_a_concurrent_signup(self, doc, *args, **kwargs):
+        if self.name == "users" and doc.get('email') == winner['email']:
+            await insert_one(self, dict(winner))
+        return await insert_one(self, doc, *args, **kwargs)
+
+    monkeypatch.setattr(AsyncMongoMockCollection, 'insert_one', insert_after_a_concurrent_signup)
+
+    response = client.post('/api/auth/session', params={"session_id": "abc"})
+
+    assert response.status_code == 200, response.text
+    assert response.json()['user']['id'] == "winner"
+    assert users_with(client, {"email": "race@example.com"}) == 1
+    with pytest.raises(DuplicateKeyError):
+        client.portal.call(lambda: server.db.users.insert_one({"email": "race@example.com"}))